@@ -2,14 +2,17 @@ import os
 import pickle
 import warnings
 import itertools
+import multiprocessing
 import numpy as np
 import pandas as pd
 import seaborn as sns
 import category_encoders as ce
 import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
 from scipy.stats import chi2_contingency
 from sklearn.preprocessing import LabelEncoder
-from analyzer import calc_outliers_range
+from graphs import plot_style, show_figure
+from aggregates import histograms_2d
 
 
 def feature_histograms_analysis(df):
@@ -19,14 +22,13 @@ def feature_histograms_analysis(df):
 
     '''
 
-    def grid_plot_generator(x_data,  rows, cols, title, figsize=(20, 10), numerical=False):
+    def grid_plot_generator(x_data,  rows, cols, title, name, figsize=(20, 10), numerical=False):
         """
         Generates a rows x cols grid of plots for the given data where each plot is a bar chart.
         If data is numerical, it uses a histogram instead.
         """
         ### Set up plt grid
-        plt.style.use('dark_background')
-        plt.rcParams['figure.dpi'] = 200        # increase plot resolution
+        plot_style(dpi=200)        # increase plot resolution
         fig, axs = plt.subplots(nrows=rows, ncols=cols, figsize=figsize)
         
         ### For each column plot in the right subplot of the grid
@@ -59,14 +61,15 @@ def feature_histograms_analysis(df):
                        
         fig.suptitle(title, fontsize=18)
         fig.subplots_adjust(top=0.90)
+        show_figure(fig, name)
 
     warnings.filterwarnings('ignore')
 
     categ_col = [ col for col in df.columns if df[col].dtype == 'object' ]
     numeric_cols =[ col for col in df.columns if df[col].dtype == 'int64' or df[col].dtype =='float64']
    
-    grid_plot_generator(df[categ_col], 1+(len(categ_col)//2), 2, "Distribution of Nominal Columns", figsize=(25,100))
-    grid_plot_generator(df[numeric_cols], 1+(len(numeric_cols)//3), 3, "Distribution of Numerical Columns", figsize=(25,100), numerical=True)
+    grid_plot_generator(df[categ_col], 1+(len(categ_col)//2), 2, "Distribution of Nominal Columns", 'feature_histograms_nominal', figsize=(25,100))
+    grid_plot_generator(df[numeric_cols], 1+(len(numeric_cols)//3), 3, "Distribution of Numerical Columns", 'feature_histograms_numerical', figsize=(25,100), numerical=True)
 
 def plot_boxplots(df):
     '''
@@ -74,15 +77,14 @@ def plot_boxplots(df):
     '''
     numerical_columns = [ col for col in df.columns if df[col].dtype == 'int64' or df[col].dtype =='float64']
     # Impute missing arrival delays with their median
-    plt.style.use('dark_background')
-    plt.rcParams['figure.dpi'] = 300
-    plt.figure(figsize=(25, 100))
+    plot_style(dpi=300)
+    fig = plt.figure(figsize=(25, 100))
     for i, numerical_col in enumerate(numerical_columns):
         ax = plt.subplot(1+(len(numerical_columns)//3), 3, i+1)
         ax.boxplot(df.dropna(subset=[numerical_col])[numerical_col])  # drop the rows that has Nans in this column
         ax.set_ylabel(numerical_col)
     plt.tight_layout()
-    plt.show()
+    show_figure(fig, 'plot_boxplots')
 
 def plot_side_by_side_boxplots(df):
     '''
@@ -90,9 +92,8 @@ def plot_side_by_side_boxplots(df):
     '''
     categ_col = [ col for col in df.columns if df[col].dtype == 'object' ]
 
-    plt.style.use('dark_background')
-    plt.rcParams['figure.dpi'] = 300
-    plt.figure(figsize=(15, 15))
+    plot_style(dpi=300)
+    fig = plt.figure(figsize=(15, 15))
     # plt.subplots_adjust(hspace=0.9)
     for i, col in enumerate(categ_col):
         ax = plt.subplot(len(categ_col) , 1, i+1)
@@ -102,7 +103,7 @@ def plot_side_by_side_boxplots(df):
         ax.set_ylabel("offering_time")
         ax.set_xlabel(col)
     plt.tight_layout()
-    plt.show()
+    show_figure(fig, 'plot_side_by_side_boxplots')
 
 def association_bet_numeric_columns(df, method='pearson'):
     """
@@ -120,72 +121,121 @@ def association_bet_numeric_columns(df, method='pearson'):
     corr = df_numeric.corr(method=method)
 
     # Create a heatmap of the correlation matrix
-    plt.style.use('dark_background')
-    plt.rcParams['figure.dpi'] = 200        # increase plot resolution
-    plt.figure(figsize=(6, 5))  # Increase the figsize as desired
+    plot_style(dpi=200)        # increase plot resolution
+    fig = plt.figure(figsize=(6, 5))  # Increase the figsize as desired
     sns.heatmap(corr, annot=True, cmap='cool', center=0, linewidths=0.5)
     plt.xticks(fontsize=6)
     plt.yticks(fontsize=6)
     plt.tight_layout()
-    plt.show()
+    show_figure(fig, 'association_bet_numeric_columns')
 
-def nominal_columns_dependency(df):
+def _pairs_dependency(codes, sizes, pairs):
+    """
+    Chi-square p-value and Cramer's V of each (i, j) pair of factorized columns.
+    The contingency table is a 2-D np.bincount of the combined codes, with the same rows and columns as pd.crosstab
+    (rows where either value is missing are left out, and so are the classes that never appear then).
+    """
+    results = []
+    for i, j in pairs:
+        present = (codes[i] >= 0) & (codes[j] >= 0)
+        table = np.bincount(codes[i][present] * sizes[j] + codes[j][present], minlength=sizes[i] * sizes[j]).reshape(sizes[i], sizes[j])
+        table = table[table.any(axis=1)][:, table.any(axis=0)]
+        chi2, p_value, dof, ex = chi2_contingency(table)
+        # Cramer's V uses the statistic without Yates' continuity correction
+        chi2 = chi2_contingency(table, correction=False)[0] if dof == 1 else chi2
+        cramers_v = np.sqrt(chi2 / (table.sum() * (min(table.shape) - 1))) if min(table.shape) > 1 else np.nan
+        results.append((p_value, cramers_v))
+    return results
+
+def nominal_columns_dependency(df, cramers_v=False, n_jobs=1):
     """
     Calculates the dependency between nominal columns in a DataFrame using the chi-square test.
 
+    Each column is factorized once and the contingency tables are built with np.bincount on the combined codes.
+    Only the pairs i <= j are computed, the matrix is symmetric, and they can be spread over a process pool.
+
     Parameters
     ----------
     df : pandas.DataFrame
         The DataFrame containing the entire data.
+
+    cramers_v : bool
+        Whether to also return Cramer's V, the strength of the association between 0 and 1. Default is False.
+
+    n_jobs : int
+        Number of processes the pairs are spread over (-1 for one per core, 1 to run in this process). Default is 1,
+        the whole matrix takes well under a second and the workers are spawned, which costs more than that. A script
+        calling it with n_jobs > 1 needs an `if __name__ == '__main__':` guard.
     Returns
     -------
     pandas.DataFrame
         A DataFrame showing the p-values of the chi-square test between each pair of nominal columns.
+
+    pandas.DataFrame
+        Only if cramers_v is True, the Cramer's V of each pair of nominal columns.
     """
     categ_col = [ col for col in df.columns if df[col].dtype == 'object' ]
 
-    p_value_df = pd.DataFrame(index=categ_col, columns=categ_col)
-
-    for col_i in categ_col:
-        for col_j in categ_col:
-            contingency_table = pd.crosstab(df[col_i], df[col_j]) # based on frequency
-            # Perform chi-square test
-            chi2, p_value, dof, ex = chi2_contingency(contingency_table)
-            p_value_df.at[col_i, col_j] = p_value
-
+    # missing values get the code -1
+    codes, sizes = [], []
+    for col in categ_col:
+        col_codes, classes = pd.factorize(df[col])
+        codes.append(col_codes)
+        sizes.append(len(classes))
+
+    pairs = list(itertools.combinations_with_replacement(range(len(categ_col)), 2))
+    n_jobs = min(os.cpu_count() if n_jobs == -1 else n_jobs, max(len(pairs), 1))
+    if n_jobs == 1:
+        results = _pairs_dependency(codes, sizes, pairs)
+    else:
+        # one chunk of pairs per worker, so the codes are sent n_jobs times only
+        chunks = [pairs[k::n_jobs] for k in range(n_jobs)]
+        # spawned rather than forked workers, a fork of a process that already loaded numba (dcor, in utils) hangs at exit
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+            chunk_results = list(executor.map(_pairs_dependency, [codes] * n_jobs, [sizes] * n_jobs, chunks))
+        results = [None] * len(pairs)
+        for k, chunk_result in enumerate(chunk_results):
+            results[k::n_jobs] = chunk_result
+
+    p_values = np.full((len(categ_col), len(categ_col)), np.nan)
+    strengths = np.full((len(categ_col), len(categ_col)), np.nan)
+    for (i, j), (p_value, strength) in zip(pairs, results):
+        p_values[i, j] = p_values[j, i] = p_value
+        strengths[i, j] = strengths[j, i] = strength
+
+    p_value_df = pd.DataFrame(p_values, index=categ_col, columns=categ_col)
+    if cramers_v:
+        return p_value_df, pd.DataFrame(strengths, index=categ_col, columns=categ_col)
     return p_value_df
 
-def visualize_continuous_data(df):
+def visualize_continuous_data(df, tables=None, bins=50):
     '''
-    Plot all possible 4c2 pairs of continuous features in a scatter plot grid of 2x3. If HighD is True, 
-    then plot all possible 4c3 pairs in a 1x4 grid of 3D scatter plots.
+    Plot all possible 4c2 pairs of continuous features in a grid of 2-D histograms of 3 columns, outliers removed.
+    The histograms are binned once per dataset (aggregates.histograms_2d, or the 'hist2d' of the eda_tables passed)
+    so that the plots don't draw the raw rows.
     '''
 
-    numerical_columns = [col for col in df.columns if df[col].dtype == 'int64' or df[col].dtype =='float64']
-    df_numeric = df.loc[:, numerical_columns]
-
+    if tables is None:
+        numerical_columns = [col for col in df.columns if df[col].dtype == 'int64' or df[col].dtype =='float64']
+        # for better visuals, lets remove outliers (the ranges of each column are computed once)
+        tables = {'hist2d': histograms_2d(df, numerical_columns, bins=bins)}
 
-    combinations = list(itertools.combinations(numerical_columns, 2)) #combinations so to avoid repetition of pairs
-    plt.style.use('dark_background')
-    fig, axes = plt.subplots(len(combinations)//3, 3, figsize=(15, 10))
+    combinations = list(tables['hist2d']) #combinations so to avoid repetition of pairs
+    plot_style()
+    fig, axes = plt.subplots((len(combinations) + 2)//3, 3, figsize=(15, 10), squeeze=False)
     plt.subplots_adjust(hspace=0.9)
     axes = axes.flatten()
     for i, (col1, col2) in enumerate(combinations):
 
-        # for better visuals, lets remove outliers
-        lower1,upper1=calc_outliers_range(df_numeric, col1)
-        lower2,upper2=calc_outliers_range(df_numeric,col2)
-        df_no_outliers=df_numeric[(df_numeric[col1]>lower1) & (df_numeric[col1]<upper1) & (df_numeric[col2]>lower2) & (df_numeric[col2]<upper2)]
-
-        axes[i].scatter(df_no_outliers[col1], df_no_outliers[col2], color='pink', s=2, alpha=0.7, marker='.')
+        counts, x_edges, y_edges = tables['hist2d'][(col1, col2)]
+        # empty bins are left transparent like the background of the scatter plots
+        axes[i].pcolormesh(x_edges, y_edges, np.ma.masked_equal(counts, 0).T, cmap='RdPu_r')
         axes[i].title.set_color('white')
         axes[i].set_xlabel(col1)
         axes[i].set_ylabel(col2)
-        axes[i].legend()
-
-    plt.show()
-
-
-
 
+    # Hide any unused subplots
+    for j in range(len(combinations), len(axes)):
+        axes[j].axis('off')
 
+    show_figure(fig, 'visualize_continuous_data')
@@ -0,0 +1,157 @@
+import itertools
+import numpy as np
+import pandas as pd
+from scipy.signal import fftconvolve
+from matplotlib.cbook import boxplot_stats
+from analyzer import calc_outliers_range
+
+# points of the fine grid the KDEs are binned on before being read at the plotted grid
+_KDE_BINS = 4096
+
+def binary_target(data, target_column='Churn'):
+    '''
+    The target as 0/1, mapping 'Yes'/'No' as the plots do but without changing the data.
+    '''
+    if data[target_column].dtype == 'object':
+        return data[target_column].map({'Yes': 1, 'No': 0})
+    return data[target_column]
+
+def category_counts(data, columns, target_column='Churn', by=None):
+    '''
+    Number of rows of each class of the columns (and of each class of `by` within it) per target value.
+
+    Returns
+    -------
+    counts : dict
+        A DataFrame per column indexed by its classes (by (column, by) pairs if `by` is given) with a column of counts per target value.
+    '''
+    target = binary_target(data, target_column)
+    keys = [by] if by is not None else []
+    return {col: data.groupby([col] + keys + [target]).size().unstack(fill_value=0) for col in columns}
+
+def box_stats(data, columns, target_column='Churn', whis=1.5, max_fliers=1000):
+    '''
+    The statistics a box plot draws (quartiles, whiskers, fliers) of each column per target value, the input of Axes.bxp.
+    Only the distinct fliers are kept, and at most max_fliers of them evenly spread over their range for the wide columns.
+
+    Returns
+    -------
+    stats : dict
+        A list per column of the box statistics of each target value, sorted by target value.
+    '''
+    target = binary_target(data, target_column)
+    stats = {}
+    for col in columns:
+        values = data[col].to_numpy(dtype=float)
+        stats[col] = []
+        for label in sorted(target.dropna().unique()):
+            group = values[(target == label).to_numpy()]
+            box = boxplot_stats(group[~np.isnan(group)], whis=whis, labels=[label])[0]
+            fliers = np.unique(box['fliers'])
+            if len(fliers) > max_fliers:
+                fliers = fliers[np.linspace(0, len(fliers) - 1, max_fliers).astype(int)]
+            box['fliers'] = fliers
+            stats[col].append(box)
+    return stats
+
+def _binned_kde(values, gridsize, cut):
+    # gaussian KDE with Scott's bandwidth (scipy's gaussian_kde, as seaborn) evaluated on gridsize points from
+    # min - cut * bw to max + cut * bw: the values are linearly binned on a fine grid, convolved with the kernel and interpolated
+    bw = values.std(ddof=1) * len(values) ** (-1 / 5)
+    grid = np.linspace(values.min() - cut * bw, values.max() + cut * bw, gridsize)
+    fine, step = np.linspace(grid[0], grid[-1], _KDE_BINS, retstep=True)
+    position = (values - grid[0]) / step
+    left = np.clip(np.floor(position).astype(int), 0, _KDE_BINS - 2)
+    right_weight = position - left
+    counts = np.bincount(left, 1 - right_weight, minlength=_KDE_BINS) + np.bincount(left + 1, right_weight, minlength=_KDE_BINS)
+    half = min(int(np.ceil(5 * bw / step)), _KDE_BINS - 1)
+    kernel = np.exp(-0.5 * (np.arange(-half, half + 1) * step / bw) ** 2)
+    density = fftconvolve(counts, kernel, mode='same') / (len(values) * bw * np.sqrt(2 * np.pi))
+    return grid, np.interp(grid, fine, np.maximum(density, 0))
+
+def kde_grids(data, columns, target_column='Churn', gridsize=200, cut=3):
+    '''
+    Density curves of each column per target value, binned so that their cost is linear in the number of rows.
+    A target value with less than two distinct values of a column has no curve, as in seaborn.
+
+    Returns
+    -------
+    grids : dict
+        A DataFrame per column with the target value, the 'Value' and its 'Density', gridsize rows per target value.
+    '''
+    target = binary_target(data, target_column)
+    grids = {}
+    for col in columns:
+        values = data[col].to_numpy(dtype=float)
+        curves = []
+        for label in sorted(target.dropna().unique()):
+            group = values[(target == label).to_numpy()]
+            group = group[~np.isnan(group)]
+            if len(group) < 2 or group.min() == group.max():
+                continue
+            grid, density = _binned_kde(group, gridsize, cut)
+            curves.append(pd.DataFrame({target_column: label, 'Value': grid, 'Density': density}))
+        grids[col] = pd.concat(curves, ignore_index=True) if curves else pd.DataFrame(columns=[target_column, 'Value', 'Density'])
+    return grids
+
+def histograms_2d(data, columns, bins=50, drop_outliers=True):
+    '''
+    2-D histograms of every pair of the columns. Each column is binned once over its range (within its outlier
+    range from calc_outliers_range, computed once per column, when drop_outliers), then a pair is a bincount
+    of the bin codes of the rows inside both ranges.
+
+    Returns
+    -------
+    histograms : dict
+        (counts, x_edges, y_edges) per (column, column) pair, counts of shape bins x bins.
+    '''
+    codes, edges = {}, {}
+    for col in columns:
+        values = data[col].to_numpy(dtype=float)
+        inside = ~np.isnan(values)
+        if drop_outliers:
+            lower, upper = calc_outliers_range(data, col)
+            inside &= (values > lower) & (values < upper)
+        if not inside.any():
+            codes[col], edges[col] = np.full(len(values), -1), np.linspace(0, 1, bins + 1)
+            continue
+        edges[col] = np.linspace(values[inside].min(), values[inside].max(), bins + 1)
+        # the last bin includes its right edge, as in np.histogram
+        codes[col] = np.where(inside, np.clip(np.searchsorted(edges[col], values, side='right') - 1, 0, bins - 1), -1)
+
+    histograms = {}
+    for col1, col2 in itertools.combinations(columns, 2):
+        both = (codes[col1] >= 0) & (codes[col2] >= 0)
+        counts = np.bincount(codes[col1][both] * bins + codes[col2][both], minlength=bins * bins).reshape(bins, bins)
+        histograms[(col1, col2)] = (counts, edges[col1], edges[col2])
+    return histograms
+
+def eda_tables(data, target_column='Churn', threshold=10, col2='HasCreditCard', bins=50, gridsize=200):
+    '''
+    All the aggregates the EDA plots of graphs.py render from, computed once per dataset. Passing them to the plots
+    (tables=...) makes their cost independent of the number of rows.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame
+        The raw data with the target column.
+    threshold : int
+        Maximum unique values of an object column to be plotted as categorical.
+    col2 : str
+        The feature counted within each categorical class in the facet grids.
+    bins, gridsize : int
+        Resolution of the 2-D histograms and of the density curves.
+
+    Returns
+    -------
+    tables : dict
+        'counts', 'facet_counts' (categorical columns), 'box', 'kde' (numerical columns) and 'hist2d' (their pairs).
+    '''
+    categorical_columns = [col for col in data.select_dtypes(include=['object', 'category']).columns
+                           if data[col].nunique() <= threshold and col != target_column]
+    numerical_columns = [col for col in data.select_dtypes(include=['int64', 'float64']).columns if col != target_column]
+    return {'counts': category_counts(data, categorical_columns, target_column),
+            'facet_counts': category_counts(data, [col for col in categorical_columns if col != col2], target_column, by=col2),
+            'box': box_stats(data, numerical_columns, target_column),
+            'kde': kde_grids(data, numerical_columns, target_column, gridsize=gridsize),
+            'hist2d': histograms_2d(data, numerical_columns, bins=bins)}
@@ -1,5 +1,20 @@
+import warnings
+import numpy as np
 import pandas as pd
-from statsmodels.stats.outliers_influence import variance_inflation_factor
+from scipy.linalg import solve_triangular
+from sketches import QuantileSketch, RunningMoments
+
+def get_numerical_columns(df):
+    '''
+    Names of the numerical columns (integers and floats of any width, e.g. float32 in compact mode).
+    '''
+    return [col for col in df.columns if df[col].dtype.kind in 'if']
+
+def get_categorical_columns(df):
+    '''
+    Names of the text columns, stored either as python objects or as pandas Categoricals (compact mode).
+    '''
+    return [col for col in df.columns if df[col].dtype == 'object' or isinstance(df[col].dtype, pd.CategoricalDtype)]
 
 def count_missing_values(df):
     """
@@ -70,32 +85,236 @@ def get_outliers(df, column):
     upper_outliers_df= df[(df[column]> upper_limit)]
     return lower_outliers_df, upper_outliers_df
 
+def _outlier_table(values, lower, upper, columns, n_rows):
+    # outlier counts of a 2-D float block from boolean sums, nans are never outliers
+    count_lower = (values < lower).sum(axis=0)
+    count_upper = (values > upper).sum(axis=0)
+    percentage = [round(((low + up) / n_rows) * 100, 2) for low, up in zip(count_lower, count_upper)]
+    return pd.DataFrame({'Lower Outliers Count': count_lower, 'Upper Outliers Count': count_upper,
+                         "Outliers Percentage (%)": percentage}, index=columns).T
+
+def _outliers_ranges(q1, q3):
+    # vectorized calc_outliers_range from the quartiles of every column
+    iqr = q3 - q1
+    return q1 - 1.5*iqr, q3 + 1.5*iqr
+
 def count_outliers(df):
     '''
     Return a statistics of numeric values. It counts how many outliers in each numeric column in a dataframe.
+    The quartiles of all the columns come from one vectorized call and the outliers are counted with boolean sums.
+    '''
+    numerical_columns = get_numerical_columns(df)
+    values = df[numerical_columns].to_numpy(dtype=float)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-nan columns
+        q1, q3 = np.nanquantile(values, [0.25, 0.75], axis=0)
+    lower, upper = _outliers_ranges(q1, q3)
+    return _outlier_table(values, lower, upper, numerical_columns, df.shape[0])
+
+def numerical_statistics(df):
+    numerical_cols = get_numerical_columns(df)
+    return df.loc[:, numerical_cols].describe().style.set_sticky(axis="index")
+
+def _correlation(x_data, centered=True):
     '''
-    count_lower, count_upper, percentage={} , {}, {}
-    numerical_columns = [col for col in df.columns if df[col].dtype == 'int64' or df[col].dtype =='float64']
+    Correlation matrix of the columns. With centered=False the columns are not centered (the cosine similarity matrix,
+    i.e. regressions without an intercept).
 
-    for col in numerical_columns:
-        lower_outliers, upper_outliers = get_outliers(df, col)
-        count_lower[col] = lower_outliers.shape[0]
-        count_upper[col] = upper_outliers.shape[0]
+    Returns the matrix over the columns that are not constantly zero (once centered), and the mask of these columns.
+    '''
+    values = x_data.to_numpy(dtype=float)
+    if centered:
+        values = values - values.mean(axis=0)
+    gram = values.T @ values
+    valid = np.diag(gram) > 0
+    gram = gram[np.ix_(valid, valid)]
+    scale = 1 / np.sqrt(np.diag(gram))
+    return gram * scale[:, None] * scale[None, :], valid
 
-        percentage[col]= round(((lower_outliers.shape[0]+upper_outliers.shape[0])/ df.shape[0])*100,2) 
+def _cholesky_inverse(corr):
+    # inverse through one Cholesky factorization, None when the matrix is singular (perfectly collinear columns)
+    try:
+        lower = np.linalg.cholesky(corr)
+    except np.linalg.LinAlgError:
+        return None
+    lower_inv = solve_triangular(lower, np.eye(len(corr)), lower=True)
+    return lower_inv.T @ lower_inv
 
-    return pd.DataFrame({'Lower Outliers Count': count_lower,'Upper Outliers Count': count_upper ,"Outliers Percentage (%)": percentage}).T
+def _null_space(corr):
+    # eigenvalues numerically zero (the tolerance of np.linalg.matrix_rank) and their eigenvectors, by increasing eigenvalue
+    values, vectors = np.linalg.eigh(corr)
+    null = values <= max(values.max(), 0) * len(values) * np.finfo(float).eps
+    return values, vectors, null
 
-def numerical_statistics(df):
-    numerical_cols = [ col for col in df.columns if df[col].dtype == 'int64' or df[col].dtype =='float64']
-    return df.loc[:, numerical_cols].describe().style.set_sticky(axis="index")
+def vif_analysis(x_data, centered=True):
+    '''
+    Variance inflation factor of every column, all at once from the diagonal of the inverse correlation matrix
+    instead of one OLS regression per column.
 
-def vif_analysis(x_data):
+    centered=True gives the classical VIFs, of regressions with an intercept (statsmodels' variance_inflation_factor
+    on the data with a constant column added). centered=False regresses without an intercept. Columns without
+    variance get a nan VIF, and the columns of an exact linear dependency an infinite one. The other columns
+    of perfectly collinear data keep their VIF, the diagonal of the pseudo-inverse.
+    '''
+    corr, valid = _correlation(x_data, centered)
+    inverse = _cholesky_inverse(corr)
+    if inverse is not None:
+        diagonal = np.diag(inverse)
+    else:
+        warnings.warn("The columns are perfectly collinear, those of the linear dependencies get an infinite VIF.")
+        values, vectors, null = _null_space(corr)
+        # the other columns are orthogonal to the null space, the pseudo-inverse gives their exact VIF
+        diagonal = np.diag(np.linalg.pinv(corr, rcond=len(corr) * np.finfo(float).eps, hermitian=True)).copy()
+        diagonal[(np.abs(vectors[:, null]) > np.sqrt(np.finfo(float).eps)).any(axis=1)] = np.inf
+    vifs = np.full(len(valid), np.nan)
+    vifs[valid] = diagonal
     vif_data = pd.DataFrame()
     vif_data["feature"] = x_data.columns
-    vif_data["VIF"] = [variance_inflation_factor(x_data.values, i) for i in range(len(x_data.columns))]
+    vif_data["VIF"] = vifs
     # Sort the VIF data by VIF values in descending order
     vif_data = vif_data.sort_values(by="VIF", ascending=False).reset_index(drop=True)
 
     vif_dict = vif_data.set_index('feature')['VIF'].to_dict()
-    return vif_dict
\ No newline at end of file
+    return vif_dict
+
+def vif_elimination(x_data, threshold=10, centered=True):
+    '''
+    Drops the column with the highest VIF until every VIF is at most threshold.
+
+    Perfectly collinear columns are dropped first, one per linear dependency, with an infinite VIF. The inverse
+    correlation matrix of the rest is then computed once; removing column k updates it with the rank-one downdate
+    inv[-k, -k] - inv[-k, k] inv[k, -k] / inv[k, k], so no regression is refitted.
+
+    Returns
+    -------
+    vif_dict : dict
+        VIF of the kept columns, sorted in descending order.
+
+    dropped : list of (str, float)
+        The dropped columns in order, with their VIF when they were dropped (nan for the columns without variance,
+        which are dropped first, then inf for the perfectly collinear ones).
+    '''
+    corr, valid = _correlation(x_data, centered)
+    columns = [col for col, keep in zip(x_data.columns, valid) if keep]
+    dropped = [(col, np.nan) for col, keep in zip(x_data.columns, valid) if not keep]
+    inverse = _cholesky_inverse(corr)
+    while inverse is None:
+        # the column with the largest weight in the dependency of the smallest eigenvalue, the last one on ties
+        weights = np.abs(_null_space(corr)[1][:, 0])
+        k = int(np.flatnonzero(weights >= weights.max() - np.sqrt(np.finfo(float).eps))[-1])
+        dropped.append((columns.pop(k), np.inf))
+        keep = np.arange(len(corr)) != k
+        corr = corr[np.ix_(keep, keep)]
+        inverse = _cholesky_inverse(corr)
+    while columns:
+        vifs = np.diag(inverse)
+        k = int(np.argmax(vifs))
+        if vifs[k] <= threshold:
+            break
+        dropped.append((columns.pop(k), float(vifs[k])))
+        keep = np.arange(len(inverse)) != k
+        inverse = inverse[np.ix_(keep, keep)] - np.outer(inverse[keep, k], inverse[k, keep]) / inverse[k, k]
+
+    vif_dict = pd.Series(np.diag(inverse), index=columns, dtype=float).sort_values(ascending=False).to_dict()
+    return vif_dict, dropped
+
+def _profile_frame(df):
+    numerical_columns = get_numerical_columns(df)
+    values = df[numerical_columns].to_numpy(dtype=float)
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)  # all-nan columns
+        q1, median, q3 = np.nanquantile(values, [0.25, 0.5, 0.75], axis=0)
+        statistics = pd.DataFrame({'count': (~np.isnan(values)).sum(axis=0), 'mean': np.nanmean(values, axis=0),
+                                   'std': np.nanstd(values, axis=0, ddof=1), 'min': np.nanmin(values, axis=0),
+                                   '25%': q1, '50%': median, '75%': q3, 'max': np.nanmax(values, axis=0)}, index=numerical_columns).T
+    lower, upper = _outliers_ranges(q1, q3)
+    return {'missing': df.isna().sum(), 'unique': df.nunique(), 'types': df.dtypes, 'duplicates': int(df.duplicated(keep=False).sum()),
+            'outliers': _outlier_table(values, lower, upper, numerical_columns, df.shape[0]), 'statistics': statistics}
+
+def _numeric_chunk(chunk, numerical_columns):
+    # the numerical columns of the first chunk stay numerical, a text value in a later chunk becomes missing
+    return chunk.assign(**{col: pd.to_numeric(chunk[col], errors='coerce') for col in numerical_columns})
+
+def _profile_chunks(chunks):
+    # pass 1: counts, distinct values, row hashes, quantile sketches and moments of the numericals
+    n_rows, missing, uniques, hashes = 0, None, {}, []
+    for chunk in chunks():
+        if missing is None:
+            types = chunk.dtypes
+            numerical_columns = get_numerical_columns(chunk)
+            missing = pd.Series(0, index=chunk.columns)
+            sketches = {col: QuantileSketch() for col in numerical_columns}
+            moments = {col: RunningMoments() for col in numerical_columns}
+            uniques = {col: set() for col in chunk.columns}
+        chunk = _numeric_chunk(chunk, numerical_columns)
+        n_rows += chunk.shape[0]
+        missing += chunk.isna().sum()
+        for col in chunk.columns:
+            uniques[col].update(pd.unique(chunk[col].dropna()))
+        hashes.append(pd.util.hash_pandas_object(chunk, index=False).to_numpy())
+        for col in numerical_columns:
+            column = chunk[col].to_numpy(dtype=float)
+            sketches[col].update(column)
+            moments[col].update(column)
+
+    q1, median, q3 = np.array([sketches[col].quantile([0.25, 0.5, 0.75]) for col in numerical_columns]).reshape(-1, 3).T
+    statistics = pd.DataFrame({'count': [moments[col].count for col in numerical_columns], 'mean': [moments[col].mean for col in numerical_columns],
+                               'std': [moments[col].std() for col in numerical_columns], 'min': [moments[col].min for col in numerical_columns],
+                               '25%': q1, '50%': median, '75%': q3, 'max': [moments[col].max for col in numerical_columns]}, index=numerical_columns).T
+    # rows whose hash occurs more than once, all occurrences counted as duplicated(keep=False) does
+    _, occurrences = np.unique(np.concatenate(hashes), return_counts=True)
+
+    # pass 2: outliers, once the quartiles of the whole data are known
+    lower, upper = _outliers_ranges(q1, q3)
+    counts = 0
+    for chunk in chunks():
+        counts = counts + _outlier_table(_numeric_chunk(chunk, numerical_columns)[numerical_columns].to_numpy(dtype=float), lower, upper, numerical_columns, 1).iloc[:2]
+    percentage = ((counts.iloc[0] + counts.iloc[1]) / n_rows * 100).round(2)
+    outliers = pd.concat([counts, percentage.to_frame("Outliers Percentage (%)").T])
+
+    return {'missing': missing, 'unique': pd.Series({col: len(values) for col, values in uniques.items()}), 'types': types,
+            'duplicates': int(occurrences[occurrences > 1].sum()), 'outliers': outliers, 'statistics': statistics}
+
+def profile(data, chunksize=None):
+    '''
+    Profiles a dataset in one call: the summaries of count_missing_values, count_unique_elements_and_types,
+    count_duplicate_rows, count_outliers and numerical_statistics.
+
+    In memory, the numerical columns are read once as a float block whose quartiles come from one vectorized
+    call, and the outliers are counted with boolean sums. With chunksize, the data is read chunk by chunk twice
+    (summaries, then outliers) and only mergeable summaries are kept: quartiles and medians are then estimates
+    (QuantileSketch), and so are the outlier counts, whose ranges come from these quartiles. The other values are
+    exact. The column types are those of the first chunk: its text columns are read as strings in every chunk, and
+    a text value in one of its numerical columns counts as missing.
+
+    Parameters
+    ----------
+    data : pandas.DataFrame or str
+        The data, or the path of a CSV file.
+
+    chunksize : int
+        Number of rows per chunk. Default is None, the whole data at once.
+
+    Returns
+    -------
+    report : dict
+        'missing', 'unique', 'duplicates', 'outliers' and 'statistics' DataFrames, laid out as the outputs of the
+        functions above ('statistics' as describe()).
+    '''
+    if chunksize is None:
+        summary = _profile_frame(data if isinstance(data, pd.DataFrame) else pd.read_csv(data))
+    elif isinstance(data, pd.DataFrame):
+        summary = _profile_chunks(lambda: (data.iloc[start:start + chunksize] for start in range(0, data.shape[0], chunksize)))
+    else:
+        # a later chunk holding only numbers in a text column (e.g. HandsetPrice) must not be parsed as numbers
+        text = {col: object for col in get_categorical_columns(pd.read_csv(data, nrows=chunksize))}
+        summary = _profile_chunks(lambda: pd.read_csv(data, chunksize=chunksize, dtype=text))
+
+    missing = summary['missing'][summary['missing'] > 0]
+    return {
+        'missing': pd.DataFrame({'Missing Count': missing}).T,
+        'unique': pd.DataFrame({'Unique Count': summary['unique'], 'Data Type': summary['types']}).T,
+        'duplicates': pd.DataFrame({'Duplicate Row Count': [summary['duplicates']]}),
+        'outliers': summary['outliers'],
+        'statistics': summary['statistics']
+    }
@@ -1,22 +1,178 @@
 import os
+import json
 import pickle
+import shutil
+import hashlib
 import warnings
 import itertools
 import numpy as np
 import pandas as pd
 import seaborn as sns
 import category_encoders as ce
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 import matplotlib.pyplot as plt
+from scipy import sparse as sp
 from scipy.stats import chi2_contingency
 from sklearn.preprocessing import LabelEncoder
-from analyzer import calc_outliers_range
+from analyzer import calc_outliers_range, get_numerical_columns, get_categorical_columns
+from sketches import QuantileSketch, RunningMoments, SortedRuns
 from sklearn.decomposition import PCA
 from sklearn.model_selection import train_test_split
 from imblearn.over_sampling import SMOTE
 from imblearn.over_sampling import ADASYN
 from imblearn.over_sampling import RandomOverSampler
 
-def handle_nulls(x_data,y_data,module_dir,method='mix',split="train"):
+# bump whenever the layout of the learned preprocessing state changes, so stale artifacts are rejected
+PREPROCESSOR_VERSION = 4
+
+def _persist(module_dir, name, obj, state=None):
+    '''
+    Stores a learned parameter. If an in-memory state dict is given it is kept there under the
+    file name, otherwise it is written to Saved/ as a pickle (or .npy for numpy arrays).
+    '''
+    if state is not None:
+        state[name] = obj
+    elif name.endswith('.npy'):
+        np.save(os.path.join(module_dir, '../Saved') + '/' + name, obj)
+    else:
+        with open(os.path.join(module_dir, '../Saved') + '/' + name, 'wb') as f:
+            pickle.dump(obj, f)
+
+def _restore(module_dir, name, state=None):
+    '''
+    Loads a learned parameter saved by _persist, from the in-memory state if given or from Saved/ otherwise.
+    '''
+    if state is not None:
+        if name not in state:
+            raise ValueError(f"'{name}' was not learned during fit. Fit with the same options before transforming.")
+        return state[name]
+    if name.endswith('.npy'):
+        return np.load(os.path.join(module_dir, '../Saved') + '/' + name)
+    with open(os.path.join(module_dir, '../Saved') + '/' + name, 'rb') as f:
+        return pickle.load(f)
+
+_pools = {}
+
+def _map_columns(func, args, n_jobs=1, backend='thread'):
+    '''
+    Calls func(*arg) for every tuple in args (one per column) and returns the results in the same order.
+    With n_jobs=1 this runs serially, otherwise the calls are fanned out over a pool of n_jobs workers
+    (-1 for one per core). backend is 'thread' or 'process'; processes avoid the GIL on object columns
+    at the cost of sending every column to a worker. Pools are kept and reused by the following calls.
+    '''
+    if n_jobs == 1 or len(args) < 2:
+        return [func(*arg) for arg in args]
+    n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+    if (backend, n_jobs) not in _pools:
+        executor = ProcessPoolExecutor if backend == 'process' else ThreadPoolExecutor
+        _pools[(backend, n_jobs)] = executor(max_workers=n_jobs)
+    return list(_pools[(backend, n_jobs)].map(func, *zip(*args)))
+
+def compact_dtypes(df):
+    '''
+    Returns df with every numerical column as float32 and every text column as a pandas Categorical,
+    which takes about a half (numbers) to a tenth (repeated strings) of the memory of float64/object columns.
+    '''
+    df = df.copy()
+    for col in get_numerical_columns(df):
+        df[col] = df[col].astype(np.float32)
+    for col in get_categorical_columns(df):
+        df[col] = df[col].astype('category')
+    return df
+
+def _float_dtype(df):
+    # float32 when every column already fits in 32 bits (compact mode), float64 otherwise
+    return np.float32 if all(dtype.itemsize <= 4 for dtype in df.dtypes) else np.float64
+
+# Per-column work of the handle_* functions. Each one takes a column (and what was learned for it)
+# and returns what it learned and/or the transformed column, so it can run in any worker.
+
+def _column_median(series):
+    return series.median()
+
+def _column_mode(series):
+    return series.mode()[0] # mode could be more than one values, so we use the 1st
+
+def _column_fillna(series, value):
+    return series.fillna(value)
+
+def _column_outliers_range(series):
+    return calc_outliers_range(series.to_frame(), series.name)
+
+def _column_replace_outliers(series, lower, upper, median=None):
+    # the train split replaces the outliers with the column median and keeps the median after replacement
+    series = series.copy()
+    series[(series < lower) | (series > upper)] = series.median() if median is None else median
+    return series, series.median() if median is None else median
+
+def _column_log(series):
+    if (series < -1).any():
+        print(f"Warning: Negative values detected in {series.name} which will result in NaNs.")
+    return np.log(series + 1)
+
+def _column_standardize(series, mean=None, std=None):
+    if mean is None:
+        mean, std = series.mean(), series.std()
+    if std != 0:
+        series = (series - mean)/std
+    return mean, std, series
+
+def _column_normalize(series, min_val=None, max_val=None):
+    if min_val is None:
+        min_val, max_val = series.min(), series.max()
+    if min_val != max_val:
+        series = (series - min_val)/(max_val - min_val)
+    return min_val, max_val, series
+
+def _category_vocab(classes):
+    '''
+    The code table of a categorical column: its seen classes (as kept by handle_diverse_categories) in sorted
+    order and the reserved 'Other' class last. Missing values have no code, they are -1 as in pandas.
+    '''
+    vocab = sorted((value for value in classes if value == value), key=str)
+    return vocab if 'Other' in vocab else vocab + ['Other']
+
+def _column_fold_categories(series, class_ratio, column_cardinaltiy):
+    # The column is hashed once into integer codes, the folding then only works on the codes
+    codes, uniques = pd.factorize(series)
+    uniques = list(uniques)
+
+    # The cardinality of this column: Number of classes over the size of training dataset
+    cardinality = len(uniques)/series.shape[0]
+    if cardinality == 1: # this column is a unique ID, it gets dropped
+        return None, None
+
+    minority = np.zeros(len(uniques), dtype=bool)
+    # if this col has a higher cardinality than the predefined threshold, then there are a lot of classes
+    if cardinality > column_cardinaltiy:
+        counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        minority = counts/counts.sum() < class_ratio # the classes which are below the prededfined ratio
+
+    # the minority classes get the code of 'Other'
+    classes = {value for value, rare in zip(uniques, minority) if not rare}
+    if minority.any():
+        classes.add('Other')
+    vocab = _category_vocab(classes)
+    position = {value: i for i, value in enumerate(vocab)}
+    remap = np.array([position['Other' if rare else value] for value, rare in zip(uniques, minority)] + [-1])
+    codes = remap[codes] # -1 (missing) picks the last entry and stays -1
+
+    if (codes == -1).any():
+        classes.add(np.nan)
+    return classes, pd.Categorical.from_codes(codes, categories=vocab)
+
+def _column_unseen_to_other(series, classes):
+    vocab = _category_vocab(classes)
+    codes = pd.Categorical(series, categories=vocab).codes.copy()
+    # a class that was not seen in training is replaced with "Other", and so is a missing value if training had none
+    unseen = np.flatnonzero(codes == -1)
+    if any(value != value for value in classes):
+        unseen = unseen[pd.notna(series.to_numpy()[unseen])]
+    codes[unseen] = vocab.index('Other')
+    return pd.Categorical.from_codes(codes, categories=vocab)
+
+def handle_nulls(x_data,y_data,module_dir,method='mix',split="train",state=None,n_jobs=1,backend='thread'):
     '''
     Deals with nans in the dataframe
     
@@ -31,6 +187,11 @@ def handle_nulls(x_data,y_data,module_dir,method='mix',split="train"):
     method: what action to take on nans. 
             ['drop', 'ffill','mode' , 'median' , 'mean', 'mix]
             if mix  is given, then a generic way of impuation is used.
+
+    state: dict or None
+            If given, the learned statistics are kept in this dict instead of being written to / read from Saved/.
+
+    n_jobs, backend: number of workers (and 'thread' or 'process' pool) the columns are spread over with method='mix'.
     Returns
     -------
     None. everything is done inplace
@@ -53,63 +214,54 @@ def handle_nulls(x_data,y_data,module_dir,method='mix',split="train"):
                 modes[col] = mode
                 x_data[col].fillna(mode, inplace=True) # mode could be more than one values, so we use the 1st
 
-            with open(os.path.join(module_dir, '../Saved') + '/null_modes.pkl', 'wb') as f:
-                pickle.dump(modes, f)
+            _persist(module_dir, 'null_modes.pkl', modes, state)
         if split=="test":
-             with open(os.path.join(module_dir, '../Saved') + '/null_modes.pkl', 'rb') as f:
-                modes = pickle.load(f)
-                for col in x_data.columns:
-                    x_data[col].fillna(modes[col], inplace=True)
+            modes = _restore(module_dir, 'null_modes.pkl', state)
+            for col in x_data.columns:
+                x_data[col].fillna(modes[col], inplace=True)
 
     if method=='median':
         if split=="train"or split=='all':
             medians=x_data.median()
             x_data.fillna(medians, inplace=True)
-            with open(os.path.join(module_dir, '../Saved') + '/null_medians.pkl', 'wb') as f:
-                pickle.dump(medians, f)
+            _persist(module_dir, 'null_medians.pkl', medians, state)
 
         if split=="test":
-            with open(os.path.join(module_dir, '../Saved') + '/null_medians.pkl', 'rb') as f:
-                medians = pickle.load(f)
+            medians = _restore(module_dir, 'null_medians.pkl', state)
             x_data.fillna(medians, inplace=True)
 
     if method=='mean':
         if split=="train" or split=='all':
             means=x_data.mean()
             x_data.fillna(means, inplace=True)
-            with open(os.path.join(module_dir, '../Saved') + '/null_means.pkl', 'wb') as f:
-                pickle.dump(means, f)
+            _persist(module_dir, 'null_means.pkl', means, state)
 
         if split=="test":
-            with open(os.path.join(module_dir, '../Saved') + '/null_means.pkl', 'rb') as f:
-                means = pickle.load(f)
+            means = _restore(module_dir, 'null_means.pkl', state)
             x_data.fillna(means, inplace=True)
 
     if method=='mix':
-        numerical_columns = [ col for col in x_data.columns if x_data[col].dtype == 'int64' or x_data[col].dtype =='float64']
-        categ_col = [ col for col in x_data.columns if x_data[col].dtype == 'object' ]
+        numerical_columns = get_numerical_columns(x_data)
+        categ_col = get_categorical_columns(x_data)
         if split=='train' or split=='all':
             # in this case we handle nulls for categorical different than for numerical
-            medians=x_data[numerical_columns].median()
-            x_data[numerical_columns] = x_data[numerical_columns].fillna(medians)  # the numericals use median
-            modes={}
-            for col in categ_col:
-                mode=x_data[col].mode()[0]
-                modes[col]=mode
-                x_data[col].fillna(mode, inplace=True)  # the categoricals use mode
+            medians = _map_columns(_column_median, [(x_data[col],) for col in numerical_columns], n_jobs, backend)  # the numericals use median
+            medians = pd.Series(medians, index=numerical_columns, dtype=float)
+            modes = _map_columns(_column_mode, [(x_data[col],) for col in categ_col], n_jobs, backend)  # the categoricals use mode
+            modes = dict(zip(categ_col, modes))
             data=[medians, modes]
-            with open(os.path.join(module_dir, '../Saved') + '/null_mix.pkl', 'wb') as f:
-                pickle.dump(data, f)
+            _persist(module_dir, 'null_mix.pkl', data, state)
 
         if split=='test':
-            with open(os.path.join(module_dir, '../Saved') + '/null_mix.pkl', 'rb') as f:
-                medians, modes = pickle.load(f)
+            medians, modes = _restore(module_dir, 'null_mix.pkl', state)
 
-            x_data[numerical_columns] = x_data[numerical_columns].fillna(medians)
-            for col in categ_col:
-                x_data[col].fillna(modes[col], inplace=True) 
+        fills = {**medians.to_dict(), **modes}
+        columns = [col for col in numerical_columns + categ_col if col in fills]
+        filled = _map_columns(_column_fillna, [(x_data[col], fills[col]) for col in columns], n_jobs, backend)
+        for col, series in zip(columns, filled):
+            x_data[col] = series
 
-def handle_diverse_categories(df,module_dir, class_ratio=0.001 , column_cardinaltiy=0.005, split='train'):
+def handle_diverse_categories(df,module_dir, class_ratio=0.001 , column_cardinaltiy=0.005, split='train', state=None, n_jobs=1, backend='thread'):
     '''
     A categorical column with high-cardinality [features with a large number of unique categories].
     These columns cause problems if a category is found in test set and does not exist in training.
@@ -118,57 +270,130 @@ def handle_diverse_categories(df,module_dir, class_ratio=0.001 , column_cardinal
         1. delete that column
         2. Change low frequent categories with "Other"
 
+    The kept columns come out as pandas Categoricals over a fixed vocab (the seen classes sorted, 'Other' last),
+    i.e. as integer codes that handle_categories encodes without looking at the strings again.
+
     Parameters
     df: Pandas data frame
     class_ratio : a threshold for the classes in a specific column. Below this threshold, this class needs to be replaced with 'Other'
     column_cardinaltiy: a threshold on the column itself. If this column has a a lot of catrgories compared to the size of the dataset
                         it means that this column is of less useful info. Either we dropp it  or group the minority classes in this col
                         in 'Other' category.
+    state: if given, the seen categories are kept in this dict instead of Saved/
+    n_jobs, backend: number of workers (and 'thread' or 'process' pool) the columns are spread over
     ----------
     Returns
     -------
     None. Everything is done inplace
     '''
 
-    categ_col = [ col for col in df.columns if df[col].dtype == 'object']
+    categ_col = get_categorical_columns(df)
     if split=="train" or split=='all':
         unique_categ={}
-        for col in categ_col:
-            # The cardinality of this column: Number of classes over the size of training dataset
-            cardinality= df[col].nunique()/df.shape[0]
-
-            if cardinality==1: # this column id a unique ID
+        results = _map_columns(_column_fold_categories, [(df[col], class_ratio, column_cardinaltiy) for col in categ_col], n_jobs, backend)
+        for col, (classes, series) in zip(categ_col, results):
+            if classes is None:
                 df.drop([col], axis=1, inplace=True)
+            else:
+                df[col] = series
+                unique_categ[col] = classes
 
-            # if this col has a higher cardinality than the predefined threshold, then there are a lot of classes 
-            elif cardinality>column_cardinaltiy:
-                ratios=df[col].value_counts(normalize=True) # count the ratio of each class in the column
-                minority=ratios[ratios<class_ratio]
-                minority=minority.reset_index().rename(columns={"index": col, col: "ratio"}) # a dataframe with the minority classes and their ratio
-                minority_classes = minority[col].tolist() # the classes which are below the prededfined ratio
-                label='Other'
-                df[col].mask(df[col].isin(minority_classes), label, inplace=True) #change the label of minority classes to the new label
+        _persist(module_dir, 'diverge_categ.pkl', unique_categ, state)
+    if split=="test":
+        unique_categ = _restore(module_dir, 'diverge_categ.pkl', state)
+
+        df.drop([col for col in categ_col if col not in unique_categ], axis=1, inplace=True)
+        categ_col = [col for col in categ_col if col in unique_categ]
+        results = _map_columns(_column_unseen_to_other, [(df[col], unique_categ[col]) for col in categ_col], n_jobs, backend)
+        for col, series in zip(categ_col, results):
+            df[col] = series
+
+def _category_codes(series, vocab):
+    # the codes of a column in its vocab, they are already there if handle_diverse_categories made it a Categorical
+    if isinstance(series.dtype, pd.CategoricalDtype) and list(series.cat.categories) == vocab:
+        return series.cat.codes.to_numpy()
+    codes = pd.Categorical(series, categories=vocab).codes.copy()
+    unseen = np.flatnonzero(codes == -1)
+    codes[unseen[pd.notna(series.to_numpy()[unseen])]] = vocab.index('Other')
+    return codes
+
+def _fit_encoders(encode, columns, categ_col, classes, counts, n_rows):
+    '''
+    Fits the encoders of handle_categories from what they depend on, without the rows themselves.
 
-            unique_categ[col]=set(df[col])
+    classes: for every column of categ_col, its classes in order of first appearance (the order the
+    category_encoders number them in), including nan if the column had missing values.
+    counts: for every column of categ_col, the number of rows of each class, out of n_rows rows.
+    The encoders are fitted on a small frame holding every class once, which gives the same encoders as
+    fitting them on the whole data.
+    '''
+    if encode == 'Ordinal':
+        return {'label_encoders.pkl': {col: ce.OrdinalEncoder(cols=[col]).fit(pd.Series(classes[col], name=col).astype(str)) for col in categ_col}}
+    elif encode == 'OneHot':
+        return {'onehot_columns.pkl': [f'{col}_{value}' for col in categ_col for value in sorted(value for value in classes[col] if value == value)]}
+    elif encode == 'Frequency':
+        return {'freq_encoders.pkl': {col: pd.Series(counts[col], dtype=float).sort_values(ascending=False) / n_rows for col in categ_col}}
+    elif encode == 'Binary':
+        size = max([len(classes[col]) for col in categ_col] + [1])
+        sample = pd.DataFrame({col: [classes[col][min(i, len(classes[col]) - 1)] for i in range(size)] if col in categ_col else np.zeros(size)
+                               for col in columns})
+        return {'binary_encoder.pkl': ce.BinaryEncoder(cols=categ_col).fit(sample)}
+    return {}
 
-        with open(os.path.join(module_dir, '../Saved') + '/diverge_categ.pkl', 'wb') as f:
-            pickle.dump(unique_categ, f)
-    if split=="test":
-        with open(os.path.join(module_dir, '../Saved') + '/diverge_categ.pkl', 'rb') as f:
-            unique_categ = pickle.load(f)
+def _compile_category_tables(state, encode, columns):
+    '''
+    Runs the fitted encoders once over the vocab of every encoded column, plus a missing value, giving a
+    lookup table with the encoded row of each code: the row of code c is table[c] and the row of a missing
+    value (code -1) is table[-1]. Encoding a column is then table[codes].
+
+    Returns a dict col -> {'names': encoded column names, 'table': 2-D float array, 'dtype': output dtype}.
+    '''
+    categ_col, two_classes = state['categ_columns.pkl']
+    vocab = {col: _category_vocab(classes) for col, classes in state['diverge_categ.pkl'].items()}
+    probe = {col: pd.Series(vocab[col] + [np.nan], name=col, dtype=object) for col in vocab}
+    tables = {}
 
+    for col, mapping in two_classes.items():
+        tables[col] = {'names': [col], 'table': probe[col].map(mapping).to_numpy(dtype=float)[:, None], 'dtype': 'int64'}
+
+    if encode == 'Ordinal':
+        encoders = state['label_encoders.pkl']
         for col in categ_col:
-            if col not in unique_categ:
-                df.drop([col], axis=1, inplace=True)
-            else:
-                classes=unique_categ[col]
-                label='Other'
-                df[col].mask(~df[col].isin(classes), label, inplace=True) # replace the unseen category with "Other"
+            table = encoders[col].transform(probe[col].astype(str)).to_numpy(dtype=float)
+            tables[col] = {'names': [col], 'table': table, 'dtype': 'int64'}
+
+    elif encode == 'OneHot':
+        onehot_columns = state['onehot_columns.pkl']
+        for col in categ_col:
+            names = [name for name in onehot_columns if name in [f'{col}_{value}' for value in vocab[col]]]
+            table = np.array([[f'{col}_{value}' == name for name in names] for value in probe[col]], dtype=float).reshape(-1, len(names))
+            tables[col] = {'names': names, 'table': table, 'dtype': 'uint8'}
+
+    elif encode == 'Frequency':
+        encoders = state['freq_encoders.pkl']
+        for col in categ_col:
+            tables[col] = {'names': [col], 'table': probe[col].map(encoders[col]).to_numpy(dtype=float)[:, None], 'dtype': 'float64'}
+
+    elif encode == 'Binary':
+        encoder = state['binary_encoder.pkl']
+        size = max([len(probe[col]) for col in categ_col] + [1])
+        sample = pd.DataFrame({col: [probe[col].iloc[min(i, len(probe[col]) - 1)] for i in range(size)] if col in categ_col else np.zeros(size)
+                               for col in columns})
+        encoded = encoder.transform(sample)
+        for col in categ_col:
+            # the binary columns of col are named col_0, col_1, ...
+            names = [name for name in encoded.columns if name not in columns and name.rsplit('_', 1)[0] == col]
+            tables[col] = {'names': names, 'table': encoded[names].to_numpy(dtype=float)[:len(probe[col])], 'dtype': 'int64'}
+
+    return tables
 
-def handle_categories(df, module_dir, encode='Binary', split='train'):
+def handle_categories(df, module_dir, encode='Binary', split='train', state=None, sparse=False):
     '''
     Performs encoding on categorical columns.
 
+    Every categorical column is turned once into integer codes over its vocab (see handle_diverse_categories),
+    and all encoders are applied as a lookup of the codes in a table holding the encoded row of each class.
+
     Parameters
     ----------
     df : pandas.DataFrame
@@ -182,101 +407,108 @@ def handle_categories(df, module_dir, encode='Binary', split='train'):
     
     split : str
         Indicates if encoding is performed on train or test data [train, test, all].
+
+    state : dict or None
+        If given, the fitted encoders are kept in this dict instead of being written to / read from Saved/.
+
+    sparse : bool
+        With encode='OneHot', return a scipy.sparse.csr_matrix holding the same columns as the DataFrame
+        (their names are saved as encoded_columns.pkl), built straight from the codes with one stored value
+        per encoded column and row instead of the wide dense frame.
     
     Returns
     -------
-    df : pandas.DataFrame
-        DataFrame after encoding. The function modifies the DataFrame in-place.
+    df : pandas.DataFrame or scipy.sparse.csr_matrix
+        DataFrame after encoding.
     '''
-    categ_col = [col for col in df.columns if df[col].dtype == 'object' and df[col].nunique() > 2]
-    
-    for col in df.columns:
-        if df[col].dtype == 'object' and df[col].nunique() == 2:
-            df[col] = df[col].map({df[col].unique()[0]: 0, df[col].unique()[1]: 1})
-    
-    if encode == 'Ordinal':
-        if split == 'train' or split == 'all':
-            label_encoders = {}
-            for col in categ_col:
-                df[col] = df[col].astype(str)
-                encoder = ce.OrdinalEncoder(cols=[col])
-                df[col] = encoder.fit_transform(df[col])
-                label_encoders[col] = encoder
-
-            # Save the encoders
-            with open(os.path.join(module_dir, '../Saved') + '/label_encoders.pkl', 'wb') as f:
-                pickle.dump(label_encoders, f)
-
-        elif split == 'test':
-            # Load the encoders
-            with open(os.path.join(module_dir, '../Saved') + '/label_encoders.pkl', 'rb') as f:
-                label_encoders = pickle.load(f)
+    vocab = {col: _category_vocab(classes) for col, classes in _restore(module_dir, 'diverge_categ.pkl', state).items() if col in df.columns}
+    codes = {col: _category_codes(df[col], vocab[col]) for col in vocab}
 
-            for col in categ_col:
-                df[col] = df[col].astype(str)
-                df[col] = label_encoders[col].transform(df[col])
-
-    elif encode == 'OneHot':
-        if split == 'train' or split == 'all':
-            onehot_encoder = pd.get_dummies(df[categ_col], prefix=categ_col)
-            df = pd.concat([df, onehot_encoder], axis=1)
-            df.drop(categ_col, axis=1, inplace=True)
-
-            # Save column names for one-hot encoded features
-            with open(os.path.join(module_dir, '../Saved') + '/onehot_columns.pkl', 'wb') as f:
-                pickle.dump(onehot_encoder.columns.tolist(), f)
-
-        elif split == 'test':
-            # Load the column names for one-hot encoded features
-            with open(os.path.join(module_dir, '../Saved') + '/onehot_columns.pkl', 'rb') as f:
-                onehot_columns = pickle.load(f)
-
-            # Create dummy variables for test set (to ensure same columns)
-            onehot_encoder = pd.get_dummies(df[categ_col], prefix=categ_col)
-            df = pd.concat([df, onehot_encoder], axis=1)
-            df.drop(categ_col, axis=1, inplace=True)
-
-            # Ensure that the test set has the same columns as the training set
-            for col in onehot_columns:
-                if col not in df.columns:
-                    df[col] = 0  # Add missing column with 0 value
-
-            df = df[onehot_columns]  # Reorder columns to match training set
-
-    elif encode == 'Frequency':
-        if split == 'train' or split == 'all':
-            freq_encoders = {}
-            for col in categ_col:
-                freq_encoding = df[col].value_counts() / len(df)
-                df[col] = df[col].map(freq_encoding)
-                freq_encoders[col] = freq_encoding
-
-            # Save frequency encoders
-            with open(os.path.join(module_dir, '../Saved') + '/freq_encoders.pkl', 'wb') as f:
-                pickle.dump(freq_encoders, f)
-
-        elif split == 'test':
-            # Load frequency encoders
-            with open(os.path.join(module_dir, '../Saved') + '/freq_encoders.pkl', 'rb') as f:
-                freq_encoders = pickle.load(f)
-
-            for col in categ_col:
-                df[col] = df[col].map(freq_encoders[col])
+    if split == 'train' or split == 'all':
+        # the classes of each column in order of first appearance, nan included
+        classes = {col: [np.nan if code == -1 else vocab[col][code] for code in pd.unique(codes[col])] for col in vocab}
+        n_classes = {col: sum(value == value for value in classes[col]) for col in vocab}
+        categ_col = [col for col in vocab if n_classes[col] > 2]
+        # columns with only two classes are mapped to 0/1. The mapping is saved so that the test data
+        # is mapped the same way regardless of which class happens to appear first in it.
+        two_classes = {}
+        for col in vocab:
+            if n_classes[col] == 2:
+                present = [value for value in classes[col] if value == value]
+                two_classes[col] = {present[0]: 0, present[1]: 1}
+        _persist(module_dir, 'categ_columns.pkl', [categ_col, two_classes], state)
+
+        counts = {}
+        for col in categ_col:
+            bins = np.bincount(codes[col][codes[col] >= 0], minlength=len(vocab[col]))
+            counts[col] = {value: bins[i] for i, value in enumerate(vocab[col]) if bins[i] > 0}
+        # the encoders see the frame with the two-class columns already mapped, i.e. as numbers
+        columns = list(df.columns)
+        encoders = _fit_encoders(encode, columns, categ_col, classes, counts, df.shape[0])
+        for name, encoder in encoders.items():
+            _persist(module_dir, name, encoder, state)
+        tables = _compile_category_tables({**encoders, 'categ_columns.pkl': [categ_col, two_classes],
+                                           'diverge_categ.pkl': _restore(module_dir, 'diverge_categ.pkl', state)}, encode, columns)
+        _persist(module_dir, 'category_tables.pkl', tables, state)
+    else:
+        categ_col, two_classes = _restore(module_dir, 'categ_columns.pkl', state)
+        tables = _restore(module_dir, 'category_tables.pkl', state)
+
+    def encoded(col):
+        table, dtype = tables[col]['table'], tables[col]['dtype']
+        block = np.asfortranarray(table[codes[col]])
+        # a column keeps its float values only where a code with a nan entry (e.g. an unmapped class) occurs
+        if not np.isnan(table).any(axis=1)[codes[col]].any():
+            return zip(tables[col]['names'], block.astype(dtype).T)
+        return ((name, values if np.isnan(values).any() else values.astype(dtype)) for name, values in zip(tables[col]['names'], block.T))
+
+    # the two-class columns and all columns of the Ordinal, Frequency and Binary encodings are replaced in place,
+    # the OneHot columns go at the end
+    onehot = categ_col if encode == 'OneHot' else []
+    data = {}
+    for col in df.columns:
+        if col in tables and col not in onehot:
+            data.update(encoded(col))
+        elif col in vocab and col not in onehot:
+            data[col] = df[col].astype(object) # a single-class column is left as is
+        elif col not in onehot:
+            data[col] = df[col]
+    names = _encoded_names(df.columns, tables, onehot)
+    if split == 'train' or split == 'all':
+        _persist(module_dir, 'encoded_columns.pkl', names, state)
 
-    elif encode == 'Binary':
-        if split == 'train' or split == 'all':
-            encoder = ce.BinaryEncoder(cols=categ_col)
-            df = encoder.fit_transform(df)
-            with open(os.path.join(module_dir, '../Saved') + '/binary_encoder.pkl', 'wb') as f:
-                pickle.dump(encoder, f)
-        elif split == 'test':
-            with open(os.path.join(module_dir, '../Saved') + '/binary_encoder.pkl', 'rb') as f:
-                encoder = pickle.load(f)
-            df = encoder.transform(df)
+    if sparse and encode == 'OneHot':
+        return _sparse_onehot(pd.DataFrame(data, index=df.index), [(codes[col], tables[col]['table']) for col in onehot])
+    for col in onehot:
+        data.update(encoded(col))
+    return pd.DataFrame(data, index=df.index)
 
-    return df
+def _encoded_names(columns, tables, onehot):
+    # the columns handle_categories outputs: every column in place (encoded or not), the one-hot ones at the end
+    names = [name for col in columns if col not in onehot for name in (tables[col]['names'] if col in tables else [col])]
+    return names + [name for col in onehot for name in tables[col]['names']]
 
-def handle_numericals(df,module_dir,method="standardize", split="train"):
+def _sparse_onehot(dense, onehot):
+    '''
+    Stacks the dense columns and the one-hot columns of every (codes, table) pair into a csr_matrix.
+    A code's table row has a single 1 (or none, for a class without column), so each row of a column
+    is one entry whose position is looked up from the code.
+    '''
+    if any(dtype == 'object' for dtype in dense.dtypes):
+        raise ValueError("A sparse output needs every column numerical, a single-class column was left as text.")
+    rows, cols, width = [np.empty(0, dtype=int)], [np.empty(0, dtype=int)], 0
+    for codes, table in onehot:
+        # the column of each code (the last code is the one of a missing value), -1 if it has none
+        position = np.where(table.any(axis=1), table.argmax(axis=1) + width, -1)[codes]
+        keep = position >= 0
+        rows.append(np.flatnonzero(keep))
+        cols.append(position[keep])
+        width += table.shape[1]
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    ones = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(dense.shape[0], width))
+    return sp.hstack([sp.csr_matrix(dense.to_numpy(dtype=float)), ones], format='csr')
+
+def handle_numericals(df,module_dir,method="standardize", split="train", state=None, n_jobs=1, backend='thread'):
     '''
     Let the numerical columns all within close scale to avoid the common probelms(e.g. slow convergence, sensitivity to scale)
     Parameters
@@ -288,50 +520,47 @@ def handle_numericals(df,module_dir,method="standardize", split="train"):
                 either standardize  or normalize
     split:
                 either train or test
+    state:
+                if given, the learned means/stds (mins/maxs) are kept in this dict instead of Saved/
+    n_jobs, backend:
+                number of workers (and 'thread' or 'process' pool) the columns are spread over
     -------
     Returns
     -------
     None. Everything is done inplace
     '''
-    numerical_columns = [ col for col in df.columns if df[col].dtype == 'int64' or df[col].dtype =='float64']
-    if (split=='train' or split=='all') and method=='standardize':
-        means, stds = [], []
-        for col in numerical_columns:
-                means.append(df[col].mean())
-                stds.append(df[col].std())
-                if df[col].std()!=0:
-                    df[col] = (df[col] - df[col].mean())/df[col].std()
-        # save the means and stds for later use
-        np.save(os.path.join(module_dir, '../Saved') + '/means.npy', means)
-        np.save(os.path.join(module_dir, '../Saved') + '/stds.npy', stds)
-
-    if split=='test' and method=='standardize':
-        means = np.load(os.path.join(module_dir, '../Saved') + '/means.npy')
-        stds = np.load(os.path.join(module_dir, '../Saved') + '/stds.npy')
-        for i,col in enumerate(numerical_columns):
-            if stds[i]!=0:
-                df[col] = (df[col]- means[i])/stds[i]
-
-    if (split=='train' or split=='all') and method=='normalize':
-        mins,maxs=[],[]
-        for col in numerical_columns:
-            min_val,max_val = df[col].min() ,df[col].max()
-            mins.append(min_val)
-            maxs.append(max_val)
-            if min_val != max_val:
-                df[col] = (df[col] - min_val)/(max_val - min_val)
-        # save the mins and maxs for later use
-        np.save(os.path.join(module_dir, '../Saved') + '/mins.npy', mins)
-        np.save(os.path.join(module_dir, '../Saved') + '/maxs.npy', maxs)
-
-    if split=='test' and method=='normalize':
-        mins = np.load(os.path.join(module_dir, '../Saved') + '/mins.npy')
-        maxs = np.load(os.path.join(module_dir, '../Saved') + '/maxs.npy')
-        for i,col in enumerate(numerical_columns):
-            if maxs[i] != mins[i]:
-                df[col] = (df[col] - mins[i])/(maxs[i] - mins[i])
-
-def handle_outliers(x_data, y_data, module_dir, method='median', split="train",skip=[]):
+    numerical_columns = get_numerical_columns(df)
+    if method=='standardize':
+        if split=='train' or split=='all':
+            results = _map_columns(_column_standardize, [(df[col],) for col in numerical_columns], n_jobs, backend)
+            means, stds = [result[0] for result in results], [result[1] for result in results]
+            # save the means and stds for later use
+            _persist(module_dir, 'means.npy', np.array(means), state)
+            _persist(module_dir, 'stds.npy', np.array(stds), state)
+
+        if split=='test':
+            means = _restore(module_dir, 'means.npy', state)
+            stds = _restore(module_dir, 'stds.npy', state)
+            results = _map_columns(_column_standardize, [(df[col], means[i], stds[i]) for i,col in enumerate(numerical_columns)], n_jobs, backend)
+
+    if method=='normalize':
+        if split=='train' or split=='all':
+            results = _map_columns(_column_normalize, [(df[col],) for col in numerical_columns], n_jobs, backend)
+            mins, maxs = [result[0] for result in results], [result[1] for result in results]
+            # save the mins and maxs for later use
+            _persist(module_dir, 'mins.npy', np.array(mins), state)
+            _persist(module_dir, 'maxs.npy', np.array(maxs), state)
+
+        if split=='test':
+            mins = _restore(module_dir, 'mins.npy', state)
+            maxs = _restore(module_dir, 'maxs.npy', state)
+            results = _map_columns(_column_normalize, [(df[col], mins[i], maxs[i]) for i,col in enumerate(numerical_columns)], n_jobs, backend)
+
+    if method in ['standardize', 'normalize']:
+        for col, result in zip(numerical_columns, results):
+            df[col] = result[2]
+
+def handle_outliers(x_data, y_data, module_dir, method='median', split="train",skip=[], state=None, n_jobs=1, backend='thread'):
     '''
     Handles outliers in the dataset.
     
@@ -353,6 +582,12 @@ def handle_outliers(x_data, y_data, module_dir, method='median', split="train",s
     module_dir: str
         The directory where the metrics (like thresholds or medians) are saved.
 
+    state: dict or None
+        If given, the thresholds and medians are kept in this dict instead of being saved under module_dir.
+
+    n_jobs, backend: int, str
+        Number of workers (and 'thread' or 'process' pool) the columns are spread over.
+
     Returns
     -------
     x_data : pandas.DataFrame
@@ -362,79 +597,64 @@ def handle_outliers(x_data, y_data, module_dir, method='median', split="train",s
         The target data with rows corresponding to deleted outliers removed (if 'delete' method is used).
     '''
     
-    numerical_columns = [col for col in x_data.columns if x_data[col].dtype in ['int64', 'float64']]
+    numerical_columns = get_numerical_columns(x_data)
 
     # Calculate or load the outlier ranges once
     if split == 'train' or split == 'all':
-        outlier_ranges = {}
-        for column_name in numerical_columns:
-            lower, upper = calc_outliers_range(x_data, column_name)
-            outlier_ranges[column_name] = (lower, upper)
+        ranges = _map_columns(_column_outliers_range, [(x_data[col],) for col in numerical_columns], n_jobs, backend)
+        outlier_ranges = dict(zip(numerical_columns, ranges))
         
         # Save the calculated outlier ranges
-        with open(os.path.join(module_dir, '../Saved') + '/outlier_ranges.pkl', 'wb') as f:
-            pickle.dump(outlier_ranges, f)
+        _persist(module_dir, 'outlier_ranges.pkl', outlier_ranges, state)
 
     elif split == 'test':
         # Load the outlier ranges calculated from the training set
-        with open(os.path.join(module_dir, '../Saved') + '/outlier_ranges.pkl', 'rb') as f:
-            outlier_ranges = pickle.load(f)
+        outlier_ranges = _restore(module_dir, 'outlier_ranges.pkl', state)
 
     # Apply the chosen method for handling outliers
+    columns = [col for col in numerical_columns if col not in skip]
+    if method in ['delete', 'cap'] and columns:
+        # the non-skipped columns as one contiguous float block with a bound vector per side
+        block = np.ascontiguousarray(x_data[columns].to_numpy(dtype=_float_dtype(x_data[columns])))
+        lower = np.array([outlier_ranges[col][0] for col in columns], dtype=float)
+        upper = np.array([outlier_ranges[col][1] for col in columns], dtype=float)
+
     if method == 'delete':
-        indices_to_drop = []
-        for column_name in numerical_columns:
-            if column_name in skip:
-                continue
-            lower, upper = outlier_ranges[column_name]
-            mask = x_data[(x_data[column_name] < lower) | (x_data[column_name] > upper)].index
-            indices_to_drop.extend(mask)
-        
         # Drop rows with outliers in x_data and corresponding y_data
-        indices_to_drop = list(set(indices_to_drop))  # Remove duplicates
-        x_data.drop(indices_to_drop, inplace=True)
-        y_data.drop(indices_to_drop, inplace=True)
+        if columns:
+            outlier_rows = ((block < lower) | (block > upper)).any(axis=1)
+            indices_to_drop = x_data.index[outlier_rows]
+            x_data.drop(indices_to_drop, inplace=True)
+            y_data.drop(indices_to_drop, inplace=True)
 
     elif method == 'cap':
-        for column_name in numerical_columns:
-            if column_name in skip:
-                continue
-            lower, upper = outlier_ranges[column_name]
-            x_data[column_name] = np.where(x_data[column_name] > upper, upper, x_data[column_name])
-            x_data[column_name] = np.where(x_data[column_name] < lower, lower, x_data[column_name])
+        if columns:
+            # nans stay nans through the clip
+            np.clip(block, lower, upper, out=block)
+            x_data[columns] = block
 
     elif method == 'median':
         if split == 'train' or split == 'all':
-            medians = {}
-            for column_name in numerical_columns:
-                lower, upper = outlier_ranges[column_name]
-                mask = (x_data[column_name] < lower) | (x_data[column_name] > upper)
-                x_data.loc[mask, column_name] = x_data[column_name].median()
-                medians[column_name] = x_data[column_name].median()
+            results = _map_columns(_column_replace_outliers, [(x_data[col], *outlier_ranges[col]) for col in numerical_columns], n_jobs, backend)
+            medians = {col: result[1] for col, result in zip(numerical_columns, results)}
 
             # Save the medians for use during testing
-            with open(os.path.join(module_dir, '../Saved') + '/outlier_medians.pkl', 'wb') as f:
-                pickle.dump(medians, f)
+            _persist(module_dir, 'outlier_medians.pkl', medians, state)
 
         elif split == 'test':
             # Load medians from the training set
-            with open(os.path.join(module_dir, '../Saved') + '/outlier_medians.pkl', 'rb') as f:
-                medians = pickle.load(f)
+            medians = _restore(module_dir, 'outlier_medians.pkl', state)
+            results = _map_columns(_column_replace_outliers, [(x_data[col], *outlier_ranges[col], medians[col]) for col in numerical_columns], n_jobs, backend)
 
-            for column_name in numerical_columns:
-                lower, upper = outlier_ranges[column_name]
-                mask = (x_data[column_name] < lower) | (x_data[column_name] > upper)
-                x_data.loc[mask, column_name] = medians[column_name]
+        for col, result in zip(numerical_columns, results):
+            x_data[col] = result[0]
 
     elif method == 'log_transform':
         
         # Log transform does not need outlier range calculation, just apply it directly
-        for column_name in numerical_columns:
-            if column_name in skip:
-                continue
-            if (x_data[column_name] < -1).any():
-                print(f"Warning: Negative values detected in {column_name} which will result in NaNs.")
-            x_data[column_name] = np.log(x_data[column_name] + 1)
+        logs = _map_columns(_column_log, [(x_data[col],) for col in columns], n_jobs, backend)
+        for col, values in zip(columns, logs):
+            x_data[col] = values
 
     return x_data, y_data
 
@@ -478,7 +698,7 @@ def handle_oversampling(x_data, y_data,split ,method='smot', **kwargs):
     
     return x_data, y_data
 
-def apply_pca(x_data, module_dir, variance_threshold=0.95, split="train"):
+def apply_pca(x_data, module_dir, variance_threshold=0.95, split="train", state=None):
     '''
     Applies PCA to reduce dimensionality.
 
@@ -496,6 +716,9 @@ def apply_pca(x_data, module_dir, variance_threshold=0.95, split="train"):
     module_dir: str
         The directory where the PCA model is saved.
 
+    state: dict or None
+        If given, the fitted PCA model is kept in this dict instead of being saved under module_dir.
+
     Returns
     -------
     x_data_pca : pandas.DataFrame
@@ -509,13 +732,11 @@ def apply_pca(x_data, module_dir, variance_threshold=0.95, split="train"):
         x_data_pca = pca.fit_transform(x_data)
         
         # Save the PCA model for future use
-        with open(os.path.join(module_dir, '../Saved') + '/pca_model.pkl', 'wb') as f:
-            pickle.dump(pca, f)
+        _persist(module_dir, 'pca_model.pkl', pca, state)
 
     elif split == 'test':
         # Load the saved PCA model from the training phase
-        with open(os.path.join(module_dir, '../Saved') + '/pca_model.pkl', 'rb') as f:
-            pca = pickle.load(f)
+        pca = _restore(module_dir, 'pca_model.pkl', state)
 
         # Apply PCA transformation on the test data
         x_data_pca = pca.transform(x_data)
@@ -525,9 +746,426 @@ def apply_pca(x_data, module_dir, variance_threshold=0.95, split="train"):
     
     return x_data_pca
 
-def read_data(split="train", nulls="mix",outliers="cap", standardize="standardize",encode='Binary',pca_threshold=None,skip=[],oversample='smot',**kwargs):
+def partial_stats(x_data):
+    '''
+    Mergeable statistics of the raw columns of a part of the training rows: sorted runs and nan counts of the
+    numericals, value counts of the categoricals. The 'mix' null fills and the outlier ranges of any union of
+    parts follow from them without scanning the rows again (see merge_partial_stats and ChurnPreprocessor.fit_transform).
+    '''
+    numerical = get_numerical_columns(x_data)
+    counts = {}
+    for col in get_categorical_columns(x_data):
+        values = x_data[col].value_counts()
+        counts[col] = Counter(values[values > 0].to_dict())  # Categorical columns also count their unused categories
+    return {'runs': {col: SortedRuns().update(x_data[col].to_numpy(dtype=float)) for col in numerical},
+            'nans': {col: int(x_data[col].isna().sum()) for col in numerical}, 'counts': counts}
+
+def merge_partial_stats(parts):
+    '''
+    Statistics of the union of disjoint parts, from their partial_stats.
+    '''
+    merged = {'runs': {}, 'nans': Counter(), 'counts': {}}
+    for part in parts:
+        for col, runs in part['runs'].items():
+            merged['runs'].setdefault(col, SortedRuns()).merge(runs)
+        merged['nans'].update(part['nans'])
+        for col, counts in part['counts'].items():
+            merged['counts'].setdefault(col, Counter()).update(counts)
+    return merged
+
+def _partial_state(partials, numerical, categorical, outliers):
+    # the state handle_nulls('mix') and handle_outliers learn on the train split, from merged partial_stats
+    medians = pd.Series({col: partials['runs'][col].median() for col in numerical}, index=numerical, dtype=float)
+    modes = {}
+    for col in categorical:
+        top = max(partials['counts'][col].values())
+        modes[col] = min(value for value, count in partials['counts'][col].items() if count == top)  # pandas' mode()[0] on ties
+    state = {'null_mix.pkl': [medians, modes]}
+    if outliers != 'median':
+        # the ranges are computed on the null-filled columns, i.e. with the nans counted as the median
+        state['outlier_ranges.pkl'] = {}
+        for col in numerical:
+            q1, q3 = partials['runs'][col].quantile([0.25, 0.75], point=medians[col], weight=partials['nans'][col])
+            state['outlier_ranges.pkl'][col] = (q1 - 1.5*(q3 - q1), q3 + 1.5*(q3 - q1))
+    return state
+
+class ChurnPreprocessor:
+    '''
+    The whole cleaning chain of read_data as one fitted object.
+
+    All learned parameters (null medians/modes, outlier ranges, means/stds, seen categories, encoders, PCA)
+    are kept in memory in self.state instead of one pickle per step under Saved/. The object itself is saved
+    and loaded as a single versioned artifact, so transforming a batch does not open any file and can never
+    pick up a stale parameter file from another run.
+
+    Parameters
+    ----------
+    nulls, outliers, standardize, encode, pca_threshold, skip, oversample:
+        Same meaning as in read_data.
+
+    n_jobs, backend:
+        The column-wise steps (nulls, outliers, scaling, rare categories) are spread over n_jobs workers
+        of a 'thread' or 'process' pool. The result is the same whatever the number of workers.
+
+    compact:
+        If True, the data is processed as float32 and Categorical columns (see compact_dtypes) up to the
+        encoding step. Statistics are then computed in 32 bits, so results differ slightly from the default.
+
+    sparse:
+        If True and encode='OneHot', the output is a scipy.sparse.csr_matrix whose columns are feature_names.
+    '''
+    def __init__(self, nulls="mix", outliers="cap", standardize="standardize", encode='Binary', pca_threshold=None, skip=[], oversample='smot',
+                 n_jobs=1, backend='thread', compact=False, sparse=False):
+        if sparse and pca_threshold is not None:
+            raise ValueError("PCA is not supported with a sparse output.")
+        self.nulls = nulls
+        self.outliers = outliers
+        self.standardize = standardize
+        self.encode = encode
+        self.pca_threshold = pca_threshold
+        self.skip = list(skip)
+        self.oversample = oversample
+        self.n_jobs = n_jobs
+        self.backend = backend
+        self.compact = compact
+        self.sparse = sparse
+        self.state = {}
+        self.columns = []
+        self.categorical = []
+        self.fitted = False
+
+    def get_params(self):
+        '''
+        Returns the options that affect the learned state (oversampling is only applied while fitting).
+        '''
+        return {"nulls": self.nulls, "outliers": self.outliers, "standardize": self.standardize,
+                "encode": self.encode, "pca_threshold": self.pca_threshold, "skip": self.skip, "compact": self.compact}
+
+    @property
+    def feature_names(self):
+        '''
+        Names of the output columns, also when the output is an array (sparse or after PCA).
+        '''
+        if 'pca_model.pkl' in self.state:
+            return [f'PC{i+1}' for i in range(self.state['pca_model.pkl'].n_components_)]
+        return self.state.get('encoded_columns.pkl')
+
+    def _process(self, x_data, y_data, split, partials=None):
+        # work on copies since the handle_* functions modify their input inplace
+        x_data, y_data = x_data.copy(), y_data.copy()
+        if self.compact:
+            x_data = compact_dtypes(x_data)
+
+        # the null fills and outlier ranges taken from merged partial statistics, these steps then only apply them
+        nulls_split, outliers_split = split, split
+        if partials is not None and split != 'test' and self.nulls == 'mix' and not self.compact:
+            self.state.update(_partial_state(partials, get_numerical_columns(x_data), get_categorical_columns(x_data), self.outliers))
+            nulls_split = 'test'
+            outliers_split = 'test' if 'outlier_ranges.pkl' in self.state else split
+
+        # data cleaning stage for all columns
+        jobs = {"n_jobs": self.n_jobs, "backend": self.backend}
+        handle_nulls(x_data, y_data, None, method=self.nulls, split=nulls_split, state=self.state, **jobs)
+
+        # transformations for numerical data
+        x_data, y_data = handle_outliers(x_data, y_data, None, method=self.outliers, split=outliers_split, skip=self.skip, state=self.state, **jobs)
+        handle_numericals(x_data, None, method=self.standardize, split=split, state=self.state, **jobs)  #the order of calling this and the above function matters
+
+        # transformations for categorical data
+        handle_diverse_categories(x_data, None, split=split, state=self.state, **jobs)
+        x_data = handle_categories(x_data, None, split=split, encode=self.encode, state=self.state, sparse=self.sparse) #the order of calling this and the above function matters
+
+        if self.pca_threshold != None:
+            x_data = apply_pca(x_data, None, variance_threshold=self.pca_threshold, split=split, state=self.state)
+
+        x_data, y_data = handle_oversampling(x_data, y_data, split=split, method=self.oversample)
+        return x_data, y_data
+
+    def fit_transform(self, x_data, y_data, split='train', partials=None):
+        '''
+        Learns the preprocessing state from x_data/y_data and returns them transformed.
+        split is 'train' (oversampling applied) or 'all' (no oversampling), as in read_data.
+
+        partials are the merge_partial_stats of parts whose union is x_data, e.g. the other folds of a
+        cross-validation. With nulls='mix' the null fills and outlier ranges are then derived from them instead
+        of scanning x_data, with the same result (compact mode always scans).
+        '''
+        if split not in ['train', 'all']:
+            raise ValueError("Invalid split parameter. Use 'train' or 'all'.")
+        self.state = {}
+        self.columns = list(x_data.columns)
+        self.categorical = get_categorical_columns(x_data)
+        x_data, y_data = self._process(x_data, y_data, split, partials)
+        self.fitted = True
+        return x_data, y_data
+
+    def fit(self, x_data, y_data, split='train', partials=None):
+        self.fit_transform(x_data, y_data, split=split, partials=partials)
+        return self
+
+    def transform(self, x_data, y_data=None):
+        '''
+        Applies the learned state to new data. y_data is optional, it is only needed to keep the target
+        aligned when rows are dropped (nulls='drop' or outliers='delete').
+        '''
+        if not self.fitted:
+            raise ValueError("ChurnPreprocessor is not fitted yet. Call fit or fit_transform first.")
+        if y_data is None:
+            x_data, _ = self._process(x_data, pd.Series(0, index=x_data.index), 'test')
+            return x_data, None
+        return self._process(x_data, y_data, 'test')
+
+    def save(self, path):
+        '''
+        Saves the fitted preprocessor as one versioned artifact.
+        '''
+        with open(path, 'wb') as f:
+            pickle.dump({"version": PREPROCESSOR_VERSION, "preprocessor": self}, f)
+
+    @staticmethod
+    def load(path):
+        '''
+        Loads a preprocessor saved with save. Artifacts written by another version of the pipeline are rejected.
+        '''
+        with open(path, 'rb') as f:
+            artifact = pickle.load(f)
+        if not isinstance(artifact, dict) or artifact.get("version") != PREPROCESSOR_VERSION:
+            raise ValueError(f"{path} was not saved by preprocessor version {PREPROCESSOR_VERSION}. Refit it with read_data(split='train').")
+        return artifact["preprocessor"]
+
+def preprocessor_path(module_dir=None):
+    '''
+    Location of the preprocessor artifact written by read_data.
+    '''
+    module_dir = module_dir or os.path.dirname(__file__)
+    return os.path.join(module_dir, '../Saved') + '/preprocessor.pkl'
+
+def data_path(split, module_dir=None, file_format='csv'):
+    '''
+    Location of the data file read for a given split, as CSV or as the 'parquet'/'feather' copy written by convert_data.
+    '''
+    module_dir = module_dir or os.path.dirname(__file__)
+    if file_format not in ['csv', 'parquet', 'feather']:
+        raise ValueError("Invalid file_format parameter. Use 'csv', 'parquet' or 'feather'.")
+    if split == "train" or split=="val":    name = 'train'
+    elif split == "test":    name = 'test'
+    elif split == "all":    name = 'cell2celltrain'
+    else:    raise ValueError("Invalid split parameter. Use 'train', 'val', 'test' or 'all'.")
+    return os.path.join(module_dir, '../DataFiles') + f'/{name}.{file_format}'
+
+def convert_data(splits=['train', 'test', 'all'], file_format='parquet', lossless=True, module_dir=None):
+    '''
+    One-time conversion of the DataFiles CSVs to a typed columnar copy next to them.
+
+    Text columns are stored as dictionary-encoded categoricals and numerical columns as float32 (integer
+    columns as int32), so the file is parsed without any dtype inference and holds each value in 4 bytes.
+
+    Parameters
+    ----------
+    splits : list
+        The splits whose CSV is converted, missing CSVs are skipped.
+
+    file_format : str
+        'parquet' or 'feather'.
+
+    lossless : bool
+        If True, a column whose values do not survive the cast to 32 bits (e.g. amounts like 12.34) is kept
+        in 64 bits, so that reading the copy gives exactly the values of the CSV. Default is True.
+
+    Returns
+    -------
+    paths : list
+        The files written.
+    '''
+    paths = []
+    for split in splits:
+        csv = data_path(split, module_dir)
+        if not os.path.exists(csv):
+            continue
+        df = pd.read_csv(csv)
+        for col in df.columns:
+            if df[col].dtype == 'object':
+                df[col] = df[col].astype('category')
+                continue
+            narrow = np.int32 if df[col].dtype == 'int64' and df[col].abs().max() < 2**31 else np.float32
+            values = df[col].to_numpy()
+            if not lossless or np.array_equal(values.astype(narrow).astype(values.dtype), values, equal_nan=True):
+                df[col] = df[col].astype(narrow)
+        path = data_path(split, module_dir, file_format)
+        if file_format == 'parquet':
+            df.to_parquet(path, index=False)
+        else:
+            df.to_feather(path)
+        paths.append(path)
+    return paths
+
+def load_data(split, file_format='csv', module_dir=None, compact=False):
+    '''
+    Reads the data file of a split with the dtypes the pipeline works on (text as object, numbers as int64/float64),
+    or with the dtypes of compact_dtypes if compact is True.
+
+    A 'parquet' or 'feather' copy is read with its stored schema and only the columns the pipeline uses,
+    CustomerID is never loaded (so duplicate rows are detected on the remaining columns).
+    '''
+    path = data_path(split, module_dir, file_format)
+    if file_format == 'csv':
+        df = pd.read_csv(path)
+        return compact_dtypes(df) if compact else df
+
+    import pyarrow.ipc
+    import pyarrow.parquet
+    schema = pyarrow.parquet.read_schema(path) if file_format == 'parquet' else pyarrow.ipc.open_file(path).schema
+    columns = [col for col in schema.names if col != 'CustomerID']
+    if file_format == 'parquet':
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        df = pd.read_feather(path, columns=columns)
+    if compact:
+        return compact_dtypes(df)
+
+    # back to the dtypes a CSV parse gives
+    for col in df.columns:
+        if df[col].dtype == 'category':
+            df[col] = df[col].astype(object)
+        elif df[col].dtype.kind == 'i':
+            df[col] = df[col].astype('int64')
+        elif df[col].dtype.kind == 'f':
+            df[col] = df[col].astype('float64')
+    return df
+
+def split_target(df, target_variable='Churn'):
+    '''
+    Maps the target variable to 0 and 1 and separates it from the features (CustomerID is dropped).
+    Returns y_data as None if the file has no target column (e.g. a scoring snapshot).
+    '''
+    if target_variable not in df.columns:
+        return df.drop(["CustomerID"], axis=1, errors='ignore'), None
+    y_data = df[target_variable].astype(object).map({'Yes': 1, 'No': 0})
+    x_data = df.drop([target_variable,"CustomerID"], axis=1, errors='ignore')
+    return x_data, y_data
+
+def cache_path(module_dir=None):
+    '''
+    Directory of the read_data output cache.
+    '''
+    module_dir = module_dir or os.path.dirname(__file__)
+    return os.path.join(module_dir, '../Saved') + '/cache'
+
+def _file_digest(path, digest=None):
+    digest = digest or hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest
+
+def _cache_key(params, module_dir):
+    '''
+    Content address of a read_data call: the bytes of the input file, every option and the preprocessor
+    version. The test split also depends on the bytes of the saved preprocessor it loads.
+    Returns None when the call cannot be cached (e.g. no preprocessor was saved yet).
+    '''
+    digest = hashlib.sha256(json.dumps({**params, "version": PREPROCESSOR_VERSION}, sort_keys=True, default=str).encode())
+    _file_digest(data_path(params["split"], module_dir, params["file_format"]), digest)
+    if params["split"] == 'test':
+        if not os.path.exists(preprocessor_path(module_dir)):
+            return None
+        _file_digest(preprocessor_path(module_dir), digest)
+    return digest.hexdigest()
+
+def _cache_load(key, split, module_dir):
+    '''
+    Returns the cached outputs of a read_data call, or None on a miss. A hit on a fitting split also puts
+    back the preprocessor that was saved with it, as running the call would have done.
+    '''
+    entry = os.path.join(cache_path(module_dir), key)
+    if not os.path.exists(os.path.join(entry, 'meta.json')):
+        return None
+    with open(os.path.join(entry, 'meta.json')) as f:
+        meta = json.load(f)
+    outputs = []
+    for name, kind in meta["outputs"]:
+        if kind is None:
+            outputs.append(None)
+            continue
+        if kind == 'sparse':
+            outputs.append(sp.load_npz(os.path.join(entry, name + '.npz')))
+            continue
+        if kind == 'array':
+            outputs.append(np.load(os.path.join(entry, name + '.npy')))
+            continue
+        data = pd.read_parquet(os.path.join(entry, name + '.parquet'))
+        outputs.append(data.iloc[:, 0].rename(meta["names"][name]) if kind == 'series' else data)
+    if split != 'test':
+        shutil.copyfile(os.path.join(entry, 'preprocessor.pkl'), preprocessor_path(module_dir))
+    # the modification time of an entry is its last use, for the LRU eviction
+    os.utime(entry)
+    return tuple(outputs)
+
+def _cache_store(key, outputs, split, module_dir, cache_size):
+    '''
+    Writes the outputs of a read_data call (frames and series as Parquet, the PCA arrays as .npy, sparse
+    matrices as .npz) under their key, then evicts the least recently used entries until the cache holds
+    at most cache_size bytes. A failed write leaves nothing behind.
+    '''
+    root = cache_path(module_dir)
+    tmp = os.path.join(root, f'{key}.{os.getpid()}.tmp')
+    os.makedirs(tmp, exist_ok=True)
+    try:
+        meta = {"outputs": [], "names": {}}
+        for i, data in enumerate(outputs):
+            name = f'output_{i}'
+            if data is None:
+                meta["outputs"].append([name, None])
+                continue
+            if sp.issparse(data):
+                sp.save_npz(os.path.join(tmp, name + '.npz'), data.tocsr())
+                meta["outputs"].append([name, 'sparse'])
+                continue
+            if isinstance(data, np.ndarray):
+                np.save(os.path.join(tmp, name + '.npy'), data)
+                meta["outputs"].append([name, 'array'])
+                continue
+            kind = 'series' if isinstance(data, pd.Series) else 'frame'
+            if kind == 'series':
+                meta["names"][name] = data.name
+                data = data.to_frame(name='values')
+            data.to_parquet(os.path.join(tmp, name + '.parquet'))
+            meta["outputs"].append([name, kind])
+        if split != 'test':
+            shutil.copyfile(preprocessor_path(module_dir), os.path.join(tmp, 'preprocessor.pkl'))
+        with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+    except BaseException:
+        # no stale staging directory, whatever stopped the write
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    # a complete entry appears at once, so a concurrent or interrupted run never sees a partial one
+    entry = os.path.join(root, key)
+    if os.path.exists(entry):
+        shutil.rmtree(tmp)
+    else:
+        os.rename(tmp, entry)
+
+    entries = []
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if name != key and os.path.isdir(path) and not name.endswith('.tmp'):
+            size = sum(os.path.getsize(os.path.join(path, file)) for file in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, path))
+    total = sum(size for _, size, _ in entries) + sum(os.path.getsize(os.path.join(entry, file)) for file in os.listdir(entry))
+    for _, size, path in sorted(entries):
+        if total <= cache_size:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+def read_data(split="train", nulls="mix",outliers="cap", standardize="standardize",encode='Binary',pca_threshold=None,skip=[],oversample='smot',n_jobs=1,cache=True,cache_size=2**30,file_format='csv',compact=False,sparse=False,**kwargs):
     '''
     Reads the data from the CSV file and performs data cleaning and preprocessing.
+
+    The preprocessing is fitted on the train ('train', 'val', 'all') split and saved as a single
+    ChurnPreprocessor artifact (Saved/preprocessor.pkl), which the 'test' split then loads.
     
     Parameters
     ----------
@@ -545,6 +1183,28 @@ def read_data(split="train", nulls="mix",outliers="cap", standardize="standardiz
     
     encode : str
         The method to encode categorical data ['Binary', 'OneHot', 'Ordinal', 'Frequency']. Default is 'Binary'.
+
+    n_jobs : int
+        Number of threads the column-wise preprocessing is spread over (-1 for all cores). Default is 1.
+
+    cache : bool
+        Whether to reuse the outputs of a previous call with the same input file and options. They are kept
+        in Saved/cache, keyed by a hash of the file bytes and of all the options. Default is True.
+
+    cache_size : int
+        Size in bytes above which the least recently used cache entries are removed. Default is 1 GiB.
+
+    file_format : str
+        Read the split from its CSV ('csv') or from the typed copy written by convert_data ('parquet', 'feather').
+        Default is 'csv'.
+
+    compact : bool
+        Whether to load and process the data as float32 and Categorical columns, to about halve the memory
+        of the cleaning chain (see ChurnPreprocessor). Default is False.
+
+    sparse : bool
+        With encode='OneHot', return the features as a scipy.sparse.csr_matrix instead of a DataFrame, its column
+        names are ChurnPreprocessor.load(preprocessor_path()).feature_names. Default is False.
     
     Returns
     -------
@@ -554,48 +1214,253 @@ def read_data(split="train", nulls="mix",outliers="cap", standardize="standardiz
     y_data : pandas.Series
         The Series containing the target variable.
     '''
-    def process(x_data,y_data,module_dir,split="train", nulls="mix",outliers="cap", standardize="standardize",encode='Binary',pca_threshold=None,skip=[],oversample='smot',**kwargs):
-       
-        # data cleaning stage for all columns
-        handle_nulls(x_data,y_data,module_dir,split=split,method=nulls)
-
-        # transformations for numerical data
-        x_data,y_data=handle_outliers(x_data,y_data,module_dir, method=outliers, split="train",skip=skip)
-        handle_numericals(x_data,module_dir,method=standardize, split=split)  #the order of calling this and the above function matters
-
-        # transformations for categorical data
-        handle_diverse_categories(x_data,module_dir,split=split)
-        x_data=handle_categories(x_data,module_dir,split=split, encode=encode) #the order of calling this and the above function matters
-        
-        if pca_threshold!=None:
-            x_data=apply_pca(x_data,module_dir,variance_threshold=pca_threshold,split=split)
-        
-        x_data, y_data=handle_oversampling(x_data, y_data,split=split, method=oversample)
-            
-        return x_data, y_data
-
     module_dir = os.path.dirname(__file__)
-    if split == "train" or split=="val":    path = os.path.join(module_dir, '../DataFiles/train.csv')
-    elif split == "test":    path = os.path.join(module_dir, '../DataFiles/test.csv')
-    elif split == "all":    path = os.path.join(module_dir, '../DataFiles/cell2celltrain.csv')
-           
-    target_variable='Churn'
-
-    df = pd.read_csv(path)
+    if cache:
+        params = dict(split=split, nulls=nulls, outliers=outliers, standardize=standardize, encode=encode,
+                      pca_threshold=pca_threshold, skip=list(skip), oversample=oversample, file_format=file_format, compact=compact, sparse=sparse)
+        key = _cache_key(params, module_dir)
+        outputs = _cache_load(key, split, module_dir) if key else None
+        if outputs is not None:
+            return outputs
+        outputs = read_data(split, nulls, outliers, standardize, encode, pca_threshold, skip, oversample, n_jobs,
+                            cache=False, file_format=file_format, compact=compact, sparse=sparse)
+        if key:
+            try:
+                _cache_store(key, outputs, split, module_dir, cache_size)
+            except ImportError:
+                warnings.warn("pyarrow is required to cache the outputs of read_data as Parquet, they are not cached.")
+        return outputs
+
+    df = load_data(split, file_format, module_dir, compact)
     # drop duplicates
     df.drop_duplicates(inplace=True)
     # map the target variable to 0 and 1 for binary classification
-    df[target_variable] = df[target_variable].map({'Yes': 1, 'No': 0})
-    y_data = df[target_variable]
-    x_data = df.drop([target_variable,"CustomerID"], axis=1)
+    x_data, y_data = split_target(df)
+
+    preprocessor = ChurnPreprocessor(nulls=nulls, outliers=outliers, standardize=standardize, encode=encode,
+                                     pca_threshold=pca_threshold, skip=skip, oversample=oversample, n_jobs=n_jobs, compact=compact, sparse=sparse)
     
     if split=='val':
         x_train, x_test, y_train, y_test = train_test_split(x_data, y_data, test_size=0.2, random_state=42)
-        x_train, y_train= process( x_train, y_train,module_dir,split="train", nulls=nulls,outliers=outliers, standardize=standardize,encode=encode,pca_threshold=pca_threshold,skip=skip, oversample=oversample)
-        x_test, y_test= process(x_test, y_test,module_dir,split="test", nulls=nulls,outliers=outliers, standardize=standardize,encode=encode,pca_threshold=pca_threshold,skip=skip, oversample=oversample)
+        x_train, y_train = preprocessor.fit_transform(x_train, y_train)
+        x_test, y_test = preprocessor.transform(x_test, y_test)
+        preprocessor.save(preprocessor_path(module_dir))
         return x_train, x_test, y_train, y_test
+    elif split=='test':
+        fitted = ChurnPreprocessor.load(preprocessor_path(module_dir))
+        if fitted.get_params() != preprocessor.get_params():
+            raise ValueError(f"The saved preprocessor was fitted with {fitted.get_params()}, read the train split with the same options first.")
+        fitted.n_jobs, fitted.sparse = n_jobs, sparse
+        x_data, y_data = fitted.transform(x_data, y_data)
+        return x_data, y_data, None, None
     else:
-        x_data, y_data = process(x_data, y_data,module_dir,split=split, nulls=nulls,outliers=outliers, standardize=standardize,encode=encode,pca_threshold=pca_threshold,skip=skip, oversample=oversample)
+        x_data, y_data = preprocessor.fit_transform(x_data, y_data, split=split)
+        preprocessor.save(preprocessor_path(module_dir))
         return x_data, y_data, None, None
 
+def _read_chunks(path, chunksize, drop_duplicates=True, categorical=[]):
+    '''
+    Reads a CSV chunk by chunk, dropping rows already seen in this or a previous chunk.
+    The categorical columns are always read as strings, so that a chunk which happens to hold only
+    numbers in such a column (e.g. HandsetPrice) is not parsed differently from the others.
+    '''
+    seen = set()
+    for chunk in pd.read_csv(path, chunksize=chunksize, dtype={col: object for col in categorical}):
+        if drop_duplicates:
+            hashes = pd.util.hash_pandas_object(chunk, index=False).to_numpy()
+            keep = ~pd.Series(hashes).duplicated().to_numpy()  # duplicates inside the chunk
+            keep &= np.array([h not in seen for h in hashes.tolist()], dtype=bool)  # rows of previous chunks
+            seen.update(hashes[keep].tolist())
+            chunk = chunk[keep]
+        if chunk.shape[0] > 0:
+            yield chunk
+
+def stream_data(split="test", path=None, chunksize=100000, preprocessor=None, drop_duplicates=True):
+    '''
+    Streaming variant of read_data for files that do not fit in memory.
+
+    The CSV is read chunk by chunk and each chunk goes through an already fitted ChurnPreprocessor
+    (by default the one saved by read_data). Duplicate rows are removed across chunks by keeping the
+    64-bit hash of every row seen so far, so memory is bounded by the chunk size plus one hash per
+    distinct row instead of the size of the file.
+
+    Parameters
+    ----------
+    split : str
+        Which DataFiles CSV to read when path is not given ['train', 'test', 'all'].
+
+    path : str
+        CSV file to read instead of the split's file.
+
+    chunksize : int
+        Number of rows read (and transformed) at a time.
+
+    preprocessor : ChurnPreprocessor
+        Fitted preprocessor to apply. Loaded from Saved/preprocessor.pkl if not given.
 
+    drop_duplicates : bool
+        Whether to drop rows already seen in this or a previous chunk.
+
+    Yields
+    ------
+    (x_data, y_data) for each chunk, y_data is None if the file has no Churn column.
+    '''
+    module_dir = os.path.dirname(__file__)
+    path = path or data_path(split, module_dir)
+    preprocessor = preprocessor or ChurnPreprocessor.load(preprocessor_path(module_dir))
+
+    for chunk in _read_chunks(path, chunksize, drop_duplicates, preprocessor.categorical):
+        x_data, y_data = split_target(chunk)
+        x_data, y_data = preprocessor.transform(x_data, y_data)
+        yield x_data, y_data
+
+def write_processed(out_path, split="test", path=None, chunksize=100000, preprocessor=None, drop_duplicates=True):
+    '''
+    Runs stream_data and appends every processed chunk to the CSV file out_path (the target, if any,
+    is written as the last column named Churn). Returns the number of rows written.
+    '''
+    rows = 0
+    for x_data, y_data in stream_data(split=split, path=path, chunksize=chunksize, preprocessor=preprocessor, drop_duplicates=drop_duplicates):
+        block = pd.DataFrame(x_data) if not isinstance(x_data, pd.DataFrame) else x_data.copy()  # PCA returns arrays
+        if y_data is not None:
+            block['Churn'] = np.asarray(y_data)
+        block.to_csv(out_path, mode='w' if rows == 0 else 'a', header=rows == 0, index=False)
+        rows += block.shape[0]
+    return rows
+
+def fit_streaming(split="train", path=None, chunksize=100000, outliers="cap", standardize="standardize", encode='Binary', skip=[],
+                  drop_duplicates=True, class_ratio=0.001, column_cardinaltiy=0.005, save=True):
+    '''
+    Out-of-core alternative to fitting the preprocessing through read_data, for training files that do not fit in memory.
+    The file is read twice, chunk by chunk, and only mergeable summaries of the columns are kept:
+
+        pass 1: quantile sketches of the numerical columns (null medians, IQR outlier ranges)
+                and value counters of the categorical ones (null modes).
+        pass 2: on chunks whose nulls and outliers are handled with the pass 1 statistics, running mean/std
+                (min/max) of the numericals and the value counts used for rare-class folding and the encoders.
+
+    The learned state has the same layout as the one of ChurnPreprocessor.fit, so the returned preprocessor is used
+    exactly like one fitted in memory. Medians and outlier ranges are estimates (rank error around 0.1%, see
+    QuantileSketch), every other statistic is exact. Nulls are handled with the 'mix' method; PCA and oversampling
+    are not supported since they need the whole transformed matrix.
+
+    Parameters
+    ----------
+    split, path, chunksize, drop_duplicates:
+        Which file to read and how, as in stream_data.
+
+    outliers, standardize, encode, skip:
+        Same meaning as in read_data.
+
+    class_ratio, column_cardinaltiy:
+        Same meaning as in handle_diverse_categories.
+
+    save : bool
+        Whether to save the fitted preprocessor to Saved/preprocessor.pkl like read_data does.
+
+    Returns
+    -------
+    preprocessor : ChurnPreprocessor
+        The fitted preprocessor.
+    '''
+    module_dir = os.path.dirname(__file__)
+    path = path or data_path(split, module_dir)
+
+    # the column types are taken from the first chunk
+    x_first, _ = split_target(next(pd.read_csv(path, chunksize=chunksize)))
+    columns = list(x_first.columns)
+    categorical = [col for col in columns if x_first[col].dtype == 'object']
+    numerical = [col for col in columns if col not in categorical]
+
+    # pass 1: statistics of the raw columns
+    sketches = {col: QuantileSketch() for col in numerical}
+    nan_counts = dict.fromkeys(numerical, 0)
+    counters = {col: Counter() for col in categorical}
+    for chunk in _read_chunks(path, chunksize, drop_duplicates, categorical):
+        x_data, _ = split_target(chunk)
+        for col in numerical:
+            values = x_data[col].to_numpy(dtype=float)
+            sketches[col].update(values)
+            nan_counts[col] += int(np.isnan(values).sum())
+        for col in categorical:
+            counters[col].update(x_data[col].value_counts().to_dict())
+
+    medians = pd.Series({col: float(sketches[col].quantile(0.5)) for col in numerical}, dtype=float)
+    modes = {}
+    for col in categorical:
+        top = max(counters[col].values())
+        modes[col] = min(value for value, count in counters[col].items() if count == top)  # pandas' mode()[0] on ties
+    state = {'null_mix.pkl': [medians, modes]}
+
+    # the ranges are computed on the null-filled columns, i.e. with the nans counted as the median
+    outlier_ranges = {}
+    for col in numerical:
+        q1, q3 = sketches[col].quantile([0.25, 0.75], point=medians[col], weight=nan_counts[col])
+        outlier_ranges[col] = (q1 - 1.5*(q3 - q1), q3 + 1.5*(q3 - q1))
+    state['outlier_ranges.pkl'] = outlier_ranges
+    if outliers == 'median':
+        # value the outliers get replaced with during pass 2, the saved medians are recomputed after replacement
+        state['outlier_medians.pkl'] = {col: float(sketches[col].quantile(0.5, point=medians[col], weight=nan_counts[col])) for col in numerical}
+
+    # pass 2: statistics of the cleaned columns
+    moments = {col: RunningMoments() for col in numerical}
+    replaced = {col: QuantileSketch() for col in numerical}
+    counters = {col: Counter() for col in categorical}
+    n_rows = 0
+    for chunk in _read_chunks(path, chunksize, drop_duplicates, categorical):
+        x_data, _ = split_target(chunk)
+        y_dummy = pd.Series(0, index=x_data.index)
+        handle_nulls(x_data, y_dummy, None, method='mix', split='test', state=state)
+        x_data, _ = handle_outliers(x_data, y_dummy, None, method=outliers, split='test', skip=skip, state=state)
+        n_rows += x_data.shape[0]
+        for col in numerical:
+            values = x_data[col].to_numpy(dtype=float)
+            moments[col].update(values)
+            if outliers == 'median':
+                replaced[col].update(values)
+        for col in categorical:
+            counts = x_data[col].value_counts()
+            for value in pd.unique(x_data[col].dropna()):  # keep the order in which classes first appear, the encoders depend on it
+                counters[col][value] += counts[value]
+
+    if outliers == 'median':
+        state['outlier_medians.pkl'] = {col: float(replaced[col].quantile(0.5)) for col in numerical}
+    if standardize == 'standardize':
+        state['means.npy'] = np.array([moments[col].mean for col in numerical])
+        state['stds.npy'] = np.array([moments[col].std() for col in numerical])
+    elif standardize == 'normalize':
+        state['mins.npy'] = np.array([moments[col].min for col in numerical])
+        state['maxs.npy'] = np.array([moments[col].max for col in numerical])
+
+    # rare classes folding, as in handle_diverse_categories
+    unique_categ, folded = {}, {}
+    for col in categorical:
+        cardinality = len(counters[col]) / n_rows
+        if cardinality == 1: # this column is a unique ID, it gets dropped
+            continue
+        minority = set()
+        if cardinality > column_cardinaltiy:
+            minority = {value for value, count in counters[col].items() if count / n_rows < class_ratio}
+        folded[col] = Counter()
+        for value, count in counters[col].items():
+            folded[col]['Other' if value in minority else value] += count
+        unique_categ[col] = set(folded[col])
+    state['diverge_categ.pkl'] = unique_categ
+
+    # encoders, as in handle_categories, fitted from the classes in order of appearance and their counts
+    categ_col = [col for col in folded if len(folded[col]) > 2]
+    two_classes = {col: {list(folded[col])[0]: 0, list(folded[col])[1]: 1} for col in folded if len(folded[col]) == 2}
+    state['categ_columns.pkl'] = [categ_col, two_classes]
+
+    # the encoders see the frame with the categorical columns left after folding and the two-class ones mapped to numbers
+    encoded_columns = [col for col in columns if col in numerical or col in folded]
+    state.update(_fit_encoders(encode, encoded_columns, categ_col, {col: list(folded[col]) for col in categ_col}, folded, n_rows))
+    state['category_tables.pkl'] = _compile_category_tables(state, encode, encoded_columns)
+    state['encoded_columns.pkl'] = _encoded_names(encoded_columns, state['category_tables.pkl'], categ_col if encode == 'OneHot' else [])
+
+    preprocessor = ChurnPreprocessor(outliers=outliers, standardize=standardize, encode=encode, skip=skip, oversample='none')
+    preprocessor.state, preprocessor.columns, preprocessor.categorical = state, columns, categorical
+    preprocessor.fitted = True
+    if save:
+        preprocessor.save(preprocessor_path(module_dir))
+    return preprocessor
@@ -0,0 +1,182 @@
+import os
+import pickle
+import numpy as np
+import pandas as pd
+
+# bins of the reference distributions: percentiles for KS, deciles (a subset of them) for PSI
+_PERCENTILES = np.arange(1, 100)
+_DECILES = np.arange(10, 100, 10)
+
+def monitor_path(module_dir=None):
+    '''
+    Location of the drift monitor artifact.
+    '''
+    module_dir = module_dir or os.path.dirname(__file__)
+    return os.path.join(module_dir, '../Saved') + '/drift_monitor.pkl'
+
+def psi(reference, current, eps=1e-4):
+    '''
+    Population stability index between two histograms (counts or proportions over the same bins).
+    Empty bins are floored at eps so that the index stays finite.
+    '''
+    reference = np.maximum(np.asarray(reference, dtype=float) / max(np.sum(reference), 1), eps)
+    current = np.maximum(np.asarray(current, dtype=float) / max(np.sum(current), 1), eps)
+    return float(np.sum((current - reference) * np.log(current / reference)))
+
+class DriftMonitor:
+    '''
+    Checks scoring batches against the training data the preprocessing was fitted on.
+
+    The references are the state of a fitted ChurnPreprocessor (outlier ranges, seen categories) plus histograms of
+    the raw training columns computed once by fit: percentile bins of the numericals, class frequencies of the
+    categoricals and the null rates. Batches are then only binned and counted (update), so monitoring a stream adds
+    a searchsorted and a bincount per column, and report turns the accumulated counts into per-feature indicators:
+
+        - PSI over the reference deciles (numericals) or classes (categoricals, the unseen ones in a bin of their own).
+        - KS (numericals), the largest gap between the reference and current distribution functions at the reference percentiles.
+        - Out of range rate, the share of values outside the outlier ranges of the preprocessor.
+        - Unseen rate, the share of values handle_diverse_categories would fold into 'Other'.
+        - Null rate of the batches against the one of the training data.
+
+    Parameters
+    ----------
+    preprocessor : ChurnPreprocessor
+        The fitted preprocessor whose training data is the reference.
+    '''
+    def __init__(self, preprocessor):
+        if not preprocessor.fitted:
+            raise ValueError("The preprocessor must be fitted before monitoring drift against it.")
+        state = preprocessor.state
+        self.ranges = state['outlier_ranges.pkl']
+        self.numerical_columns = list(self.ranges)
+        self.lower = np.array([self.ranges[col][0] for col in self.numerical_columns], dtype=float)
+        self.upper = np.array([self.ranges[col][1] for col in self.numerical_columns], dtype=float)
+        # the classes kept by handle_diverse_categories and their codes, anything else becomes 'Other'
+        seen = state['diverge_categ.pkl']
+        self.categorical_columns = list(seen)
+        self.codes = {col: {value: i for i, value in enumerate(sorted(value for value in seen[col] if value == value))} for col in self.categorical_columns}
+        self.fitted = False
+
+    def _count(self, numerical, categorical):
+        # counts of a block of raw numericals (rows x numerical_columns) and of the raw categorical values
+        counts = {}
+        missing = np.isnan(numerical)
+        counts['rows'] = numerical.shape[0] if self.numerical_columns else len(next(iter(categorical.values()), []))
+        counts['numerical_nulls'] = missing.sum(axis=0)
+        counts['out_of_range'] = ((numerical < self.lower) | (numerical > self.upper)).sum(axis=0)
+        counts['bins'] = [np.bincount(np.searchsorted(edges, numerical[~missing[:, i], i], side='right'), minlength=len(edges) + 1)
+                          for i, edges in enumerate(self.edges)]
+        counts['classes'], counts['categorical_nulls'] = [], []
+        for col in self.categorical_columns:
+            # a dict lookup per value, the code after the seen classes stands for the unseen values
+            lookup, unseen = self.codes[col], len(self.codes[col])
+            codes = [lookup.get(value, unseen) for value in categorical[col] if value is not None and value == value]
+            counts['classes'].append(np.bincount(np.array(codes, dtype=int), minlength=unseen + 1))
+            counts['categorical_nulls'].append(len(categorical[col]) - len(codes))
+        return counts
+
+    def fit(self, x_reference):
+        '''
+        Computes the reference histograms and null rates from the raw training features (cleaner.split_target).
+        '''
+        numerical = x_reference[self.numerical_columns].to_numpy(dtype=float)
+        self.edges, self.psi_bins = [], []
+        for i in range(len(self.numerical_columns)):
+            if np.isnan(numerical[:, i]).all():
+                self.edges.append(np.empty(0))
+                self.psi_bins.append(np.zeros(1, dtype=int))
+                continue
+            edges = np.unique(np.nanpercentile(numerical[:, i], _PERCENTILES))
+            # the deciles are among the percentile edges, a decile bin starts right after its lower edge
+            deciles = np.unique(np.nanpercentile(numerical[:, i], _DECILES))
+            self.edges.append(edges)
+            self.psi_bins.append(np.unique(np.append(0, np.searchsorted(edges, deciles) + 1)))
+        self.reference = self._count(numerical, {col: x_reference[col].to_numpy() for col in self.categorical_columns})
+        self.fitted = True
+        self.reset()
+        return self
+
+    def reset(self):
+        '''
+        Forgets the batches seen so far.
+        '''
+        self.current = None
+
+    def update_block(self, numerical, categorical):
+        '''
+        Adds a batch given as a 2-D float array of the numerical_columns (nans for missing values) and a dict
+        of the raw values of each categorical column. This is the hook of ChurnScorer.
+        '''
+        if not self.fitted:
+            raise ValueError("DriftMonitor is not fitted yet. Call fit with the training features first.")
+        counts = self._count(np.asarray(numerical, dtype=float).reshape(-1, len(self.numerical_columns)), categorical)
+        if self.current is None:
+            self.current = counts
+            return self
+        for key, value in counts.items():
+            if isinstance(value, list):
+                self.current[key] = [total + part for total, part in zip(self.current[key], value)]
+            else:
+                self.current[key] = self.current[key] + value
+        return self
+
+    def update(self, x_data):
+        '''
+        Adds a batch of raw features, a DataFrame or a list of records (dicts keyed by the CSV column names).
+        '''
+        if isinstance(x_data, pd.DataFrame):
+            numerical = x_data[self.numerical_columns].to_numpy(dtype=float)
+            categorical = {col: x_data[col].to_numpy() for col in self.categorical_columns}
+        else:
+            numerical = np.array([[record.get(col) for col in self.numerical_columns] for record in x_data], dtype=float)
+            categorical = {col: [record.get(col) for record in x_data] for col in self.categorical_columns}
+        return self.update_block(numerical, categorical)
+
+    def report(self):
+        '''
+        Drift indicators of the batches seen since the last reset, one row per feature.
+
+        Returns
+        -------
+        report : pandas.DataFrame
+            'Type', 'PSI', 'KS', 'Out Of Range Rate' (and its 'Reference ...'), 'Unseen Rate' (and its 'Reference ...'),
+            'Null Rate', 'Reference Null Rate' and 'Null Rate Change', sorted by PSI.
+        '''
+        if self.current is None:
+            raise ValueError("No batch was added since the last reset.")
+        ref, cur = self.reference, self.current
+        rows = []
+        for i, col in enumerate(self.numerical_columns):
+            ref_bins, cur_bins = ref['bins'][i], cur['bins'][i]
+            # the decile bins are sums of consecutive percentile bins
+            ref_psi, cur_psi = np.add.reduceat(ref_bins, self.psi_bins[i]), np.add.reduceat(cur_bins, self.psi_bins[i])
+            ks = np.abs(np.cumsum(ref_bins) / max(ref_bins.sum(), 1) - np.cumsum(cur_bins) / max(cur_bins.sum(), 1)).max()
+            ref_valid, cur_valid = ref['rows'] - ref['numerical_nulls'][i], cur['rows'] - cur['numerical_nulls'][i]
+            rows.append({'Feature': col, 'Type': 'numerical', 'PSI': psi(ref_psi, cur_psi), 'KS': float(ks),
+                         'Out Of Range Rate': cur['out_of_range'][i] / max(cur_valid, 1),
+                         'Reference Out Of Range Rate': ref['out_of_range'][i] / max(ref_valid, 1),
+                         'Null Rate': cur['numerical_nulls'][i] / cur['rows'], 'Reference Null Rate': ref['numerical_nulls'][i] / ref['rows']})
+        for i, col in enumerate(self.categorical_columns):
+            ref_classes, cur_classes = ref['classes'][i], cur['classes'][i]
+            # the classes have no order, KS is only reported for the numericals
+            rows.append({'Feature': col, 'Type': 'categorical', 'PSI': psi(ref_classes, cur_classes), 'KS': np.nan,
+                         'Unseen Rate': cur_classes[-1] / max(cur_classes.sum(), 1),
+                         'Reference Unseen Rate': ref_classes[-1] / max(ref_classes.sum(), 1),
+                         'Null Rate': cur['categorical_nulls'][i] / cur['rows'], 'Reference Null Rate': ref['categorical_nulls'][i] / ref['rows']})
+
+        report = pd.DataFrame(rows, columns=['Feature', 'Type', 'PSI', 'KS', 'Out Of Range Rate', 'Reference Out Of Range Rate', 'Unseen Rate',
+                                             'Reference Unseen Rate', 'Null Rate', 'Reference Null Rate']).set_index('Feature')
+        report['Null Rate Change'] = report['Null Rate'] - report['Reference Null Rate']
+        return report.sort_values(by='PSI', ascending=False)
+
+    def save(self, path=None):
+        '''
+        Saves the fitted monitor (references and the batches seen so far), by default to Saved/drift_monitor.pkl.
+        '''
+        with open(path or monitor_path(), 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path=None):
+        with open(path or monitor_path(), 'rb') as f:
+            return pickle.load(f)
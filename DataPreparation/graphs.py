@@ -1,11 +1,119 @@
+import os
 import matplotlib.pyplot as plt
 import seaborn as sns
 import pandas as pd
 import numpy as np
 import warnings
 import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from aggregates import category_counts, box_stats, kde_grids
 
-def plot_stacked_bar_churn_vs_categorical(data, target_column='Churn', threshold=10):
+# where the plots go: None shows them interactively, a directory saves them there (see batch_mode)
+# 'written' collects the files of an export_plots job only, it is None otherwise so that nothing accumulates
+_batch = {'output_dir': None, 'dpi': 100, 'max_points': None, 'fmt': 'png', 'prefix': '', 'written': None}
+
+def batch_mode(output_dir=None, dpi=100, max_points=None, fmt='png'):
+    """
+    Switches the plotting functions of graphs.py and DataPreparation.py between interactive and headless rendering.
+
+    With an output_dir each figure is rendered by the Agg backend, saved as <output_dir>/<name>.<fmt> and closed
+    instead of shown, and the figures are built at dpi rather than at the 150-300 the functions ask for (a 25x100 inches
+    figure at 300 dpi is a 900MB canvas). Calling it without an output_dir goes back to plt.show().
+
+    Parameters:
+    output_dir (str): Directory of the rendered plots, None to show them.
+    dpi (int): Resolution of the figures in batch mode.
+    max_points (int): Scatter, KDE and pair plots draw a random sample of this many rows of larger data, None draws all.
+    fmt (str): File format of the plots.
+    """
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        plt.switch_backend('Agg')
+        plt.rcParams['figure.dpi'] = dpi
+    _batch.update(output_dir=output_dir, dpi=dpi, max_points=max_points, fmt=fmt, prefix='', written=None)
+
+def plot_style(dpi=None):
+    """
+    Dark background and the figure resolution of a plot, the batch mode one when rendering to files.
+    """
+    plt.style.use('dark_background')
+    if _batch['output_dir'] is not None:
+        plt.rcParams['figure.dpi'] = _batch['dpi']
+    elif dpi is not None:
+        plt.rcParams['figure.dpi'] = dpi
+
+def sample_points(data, max_points=None):
+    """
+    A random sample of max_points rows (by default the one of batch_mode) of data that has more, to keep the point
+    plots cheap. The statistics behind a plot (correlations, outlier ranges) should still use the full data.
+    """
+    max_points = max_points or _batch['max_points']
+    if max_points is None or len(data) <= max_points:
+        return data
+    return data.sample(n=max_points, random_state=42)
+
+def show_figure(fig, name):
+    """
+    Shows the figure, or in batch mode saves it as <output_dir>/<name>.<fmt> and closes it so that memory doesn't build up.
+    """
+    if _batch['output_dir'] is None:
+        plt.show()
+        return
+    path = os.path.join(_batch['output_dir'], f"{_batch['prefix']}{name}.{_batch['fmt']}")
+    fig.savefig(path, dpi=_batch['dpi'], bbox_inches='tight')
+    plt.close(fig)
+    if _batch['written'] is not None:
+        _batch['written'].append(path)
+
+def _render_job(function, args, kwargs, name, settings):
+    # one plot function in batch mode, returns the files it wrote
+    plt.switch_backend('Agg')
+    plt.rcParams['figure.dpi'] = settings['dpi']
+    _batch.update(settings, prefix=f'{name}_' if name else '', written=[])
+    try:
+        function(*args, **kwargs)
+    finally:
+        plt.close('all')
+    return _batch['written']
+
+def export_plots(jobs, output_dir, n_jobs=1, dpi=100, max_points=20000, fmt='png'):
+    """
+    Renders a batch of plots headlessly to files, independent figures in parallel.
+
+    Parameters:
+    jobs (list): (function, kwargs) or (function, kwargs, name) tuples, e.g. (plot_kde_churn_vs_numerical, {'data': df}).
+                 The files of a job are named after the figures it draws, prefixed by its name if given.
+    output_dir (str): Directory of the rendered plots.
+    n_jobs (int): Number of worker processes, -1 for one per CPU and 1 (default) to render in this process.
+                  Each spawned worker first imports matplotlib, seaborn and pandas, seconds of start-up that a batch
+                  of a few plots does not win back: parallel rendering pays off for many jobs on several cores.
+    dpi, max_points, fmt: As in batch_mode.
+
+    Returns:
+    list: The paths of the written files, in the order of the jobs.
+
+    The workers are spawned, so a script calling it with n_jobs > 1 needs an `if __name__ == '__main__':` guard.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    settings = {'output_dir': output_dir, 'dpi': dpi, 'max_points': max_points, 'fmt': fmt}
+    jobs = [(job[0], (), job[1], job[2] if len(job) > 2 else None) for job in jobs]
+    n_jobs = min(os.cpu_count() if n_jobs == -1 else n_jobs, max(len(jobs), 1))
+
+    if n_jobs == 1:
+        # render here and give back the backend and settings of the session
+        backend, previous = plt.get_backend(), dict(_batch)
+        try:
+            written = [_render_job(*job, settings) for job in jobs]
+        finally:
+            _batch.update(previous)
+            plt.switch_backend(backend)
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn')) as executor:
+            written = list(executor.map(_render_job, *zip(*jobs), [settings] * len(jobs)))
+    return [path for paths in written for path in paths]
+
+def plot_stacked_bar_churn_vs_categorical(data, target_column='Churn', threshold=10, tables=None):
     """
     Plots stacked bar plots for each categorical feature against the churn column.
     Automatically detects categorical columns based on data type and number of unique values.
@@ -14,22 +122,27 @@ def plot_stacked_bar_churn_vs_categorical(data, target_column='Churn', threshold
     data (pd.DataFrame): DataFrame containing the data.
     target_column (str): The target column indicating churn (default is 'churn').
     threshold (int): Maximum unique values to consider a column as categorical.
+    tables (dict): The aggregates.eda_tables of the data to plot from, computed from data if None.
     """
 
-    # Convert churn column to binary integers
-    data[target_column] = data[target_column].map({'Yes': 1, 'No': 0})
+    if tables is None:
+        # Convert churn column to binary integers
+        data[target_column] = data[target_column].map({'Yes': 1, 'No': 0})
 
-    # Automatically detect categorical columns based on data type and number of unique values
-    categorical_columns = [col for col in data.select_dtypes(include=['object', 'category']).columns
-                           if data[col].nunique() <= threshold and col != target_column]
+        # Automatically detect categorical columns based on data type and number of unique values
+        categorical_columns = [col for col in data.select_dtypes(include=['object', 'category']).columns
+                               if data[col].nunique() <= threshold and col != target_column]
 
-    if target_column not in data.columns:
-        raise ValueError(f"Churn column '{target_column}' not found in DataFrame")
+        if target_column not in data.columns:
+            raise ValueError(f"Churn column '{target_column}' not found in DataFrame")
+
+        tables = {'counts': category_counts(data, categorical_columns, target_column)}
+
+    categorical_columns = list(tables['counts'])
 
 
     # Set the plot style and background
-    plt.style.use('dark_background')
-    plt.rcParams['figure.dpi'] = 200  # Increase plot resolution
+    plot_style(dpi=200)  # Increase plot resolution
 
     num_columns = len(categorical_columns)
 
@@ -44,9 +157,8 @@ def plot_stacked_bar_churn_vs_categorical(data, target_column='Churn', threshold
     axs = axs.flatten()  # Flatten the 2D array of axes for easier indexing
 
     for i, col in enumerate(categorical_columns):
-        # Calculate value counts for churn = 1 and churn = 0
-        churn_data = data.groupby([col, target_column]).size().unstack(fill_value=0)
-        
+        # Value counts for churn = 1 and churn = 0
+        churn_data = tables['counts'][col]
 
         # Prepare for plotting
         labels = churn_data.index
@@ -73,9 +185,9 @@ def plot_stacked_bar_churn_vs_categorical(data, target_column='Churn', threshold
 
     fig.suptitle('Churn vs Categorical Features', fontsize=16)
     fig.tight_layout(rect=[0, 0.03, 1, 0.95])
-    plt.show()
+    show_figure(fig, 'plot_stacked_bar_churn_vs_categorical')
 
-def plot_box_churn_vs_numerical(data, target_column='Churn'):
+def plot_box_churn_vs_numerical(data, target_column='Churn', tables=None):
     """
     Plots box plots for each numerical feature against the churn column.
     Automatically detects numerical columns based on data type.
@@ -83,21 +195,27 @@ def plot_box_churn_vs_numerical(data, target_column='Churn'):
     Parameters:
     data (pd.DataFrame): DataFrame containing the data.
     target_column (str): The target column indicating churn (default is 'churn').
+    tables (dict): The aggregates.eda_tables of the data to plot from, computed from data if None.
     """
     
-    # Convert churn column to binary integers if it contains 'Yes'/'No'
-    if data[target_column].dtype == 'object':
-        data[target_column] = data[target_column].map({'Yes': 1, 'No': 0})
+    if tables is None:
+        # Convert churn column to binary integers if it contains 'Yes'/'No'
+        if data[target_column].dtype == 'object':
+            data[target_column] = data[target_column].map({'Yes': 1, 'No': 0})
 
-    # Automatically detect numerical columns based on data type
-    numerical_columns = data.select_dtypes(include=['int64', 'float64']).columns.tolist()
+        # Automatically detect numerical columns based on data type
+        numerical_columns = data.select_dtypes(include=['int64', 'float64']).columns.tolist()
 
-    # Exclude the churn column from numerical columns if present
-    if target_column in numerical_columns:
-        numerical_columns.remove(target_column)
+        # Exclude the churn column from numerical columns if present
+        if target_column in numerical_columns:
+            numerical_columns.remove(target_column)
 
-    if target_column not in data.columns:
-        raise ValueError(f"Churn column '{target_column}' not found in DataFrame")
+        if target_column not in data.columns:
+            raise ValueError(f"Churn column '{target_column}' not found in DataFrame")
+
+        tables = {'box': box_stats(data, numerical_columns, target_column)}
+
+    numerical_columns = list(tables['box'])
 
 
     num_columns = len(numerical_columns)
@@ -113,9 +231,9 @@ def plot_box_churn_vs_numerical(data, target_column='Churn'):
     axs = axs.flatten()  # Flatten the 2D array of axes for easier indexing
 
     for i, col in enumerate(numerical_columns):
-        # Create the box plot
+        # Create the box plot from its quartiles, whiskers and fliers
         ax = axs[i]  # Get the current axis
-        data.boxplot(column=col, by=target_column, ax=ax, grid=False)
+        ax.bxp(tables['box'][col])
 
         # Set the title and labels
         ax.set_title(f'{col} vs Churn', fontsize=12)
@@ -128,7 +246,7 @@ def plot_box_churn_vs_numerical(data, target_column='Churn'):
 
     fig.suptitle('Churn vs Numerical Features', fontsize=16)
     plt.tight_layout(rect=[0, 0.03, 1, 0.95])
-    plt.show()
+    show_figure(fig, 'plot_box_churn_vs_numerical')
 
 def plot_pairplot_churn_vs_numerical(data, target_column='Churn'):
     """
@@ -161,20 +279,19 @@ def plot_pairplot_churn_vs_numerical(data, target_column='Churn'):
         print("No numerical columns found to plot.")
         return
     
-    # Include the churn column in the data for pair plotting
-    data_subset = data[numerical_columns + [target_column]]
+    # Include the churn column in the data for pair plotting, a sample of it for large data
+    data_subset = sample_points(data[numerical_columns + [target_column]])
     
     # Set the plot style
-    plt.style.use('dark_background')
-    plt.rcParams['figure.dpi'] = 150  # Higher resolution for the plot
+    plot_style(dpi=150)  # Higher resolution for the plot
     
     # Create the pair plot using seaborn
-    sns.pairplot(data_subset, hue=target_column, palette='coolwarm', diag_kind='kde', markers=["o", "s"])
+    grid = sns.pairplot(data_subset, hue=target_column, palette='coolwarm', diag_kind='kde', markers=["o", "s"])
 
     # Set the overall title for the pair plot
     plt.suptitle('Pair Plot: Numerical Features vs Churn', fontsize=16, y=1.02)
     
-    plt.show()
+    show_figure(grid.fig, 'plot_pairplot_churn_vs_numerical')
 
 def plot_pairplot_high_correlation(data, correlation_threshold=0.5, ncols=3):
     """
@@ -214,8 +331,7 @@ def plot_pairplot_high_correlation(data, correlation_threshold=0.5, ncols=3):
     high_corr_pairs.sort(key=lambda x: abs(x[2]), reverse=True)
 
     # Set the plot style and size
-    plt.style.use('dark_background')
-    plt.rcParams['figure.dpi'] = 150  # Higher resolution for the plot
+    plot_style(dpi=150)  # Higher resolution for the plot
 
     # Create a grid for the plots
     nrows = int(np.ceil(len(high_corr_pairs) / ncols))
@@ -224,12 +340,15 @@ def plot_pairplot_high_correlation(data, correlation_threshold=0.5, ncols=3):
     # Flatten axes for easy indexing
     axes = axes.flatten()
 
+    # The correlations are of the full data, the scatter plots draw a sample of it for large data
+    points = sample_points(data[numerical_columns])
+
     # Create pair plots for high correlation pairs
     for idx, pair in enumerate(high_corr_pairs):
         feature1, feature2, corr_value = pair
         
         # Create a scatter plot for each high correlation pair
-        sns.scatterplot(data=data, x=feature1, y=feature2, ax=axes[idx], alpha=0.6)
+        sns.scatterplot(data=points, x=feature1, y=feature2, ax=axes[idx], alpha=0.6)
         axes[idx].set_title(f'{feature1} vs {feature2}\nCorr: {corr_value:.2f}', fontsize=10)
         axes[idx].set_xlabel(feature1, fontsize=8)
         axes[idx].set_ylabel(feature2, fontsize=8)
@@ -243,7 +362,7 @@ def plot_pairplot_high_correlation(data, correlation_threshold=0.5, ncols=3):
     
     # Adjust layout for better fit
     plt.tight_layout()
-    plt.show()
+    show_figure(fig, 'plot_pairplot_high_correlation')
 
 def plot_correlation_heatmap(data, churn_column='churn'):
     """
@@ -280,18 +399,17 @@ def plot_correlation_heatmap(data, churn_column='churn'):
     correlation_matrix = data_subset.corr()
 
     # Set the plot style
-    plt.style.use('dark_background')
-    plt.rcParams['figure.dpi'] = 150  # Higher resolution for the plot
+    plot_style(dpi=150)  # Higher resolution for the plot
 
     # Create a heatmap without annotations
-    plt.figure(figsize=(12, 8))
+    fig = plt.figure(figsize=(12, 8))
     sns.heatmap(correlation_matrix, annot=False, cmap='coolwarm', square=True, cbar_kws={"shrink": .8})
     
     # Set the title
     plt.title('Correlation Heatmap of Numerical Features vs Churn', fontsize=16)
-    plt.show()
+    show_figure(fig, 'plot_correlation_heatmap')
 
-def plot_facetgrid_churn_vs_categorical(data, target_column='Churn',col2='HasCreditCard',threshold=10):
+def plot_facetgrid_churn_vs_categorical(data, target_column='Churn',col2='HasCreditCard',threshold=10, tables=None):
     """
     Plots facet grids for each categorical feature against the churn column.
     Automatically detects categorical columns based on data type and number of unique values.
@@ -300,22 +418,27 @@ def plot_facetgrid_churn_vs_categorical(data, target_column='Churn',col2='HasCre
     data (pd.DataFrame): DataFrame containing the data.
     target_column (str): The target column indicating churn (default is 'Churn').
     threshold (int): Maximum unique values to consider a column as categorical.
+    tables (dict): The aggregates.eda_tables of the data to plot from (its col2), computed from data if None.
     """
     warnings.filterwarnings("ignore")
-    # Convert churn column to binary integers if it contains 'Yes'/'No'
-    if data[target_column].dtype == 'object':
-        data[target_column] = data[target_column].map({'Yes': 1, 'No': 0})
+    if tables is None:
+        # Convert churn column to binary integers if it contains 'Yes'/'No'
+        if data[target_column].dtype == 'object':
+            data[target_column] = data[target_column].map({'Yes': 1, 'No': 0})
 
-    # Automatically detect categorical columns based on data type and number of unique values
-    categorical_columns = [col for col in data.select_dtypes(include=['object', 'category']).columns
-                           if data[col].nunique() <= threshold and col != target_column]
+        # Automatically detect categorical columns based on data type and number of unique values
+        categorical_columns = [col for col in data.select_dtypes(include=['object', 'category']).columns
+                               if data[col].nunique() <= threshold and col != target_column and col != col2]
 
-    if target_column not in data.columns:
-        raise ValueError(f"Churn column '{target_column}' not found in DataFrame")
+        if target_column not in data.columns:
+            raise ValueError(f"Churn column '{target_column}' not found in DataFrame")
+
+        tables = {'facet_counts': category_counts(data, categorical_columns, target_column, by=col2)}
+
+    categorical_columns = list(tables['facet_counts'])
 
     # Set the plot style and background
-    plt.style.use('dark_background')
-    plt.rcParams['figure.dpi'] = 200  # Increase plot resolution
+    plot_style(dpi=200)  # Increase plot resolution
 
     num_columns = len(categorical_columns)
 
@@ -323,24 +446,33 @@ def plot_facetgrid_churn_vs_categorical(data, target_column='Churn',col2='HasCre
         print("No categorical columns found to plot.")
         return
 
-    # Create a FacetGrid for each categorical feature
+    # Create a facet grid for each categorical feature: a count plot of col2 per class, one bar per churn value
+    colors = sns.color_palette()
     for col in categorical_columns:
-        # Check if the target column is in the current categorical column
-        if col == target_column:
-            continue
-
-        # Create the FacetGrid with countplot
-        # g = sns.FacetGrid(data, col=col, hue=target_column, col_wrap=1, height=4, aspect=2)
-        g = sns.FacetGrid(data, col=col, hue=target_column)
-        g.map(sns.countplot, col2)  # Change 'HasCreditCard' to the feature of interest if needed
-        g.add_legend()
+        counts = tables['facet_counts'][col]
+        classes, col2_classes = counts.index.levels[0], counts.index.levels[1]
+        counts = counts.reindex(pd.MultiIndex.from_product([classes, col2_classes]), fill_value=0)
+        fig, axs = plt.subplots(nrows=1, ncols=len(classes), figsize=(3 * len(classes), 3), sharey=True, squeeze=False)
+        positions, width = np.arange(len(col2_classes)), 0.8 / len(counts.columns)
+
+        for ax, value in zip(axs[0], classes):
+            for k, label in enumerate(counts.columns):
+                ax.bar(positions + (k - (len(counts.columns) - 1) / 2) * width, counts.loc[value, label], width=width,
+                       color=colors[k % len(colors)], label=label)
+            ax.set_xticks(positions)
+            ax.set_xticklabels(col2_classes)
+            ax.set_title(f'{col} = {value}')
+            ax.set_xlabel(counts.index.names[1])
+        axs[0, 0].set_ylabel('count')
+        fig.legend(*axs[0, 0].get_legend_handles_labels(), title=target_column, loc='center left', bbox_to_anchor=(1, 0.5))
         
         # Set the title
-        g.fig.suptitle(f'Churn vs {col}', fontsize=16, y=1.05)
+        fig.suptitle(f'Churn vs {col}', fontsize=16, y=1.05)
 
-    plt.show()
+        # one figure per feature, closed once rendered in batch mode
+        show_figure(fig, f'plot_facetgrid_churn_vs_categorical_{col}')
 
-def plot_kde_churn_vs_numerical(data, target_column='Churn'):
+def plot_kde_churn_vs_numerical(data, target_column='Churn', tables=None):
     """
     Plots KDE plots for each numerical feature against the churn column.
     Automatically detects numerical columns based on data type.
@@ -348,24 +480,30 @@ def plot_kde_churn_vs_numerical(data, target_column='Churn'):
     Parameters:
     data (pd.DataFrame): DataFrame containing the data.
     target_column (str): The target column indicating churn (default is 'Churn').
+    tables (dict): The aggregates.eda_tables of the data to plot from, computed from data if None.
     """
 
     # Suppress warnings
     warnings.filterwarnings("ignore")
     
-    # Convert churn column to binary integers if it contains 'Yes'/'No'
-    if data[target_column].dtype == 'object':
-        data[target_column] = data[target_column].map({'Yes': 1, 'No': 0})
+    if tables is None:
+        # Convert churn column to binary integers if it contains 'Yes'/'No'
+        if data[target_column].dtype == 'object':
+            data[target_column] = data[target_column].map({'Yes': 1, 'No': 0})
 
-    # Automatically detect numerical columns based on data type
-    numerical_columns = data.select_dtypes(include=['int64', 'float64']).columns.tolist()
+        # Automatically detect numerical columns based on data type
+        numerical_columns = data.select_dtypes(include=['int64', 'float64']).columns.tolist()
 
-    # Exclude the churn column from numerical columns if present
-    if target_column in numerical_columns:
-        numerical_columns.remove(target_column)
+        # Exclude the churn column from numerical columns if present
+        if target_column in numerical_columns:
+            numerical_columns.remove(target_column)
 
-    if target_column not in data.columns:
-        raise ValueError(f"Churn column '{target_column}' not found in DataFrame")
+        if target_column not in data.columns:
+            raise ValueError(f"Churn column '{target_column}' not found in DataFrame")
+
+        tables = {'kde': kde_grids(data, numerical_columns, target_column)}
+
+    numerical_columns = list(tables['kde'])
 
     num_columns = len(numerical_columns)
 
@@ -380,9 +518,12 @@ def plot_kde_churn_vs_numerical(data, target_column='Churn'):
     axs = axs.flatten()  # Flatten the 2D array of axes for easier indexing
 
     for i, col in enumerate(numerical_columns):
-        # Create the KDE plots
-        sns.kdeplot(data[data[target_column] == 1][col], label='Churn', ax=axs[i], shade=True)
-        sns.kdeplot(data[data[target_column] == 0][col], label='No Churn', ax=axs[i], shade=True)
+        # Create the KDE plots from the density grids, shaded as sns.kdeplot
+        curves = tables['kde'][col]
+        for value, label in ((1, 'Churn'), (0, 'No Churn')):
+            curve = curves[curves.iloc[:, 0] == value]
+            line, = axs[i].plot(curve['Value'], curve['Density'], label=label)
+            axs[i].fill_between(curve['Value'], curve['Density'], color=line.get_color(), alpha=0.25)
 
         # Set the title and labels
         axs[i].set_title(f'KDE Plot of {col} by Churn', fontsize=12)
@@ -396,7 +537,7 @@ def plot_kde_churn_vs_numerical(data, target_column='Churn'):
 
     fig.suptitle('Churn vs Numerical Features - KDE Plots', fontsize=16)
     plt.tight_layout(rect=[0, 0.03, 1, 0.95])
-    plt.show()
+    show_figure(fig, 'plot_kde_churn_vs_numerical')
 
 def plot_pairplot_columns(data, columns, y_column='Churn', ncols=3):
     """
@@ -418,8 +559,7 @@ def plot_pairplot_columns(data, columns, y_column='Churn', ncols=3):
     pairs = list(itertools.combinations(columns, 2))
     
     # Set the plot style and size
-    plt.style.use('dark_background')
-    plt.rcParams['figure.dpi'] = 150  # Higher resolution for the plot
+    plot_style(dpi=150)  # Higher resolution for the plot
 
     # Create a grid for the plots
     nrows = int(np.ceil(len(pairs) / ncols))
@@ -428,9 +568,12 @@ def plot_pairplot_columns(data, columns, y_column='Churn', ncols=3):
     # Flatten axes for easy indexing
     axes = axes.flatten()
 
+    # A sample of large data is enough for the scatter plots
+    points = sample_points(data[list(columns) + [y_column]])
+
     # Create scatter plots for each pair
     for idx, (x_col, y_col) in enumerate(pairs):
-        sns.scatterplot(data=data, x=x_col, y=y_col, hue=y_column, palette=colors, ax=axes[idx], alpha=0.8)
+        sns.scatterplot(data=points, x=x_col, y=y_col, hue=y_column, palette=colors, ax=axes[idx], alpha=0.8)
         axes[idx].set_title(f'{x_col} vs {y_col}', fontsize=10)
         axes[idx].set_xlabel(x_col, fontsize=8)
         axes[idx].set_ylabel(y_col, fontsize=8)
@@ -444,4 +587,4 @@ def plot_pairplot_columns(data, columns, y_column='Churn', ncols=3):
     
     # Adjust layout for better fit
     plt.tight_layout()
-    plt.show()
\ No newline at end of file
+    show_figure(fig, 'plot_pairplot_columns')
\ No newline at end of file
@@ -0,0 +1,200 @@
+import numpy as np
+
+class QuantileSketch:
+    '''
+    Mergeable quantile sketch (KLL style) for columns too large to hold in memory.
+
+    Values are kept in levels where an item at level h stands for 2**h original values. When a level
+    grows over its capacity it is sorted and every other item is promoted to the next level, so the
+    sketch stays at a few multiples of k items whatever the number of values added. The rank error is
+    in the order of 1/k. Two sketches built over disjoint parts of a column can be merged.
+
+    Parameters
+    ----------
+    k : int
+        Capacity of the top level, trades memory for accuracy.
+    seed : int
+        Seed of the random offsets used when compacting, for reproducible results.
+    '''
+    def __init__(self, k=1000, seed=42):
+        self.k = k
+        self.count = 0
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            if len(self.levels[level]) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(self.levels[level])
+                # with an odd number of items one stays behind at this level
+                leftover, items = items[:len(items) % 2], items[len(items) % 2:]
+                promoted = items[self.rng.integers(2)::2]
+                self.levels[level] = leftover
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            level += 1
+
+    def update(self, values):
+        '''
+        Adds the non-nan values of an array to the sketch.
+        '''
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        self.count += len(values)
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+        return self
+
+    def merge(self, other):
+        '''
+        Adds the values summarized by another sketch to this one.
+        '''
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.count += other.count
+        self._compress()
+        return self
+
+    def quantile(self, q, point=None, weight=0):
+        '''
+        Estimates the q-th quantile(s) with the same linear interpolation as pandas.Series.quantile.
+        While no compaction happened the result is exact.
+
+        point, weight: optionally add `weight` copies of the value `point` to the distribution at query
+        time (e.g. the nans of a column that are going to be filled with its median).
+        '''
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level) for level, items in enumerate(self.levels)])
+        if point is not None and weight > 0:
+            items, weights = np.append(items, point), np.append(weights, weight)
+        if len(items) == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+
+        order = np.argsort(items, kind='stable')
+        items, weights = items[order], weights[order]
+        # an item of weight w covers the ranks [end - w, end - 1], interpolate between these
+        ends = np.cumsum(weights) - 1
+        starts = ends - weights + 1
+        ranks = np.column_stack([starts, ends]).ravel()
+        values = np.repeat(items, 2)
+        return np.interp(np.asarray(q) * ends[-1], ranks, values)
+
+class RunningMoments:
+    '''
+    Count, mean, variance, min and max of a column updated chunk by chunk (Welford / Chan et al.),
+    mergeable across disjoint parts of the data.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+
+    def merge_stats(self, count, mean, m2, min_val, max_val):
+        if count == 0:
+            return self
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+        self.min, self.max = min(self.min, min_val), max(self.max, max_val)
+        return self
+
+    def update(self, values):
+        '''
+        Adds the non-nan values of an array.
+        '''
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return self
+        mean = values.mean()
+        return self.merge_stats(len(values), mean, ((values - mean) ** 2).sum(), values.min(), values.max())
+
+    def merge(self, other):
+        return self.merge_stats(other.count, other.mean, other.m2, other.min, other.max)
+
+    def std(self, ddof=1):
+        # same default ddof as pandas.Series.std
+        return np.sqrt(self.m2 / (self.count - ddof)) if self.count > ddof else np.nan
+
+class SortedRuns:
+    '''
+    Exact mergeable quantiles of a column kept as sorted runs, one per part of the data.
+
+    Merging only appends the runs of the other part (the arrays are shared, not copied), and a quantile
+    selects its order statistics with binary searches over the runs instead of sorting their union.
+    Meant for parts that fit in memory, e.g. the cross-validation folds whose training rows are the
+    union of the other folds.
+    '''
+    def __init__(self):
+        self.count = 0
+        self.runs = []
+
+    def update(self, values):
+        '''
+        Adds the non-nan values of an array as a new run.
+        '''
+        values = np.asarray(values, dtype=float)
+        values = np.sort(values[~np.isnan(values)])
+        if len(values):
+            self.runs.append(values)
+            self.count += len(values)
+        return self
+
+    def merge(self, other):
+        self.runs += other.runs
+        self.count += other.count
+        return self
+
+    def _kth(self, runs, k):
+        # the k-th smallest value (from 0) is the first item of a run with more than k values <= to it
+        for run in runs:
+            lo, hi = 0, len(run)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if sum(np.searchsorted(other, run[mid], side='right') for other in runs) > k:
+                    hi = mid
+                else:
+                    lo = mid + 1
+            if lo < len(run) and sum(np.searchsorted(other, run[lo], side='left') for other in runs) <= k:
+                return run[lo]
+
+    def quantile(self, q, point=None, weight=0):
+        '''
+        The q-th quantile(s), exactly as pandas.Series.quantile computes it (linear interpolation).
+
+        point, weight: optionally add `weight` copies of the value `point` to the distribution at query
+        time (e.g. the nans of a column that are going to be filled with its median).
+        '''
+        runs = self.runs + ([np.full(weight, float(point))] if point is not None and weight > 0 else [])
+        count = sum(len(run) for run in runs)
+        if count == 0:
+            return np.full(np.shape(q), np.nan) if np.ndim(q) else np.nan
+        results = []
+        for p in np.atleast_1d(q):
+            index = p * (count - 1)
+            lower = int(np.floor(index))
+            values = np.array([self._kth(runs, lower), self._kth(runs, min(lower + 1, count - 1))])
+            # numpy's own interpolation between the two neighbouring order statistics
+            results.append(np.quantile(values, index - lower))
+        return np.array(results) if np.ndim(q) else results[0]
+
+    def median(self):
+        '''
+        The median of the values, as pandas.Series.median.
+        '''
+        if self.count == 0:
+            return np.nan
+        middle = [self._kth(self.runs, (self.count - 1) // 2), self._kth(self.runs, self.count // 2)]
+        return np.median(middle)
